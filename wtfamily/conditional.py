@@ -0,0 +1,118 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+Conditional HTTP responses.
+
+The data only changes when it is imported, so the validators of a response
+(`ETag` and `Last-Modified`) are derived from the version of the database
+generation being served (see `DatabaseGenerations.get_version()`) and the
+request URL.  A request with matching `If-None-Match` or
+`If-Modified-Since` headers is answered with ``304 Not Modified`` before
+the view is called.
+
+The code, templates and static files (the "build") are part of the
+validators as well, so that a deploy changing e.g. the shape of the JSON is
+not hidden from the clients until the next import.
+
+Views whose responses do not depend on the data alone (e.g. the status of
+import jobs) opt out by setting ``Cache-Control: no-store``; the clients
+never get the validators for them and so never make them conditional.
+"""
+import datetime
+import functools
+import hashlib
+import os
+
+
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+# not part of the build
+IGNORED_DIRS = ('__pycache__', 'tests')
+IGNORED_SUFFIXES = ('.pyc', '.pyo')
+
+
+@functools.lru_cache()
+def get_build(root):
+    """
+    Returns the version of the files under given directory and the time the
+    newest of them was last modified (naive UTC, like the dates in MongoDB).
+    Only the file metadata is looked at, so this is cheap; it is computed
+    once per process anyway.
+    """
+    digest = hashlib.sha1()
+    modified = 0
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(x for x in dir_names if x not in IGNORED_DIRS)
+        for file_name in sorted(file_names):
+            if file_name.endswith(IGNORED_SUFFIXES):
+                continue
+            path = os.path.join(dir_path, file_name)
+            stat = os.stat(path)
+            digest.update('{} {} {}\n'.format(
+                os.path.relpath(path, root), stat.st_size,
+                stat.st_mtime_ns).encode('utf-8'))
+            modified = max(modified, stat.st_mtime)
+    return (digest.hexdigest(),
+            datetime.datetime.utcfromtimestamp(int(modified)))
+
+
+def make_etag(db_name, revision, request, build=''):
+    """
+    Returns a (strong) entity tag for the response to given request made
+    against given revision of the database by given build of the app (see
+    `get_build()`).
+    """
+    key = '\n'.join([build, db_name, str(revision), request.full_path])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """
+    Returns `True` if the client already has the response with given
+    validators.  As per RFC 7232, `If-Modified-Since` is ignored if
+    `If-None-Match` is given.
+    """
+    if request.method not in CONDITIONAL_METHODS:
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since:
+        return request.if_modified_since >= _to_http_precision(last_modified)
+    return False
+
+
+def set_validators(response, etag, last_modified=None):
+    """
+    Adds the validators to given response unless it opted out (or has its
+    own, like static files).
+    """
+    if response.status_code not in (200, 304):
+        return response
+    if response.cache_control.no_store or 'ETag' in response.headers:
+        return response
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _to_http_precision(last_modified)
+    return response
+
+
+def _to_http_precision(value):
+    # MongoDB returns naive UTC datetimes; HTTP dates have no fractions
+    return value.replace(microsecond=0, tzinfo=datetime.timezone.utc)
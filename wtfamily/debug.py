@@ -25,6 +25,7 @@ from confu import Configurable
 from pymongo.database import Database
 
 # local
+from generations import DatabaseGenerations
 import models
 
 
@@ -57,7 +58,8 @@ class WTFamilyDebug(Configurable):
                 importlib.reload(m)
 
             if not db:
-                db = self.mongo_db
+                db = DatabaseGenerations(self.mongo_db.client,
+                                         self.mongo_db.name).get_current()
 
             # monkey-patch to avoid flask.g
             models.Entity._get_database = lambda: db
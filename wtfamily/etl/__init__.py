@@ -16,15 +16,27 @@
 #
 #    You should have received a copy of the GNU Lesser General Public License
 #    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import gzip
+import os
+import sys
+import tempfile
+
 import argh
 from confu import Configurable
 from pymongo import MongoClient
 
-from .mongo_to_gramps_xml import export_to_xml
-from .gramps_xml_to_mongo import import_from_xml
+from generations import DatabaseGenerations
+from indexes import ensure_indexes, find_collection_scans
+from .mongo_to_gramps_xml import (export_to_xml, export_to_file,
+                                  export_to_gzip_file)
+from .gramps_xml_to_mongo import (import_from_xml, get_checksum,
+                                  ImportProgress, DEFAULT_BATCH_SIZE)
+from .benchmark import run_benchmark, measure, write_report
+from .synthetic import write_gramps_xml, DEFAULT_PEOPLE, DEFAULT_SEED
 
 
 MONGO_DB_NAME = 'wtfamily-from-grampsxml'
+BENCHMARK_DB_NAME = 'wtfamily-benchmark'
 
 
 class WTFamilyETL(Configurable):
@@ -34,33 +46,261 @@ class WTFamilyETL(Configurable):
     }
 
     def import_gramps_xml(self, path=None, db_name=MONGO_DB_NAME,
-                          replace=False):
+                          stream=False, batch_size=DEFAULT_BATCH_SIZE,
+                          workers=1, incremental=False, delete_missing=False,
+                          no_switch=False):
+        """
+        Imports given Gramps XML file (plain or gzipped) into MongoDB.
+        With `--stream`, the file is parsed item by item instead of being
+        loaded at once; this is slower but memory usage stays flat.
+        Documents are inserted `--batch-size` at a time.
+        With `--workers N`, items are translated by N processes.
 
-        if db_name in self.mongo_client.database_names():
-            if replace or argh.confirm('DROP and replace existing DB "{}"'
-                                       .format(db_name)):
-                self.mongo_client.drop_database(db_name)
-            else:
-                yield 'Not replacing the existing database.'
-                return
-        else:
-            yield 'Importing into a new DB "{}"'.format(db_name)
+        The data is imported into a new generation of the database (see
+        `generations`) and the web app is switched to it once the import is
+        complete, unless `--no-switch` is given.  The previous generation is
+        kept for `rollback-import`.
+
+        With `--incremental`, the current generation is updated in place
+        instead: only new and changed items (by `handle` and `change`) are
+        written, and with `--delete-missing` the items not found in the file
+        are deleted.
+        """
+        return self.run_import(path, db_name, stream=stream,
+                               batch_size=batch_size, workers=workers,
+                               incremental=incremental,
+                               delete_missing=delete_missing,
+                               no_switch=no_switch)
+
+    def run_import(self, path=None, db_name=MONGO_DB_NAME, progress=None,
+                   incremental=False, delete_missing=False, no_switch=False,
+                   checksum=None, **options):
+        """
+        Same as `import_gramps_xml()` but also reports the progress to given
+        `ImportProgress` object (e.g. for a background job).  The `checksum`
+        of the file is computed unless it's given (e.g. for an upload).
+        """
+        generations = DatabaseGenerations(self.mongo_client, db_name)
+        progress = progress or ImportProgress()
+
+        path = path or self.gramps_xml_path
+        checksum = checksum or get_checksum(path)
+
+        options.update(progress=progress)
+
+        if incremental:
+            db = generations.get_current()
+            yield 'Updating the DB "{}"'.format(db.name)
+            import_from_xml(path, db, incremental=True,
+                            delete_missing=delete_missing, **options)
+            generations.touch(db.name)
+            generations.update(db.name, checksum=checksum)
+            return
+
+        db = generations.create(checksum=checksum)
+        yield 'Importing into a new DB "{}"'.format(db.name)
+
+        try:
+            import_from_xml(path, db, **options)
+        except BaseException:
+            generations.mark_failed(db.name)
+            raise
 
-        db = self.mongo_client[db_name]
+        generations.touch(db.name)
 
-        return import_from_xml(path or self.gramps_xml_path, db)
+        if no_switch:
+            yield 'Not switching to the new DB.'
+            return
+
+        progress.set_phase('switching')
+        generations.switch(db.name)
+        yield 'Switched to the new DB "{}"'.format(db.name)
+
+    def get_current_checksum(self, db_name=MONGO_DB_NAME):
+        """
+        Returns the checksum of the file imported into the current generation
+        of the database (if known).
+        """
+        generation = DatabaseGenerations(self.mongo_client,
+                                         db_name).find_current()
+        return generation.get('checksum') if generation else None
+
+    def rollback_import(self, db_name=MONGO_DB_NAME):
+        """
+        Switches back to the previous generation of the database.
+        """
+        name = DatabaseGenerations(self.mongo_client, db_name).rollback()
+        yield 'Switched to the DB "{}"'.format(name)
+
+    def switch_generation(self, name, db_name=MONGO_DB_NAME):
+        """
+        Switches to given generation of the database (see `generations`).
+        """
+        DatabaseGenerations(self.mongo_client, db_name).switch(name)
+        yield 'Switched to the DB "{}"'.format(name)
+
+    def generations(self, db_name=MONGO_DB_NAME):
+        """
+        Lists the generations of the database, newest first.
+        """
+        generations = DatabaseGenerations(self.mongo_client, db_name)
+        current = generations.get_current_name()
+        for generation in generations.find():
+            yield '{} {} {:%Y-%m-%d %H:%M:%S} {}'.format(
+                '*' if generation['_id'] == current else ' ',
+                generation['_id'], generation['created'],
+                generation['status'])
+
+    def collect_garbage(self, db_name=MONGO_DB_NAME, keep=1,
+                        include_staging=False):
+        """
+        Drops old generations of the database, keeping the current one and
+        `--keep` previous ones.  Unfinished imports are only dropped with
+        `--include-staging` (make sure that none is in progress).
+        """
+        generations = DatabaseGenerations(self.mongo_client, db_name)
+        dropped = generations.collect_garbage(keep=keep,
+                                              include_staging=include_staging)
+        for name in dropped:
+            yield 'Dropped "{}"'.format(name)
+        if not dropped:
+            yield 'Nothing to drop.'
+
+    def get_current_db(self, db_name=MONGO_DB_NAME):
+        return DatabaseGenerations(self.mongo_client, db_name).get_current()
 
     def export_gramps_xml(self, path=None, db_name=MONGO_DB_NAME,
                           replace=False):
-        db = self.mongo_client[db_name]
+        """
+        Exports the database to a gzip-compressed Gramps XML file at `path`.
+        Without `path`, plain XML is written to stdout.
+        """
+        db = self.get_current_db(db_name)
+
+        if not path:
+            export_to_file(db, sys.stdout)
+            return
+
+        if os.path.exists(path):
+            if not (replace or argh.confirm('Overwrite existing file "{}"'
+                                            .format(path))):
+                yield 'Not replacing the existing file.'
+                return
+
+        export_to_gzip_file(db, path)
+
+        yield 'Exported to {}'.format(path)
+
+    def iter_gramps_xml(self, db_name=MONGO_DB_NAME):
+        """
+        Returns a generator of Gramps XML chunks (e.g. for a streaming
+        response).
+        """
+        db = self.get_current_db(db_name)
 
-        # TODO: either compress and save to file,
-        #       or remove the `path` and `replace` args
         return export_to_xml(db)
 
+    def ensure_indexes(self, db_name=MONGO_DB_NAME, check=False):
+        """
+        Creates the indexes needed by the models (the import does this, too).
+        With `--check`, reports sample queries that still scan a collection.
+        """
+        db = self.get_current_db(db_name)
+
+        ensure_indexes(db)
+
+        if not check:
+            return
+
+        unindexed = find_collection_scans(db)
+        for model, conditions in unindexed:
+            yield 'COLLSCAN: {} {}'.format(model.entity_name, conditions)
+        if not unindexed:
+            yield 'All sample queries use indexes.'
+
+    def generate_gramps_xml(self, path, people=DEFAULT_PEOPLE,
+                            seed=DEFAULT_SEED, replace=False):
+        """
+        Writes a synthetic Gramps XML file with given number of people (see
+        `etl.synthetic`).  The file is gzipped if the name ends with
+        ".gramps" or ".gz".
+        """
+        if os.path.exists(path):
+            if not (replace or argh.confirm('Overwrite existing file "{}"'
+                                            .format(path))):
+                yield 'Not replacing the existing file.'
+                return
+
+        _open = gzip.open if path.endswith(('.gramps', '.gz')) else open
+        with _open(path, 'wb') as f:
+            tree = write_gramps_xml(f, people=people, seed=seed)
+
+        yield 'Generated {} people in {} families at {}'.format(
+            len(tree), len(tree.fathers), path)
+
+    def benchmark(self, path=None, people=DEFAULT_PEOPLE, seed=DEFAULT_SEED,
+                  output='benchmark.json', db_name=BENCHMARK_DB_NAME,
+                  batch_size=DEFAULT_BATCH_SIZE, workers=1):
+        """
+        Times the ETL phases (extract, transform, load, build_xml,
+        export_to_xml and the round trip) on given Gramps XML file and writes
+        the throughput and peak memory usage of each phase as JSON to
+        `output`.  Without `path`, a synthetic file with `--people` people
+        is generated.
+
+        The database `db_name` (and a second one for the round trip) is
+        dropped before and after the benchmark.
+        """
+        round_trip_db_name = db_name + '-round-trip'
+        for name in (db_name, round_trip_db_name):
+            self.mongo_client.drop_database(name)
+
+        phases = []
+        info = {'workers': workers, 'batch_size': batch_size}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            if path:
+                info['path'] = path
+            else:
+                path = os.path.join(tmp_dir, 'synthetic.xml')
+                info.update(people=people, seed=seed)
+
+                def _generate():
+                    with open(path, 'wb') as f:
+                        return len(write_gramps_xml(f, people=people,
+                                                    seed=seed))
+
+                measure(phases, 'generate', _generate, count=lambda x: x)
+
+            info['size'] = os.path.getsize(path)
+
+            try:
+                phases.extend(run_benchmark(
+                    path, self.mongo_client[db_name],
+                    self.mongo_client[round_trip_db_name],
+                    batch_size=batch_size, workers=workers))
+            finally:
+                for name in (db_name, round_trip_db_name):
+                    self.mongo_client.drop_database(name)
+
+        with open(output, 'w') as f:
+            write_report(f, phases, **info)
+
+        for phase in phases:
+            yield '{name:>15}: {seconds:>9.3f} s {peak_rss_kb:>10} KB'.format(
+                **phase)
+        yield 'Written to {}'.format(output)
+
     @property
     def commands(self):
         return [
             self.import_gramps_xml,
-            self.export_gramps_xml
+            self.rollback_import,
+            self.switch_generation,
+            self.generations,
+            self.collect_garbage,
+            self.export_gramps_xml,
+            self.ensure_indexes,
+            self.generate_gramps_xml,
+            self.benchmark,
         ]
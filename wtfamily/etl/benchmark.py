@@ -0,0 +1,195 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+Benchmark of the ETL phases.
+
+Each phase is timed separately and its throughput and peak memory usage
+(resident set size) are recorded.  The report is a JSON document, so results
+of different runs (or commits) can be compared by a script.
+
+The peak RSS is measured per phase on Linux (the high-water mark is reset
+before each phase); elsewhere it is the peak of the whole process so far.
+"""
+import datetime
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+from lxml import etree
+
+from indexes import ensure_indexes
+from .gramps_xml_to_mongo import (extract, transform, load,
+                                  denormalize_parent_ids,
+                                  denormalize_search_tokens,
+                                  denormalize_phonetic_codes, import_from_xml,
+                                  MODELS, DEFAULT_BATCH_SIZE)
+from .mongo_to_gramps_xml import build_xml, export_to_xml
+
+
+def run_benchmark(path, db, round_trip_db, batch_size=DEFAULT_BATCH_SIZE,
+                  workers=1):
+    """
+    Imports given Gramps XML file into `db`, exports it back and imports
+    the result into `round_trip_db`.  Both databases are expected to be
+    empty.  Returns the list of phases (see `measure()`).
+    """
+    phases = []
+
+    xml_root_el = measure(phases, 'extract', lambda: extract(path),
+                          count=_count_items,
+                          size=os.path.getsize(path))
+
+    items = measure(phases, 'transform',
+                    lambda: list(transform(xml_root_el, workers=workers)),
+                    count=len)
+    del xml_root_el
+
+    def _load():
+        load(items, db, batch_size=batch_size)
+        ensure_indexes(db)
+        denormalize_parent_ids(db)
+        denormalize_search_tokens(db, batch_size=batch_size)
+        denormalize_phonetic_codes(db, batch_size=batch_size)
+        return len(items)
+
+    measure(phases, 'load', _load, count=lambda x: x)
+    del items
+
+    measure(phases, 'build_xml', lambda: build_xml(db), count=_count_items)
+
+    fd, export_path = tempfile.mkstemp(suffix='.xml')
+    os.close(fd)
+
+    def _export():
+        with open(export_path, 'w', encoding='utf-8') as f:
+            for chunk in export_to_xml(db):
+                f.write(chunk)
+
+    def _round_trip():
+        import_from_xml(export_path, round_trip_db, stream=True,
+                        batch_size=batch_size, workers=workers)
+        return _count_documents(round_trip_db)
+
+    try:
+        measure(phases, 'export_to_xml', _export,
+                count=lambda _: _count_documents(db))
+        measure(phases, 'round_trip', _round_trip, count=lambda x: x,
+                size=os.path.getsize(export_path))
+    finally:
+        os.remove(export_path)
+
+    # the export must not lose anything
+    expected = _count_documents(db, by_model=True)
+    actual = _count_documents(round_trip_db, by_model=True)
+    phases[-1]['consistent'] = expected == actual
+
+    return phases
+
+
+def measure(phases, name, func, count=None, size=None):
+    """
+    Calls `func` and appends a dictionary with the measurements to `phases`.
+    Returns whatever `func` returned.
+
+    :param count: Function which returns the number of processed items
+        given the result of `func`.
+    :param size: Number of processed bytes (if it makes sense).
+    """
+    print('Benchmarking {} ...'.format(name))
+
+    _reset_peak_rss()
+    started = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - started
+
+    phase = {
+        'name': name,
+        'seconds': round(seconds, 3),
+        'peak_rss_kb': _get_peak_rss(),
+    }
+    if count:
+        phase['items'] = count(result)
+        phase['items_per_second'] = round(phase['items'] / seconds, 1)
+    if size:
+        phase['bytes'] = size
+        phase['bytes_per_second'] = round(size / seconds)
+
+    phases.append(phase)
+
+    return result
+
+
+def write_report(f, phases, **info):
+    """
+    Writes the benchmark results as JSON to given text file object.
+    Extra keyword arguments (e.g. the number of people) are included as is.
+    """
+    report = dict(info,
+                  created=datetime.datetime.now().isoformat(),
+                  python=platform.python_version(),
+                  platform=platform.platform(),
+                  phases=phases)
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.write('\n')
+
+
+def _count_items(xml_root_el):
+    return sum(len(group_el) for group_el in xml_root_el
+               if etree.QName(group_el).localname != 'header')
+
+
+def _count_documents(db, by_model=False):
+    counts = dict((model.entity_name,
+                   db[model.entity_name].count_documents({}))
+                  for model in MODELS)
+    if by_model:
+        return counts
+    return sum(counts.values())
+
+
+def _reset_peak_rss():
+    # see "/proc/[pid]/clear_refs" in proc(5); Linux 4.0+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _get_peak_rss():
+    """
+    Returns the peak resident set size in kilobytes.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes instead of kilobytes
+        peak //= 1024
+    return peak
@@ -22,17 +22,32 @@
 Converter of (un)compressed Gramps XML to WTFamily MongoDB.
 """
 import binascii
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 import datetime
+import functools
 import gzip
+import hashlib
+import threading
+import zlib
 # NOTE: not bundled with Python but separate library; it can pretty-print.
 from lxml import etree
 import pprint
 
+import bson
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from indexes import ensure_indexes
+from kinship import KinshipGraph
 from models import (Entity, Person, Family, Event, Citation, Source, Place,
                     Repository, MediaObject, Note, Bookmark, NameMap,
-                    NameFormat)
+                    NameFormat, _make_projection)
 
+from phonetic import make_phonetic_codes
+from search import make_search_tokens
 import etl.translators as s
+from etl.translators.generic import normalize_attr_value
 
 
 WTFAMILY_APP_NAME = 'WTFamily'
@@ -40,23 +55,129 @@ GRAMPS_XML_VERSION_TUPLE = (1, 7, 1) # version for Gramps 4.2
 GRAMPS_XML_VERSION = '.'.join(str(i) for i in GRAMPS_XML_VERSION_TUPLE)
 GRAMPS_URL_HOMEPAGE = "http://gramps-project.org/"
 
+# documents per `insert_many()` call
+DEFAULT_BATCH_SIZE = 1000
+
+# items per task sent to a worker process (with `workers` > 1)
+CHUNK_SIZE = 200
+
+# bytes read at a time when computing checksums
+READ_SIZE = 64 * 1024
+
+
+# NOTE: this largerly mirrors/copies the import code; can we unify them?
+MODEL_TO_TAG = {
+    Person: ('people', 'person', s.PersonTranslator),
+    Family: ('families', 'family', s.FamilyTranslator),
+    Event: ('events', 'event', s.EventTranslator),
+    Source: ('sources', 'source', s.SourceTranslator),
+    Place: ('places', 'placeobj', s.PlaceTranslator),
+    MediaObject: ('objects', 'object', s.MediaObjectTranslator),
+    Repository: ('repositories', 'repository', s.RepositoryTranslator),
+    Note: ('notes', 'note', s.NoteTranslator),
+    # TODO: Tag: ('tags', 'tag', s.TagTranslator),
+    Citation: ('citations', 'citation', s.CitationTranslator),
+    Bookmark: ('bookmarks', 'bookmark', s.BookmarkTranslator),
+    NameMap: ('namemaps', 'map', s.NameMapTranslator),
+    NameFormat: ('name-formats', 'format', s.NameFormatTranslator),
+}
+MODELS = (Person, Family, NameFormat, Event, Citation, Source, Place,
+          Repository, MediaObject, Note, Bookmark, NameMap)
+
+# (group tag, item tag) → model
+TAGS_TO_MODEL = dict(((group_tag, item_tag), model)
+                     for model, (group_tag, item_tag, _)
+                     in MODEL_TO_TAG.items())
+
+# what identifies the items without handles (see `StoredChanges`)
+NATURAL_KEYS = {
+    Bookmark: ('target', 'hlink'),
+    NameMap: ('type', 'key'),
+    NameFormat: ('number',),
+}
+
 
 def extract(path):
     print('Extracting from {} ...'.format(path))
 
+    with _open_xml(path) as f:
+        xml_root_el = etree.fromstring(f.read())
+
+    return xml_root_el
+
+
+def spool_chunks(chunks, f):
+    """
+    Writes the (plain or gzipped) XML coming in an iterable of byte strings
+    (e.g. an upload being received) to given file as is, to be imported with
+    `extract_and_transform_iteratively()`.  Raises `ValueError` or
+    `etree.XMLSyntaxError` if it's not well-formed XML.  Only the current
+    element is kept in memory while checking that.
+    """
+    print('Spooling a stream ...')
+
+    parser = etree.XMLPullParser(events=('end',))
+    decompressor = None
+
+    def _feed(data):
+        parser.feed(data)
+        # same as in `_iterate_items()`
+        for _, elem in parser.read_events():
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    # the first bytes tell whether the data is compressed
+    head = b''
+    for chunk in chunks:
+        f.write(chunk)
+
+        if head is not None:
+            head += chunk
+            if len(head) < 5:
+                continue
+            if head.startswith(b'\x1f\x8b'):
+                # gzip header and trailer, see zlib docs
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif not head.startswith(b'<?xml'):
+                raise ValueError('The data is neither plain nor gzipped XML')
+            chunk, head = head, None
+
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+        _feed(chunk)
+
+    if head is not None:
+        raise ValueError('The data is neither plain nor gzipped XML')
+
+    if decompressor:
+        _feed(decompressor.flush())
+
+    parser.close()
+
+
+def get_checksum(path):
+    """
+    Returns the SHA-256 hex digest of given file (to tell if it has already
+    been imported).
+    """
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(functools.partial(f.read, READ_SIZE), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def _open_xml(path):
     if _is_gzip_file(path):
-        opener = gzip.open
+        # decompresses on the fly as the file is being read
+        return gzip.open(path)
     elif _is_plain_xml_file(path):
-        opener = lambda x: open(x, 'rb')
+        return open(path, 'rb')
     else:
         raise ValueError('File {} is neither a plain nor a gzipped XML file'
                          .format(path))
 
-    with opener(path) as f:
-        xml_root_el = etree.fromstring(f.read())
-
-    return xml_root_el
-
 
 def _is_gzip_file(path):
     with open(path, 'rb') as f:
@@ -68,26 +189,7 @@ def _is_plain_xml_file(path):
         return f.read(5) == '<?xml'
 
 
-def transform(xml_root_el):
-    # NOTE: this largerly mirrors/copies the import code; can we unify them?
-    model_to_tag = {
-        Person: ('people', 'person', s.PersonTranslator),
-        Family: ('families', 'family', s.FamilyTranslator),
-        Event: ('events', 'event', s.EventTranslator),
-        Source: ('sources', 'source', s.SourceTranslator),
-        Place: ('places', 'placeobj', s.PlaceTranslator),
-        MediaObject: ('objects', 'object', s.MediaObjectTranslator),
-        Repository: ('repositories', 'repository', s.RepositoryTranslator),
-        Note: ('notes', 'note', s.NoteTranslator),
-        # TODO: Tag: ('tags', 'tag', s.TagTranslator),
-        Citation: ('citations', 'citation', s.CitationTranslator),
-        Bookmark: ('bookmarks', 'bookmark', s.BookmarkTranslator),
-        NameMap: ('namemaps', 'map', s.NameMapTranslator),
-        NameFormat: ('name-formats', 'format', s.NameFormatTranslator),
-    }
-    models = (Person, Family, NameFormat, Event, Citation, Source, Place,
-              Repository, MediaObject, Note, Bookmark, NameMap)
-
+def transform(xml_root_el, workers=1, skip=None):
     # Gather the mappings of internal Gramps IDs ("handles") to "public" IDs.
     handle_to_id = {}
     for el in xml_root_el.findall('.//*[@handle]'):
@@ -99,48 +201,581 @@ def transform(xml_root_el):
     def _qn(name):
         return etree.QName(xml_root_el, name).text
 
+    def _find_items():
+        for model in MODELS:
+            print('  * {}'.format(model.__name__))
+            group_tag, item_tag, _ = MODEL_TO_TAG[model]
+            search_expr = '{}/{}'.format(_qn(group_tag), _qn(item_tag))
+
+            for elem in xml_root_el.findall(search_expr):
+                if not (skip and skip(elem, model)):
+                    yield elem, model
+
     # Now that we have the full mapping, proceed to extract and transform tags
-    for model in models:
-        print('  * {}'.format(model.__name__))
-        group_tag, item_tag, ItemTranslator = model_to_tag[model]
-        search_expr = '{}/{}'.format(_qn(group_tag), _qn(item_tag))
-        elems = xml_root_el.findall(search_expr)
+    return _translate_items(_find_items(), handle_to_id, workers)
+
+
+def extract_and_transform_iteratively(path, workers=1, skip=None):
+    """
+    Same as `transform(extract(path))` but never holds the whole document in
+    memory, so memory usage does not depend on the size of the file.
+
+    The file is read twice: first to gather the handles (only the top-level
+    items have them), then to translate the items one by one.  Items are
+    yielded in the document order.
+
+    `skip` is an optional function which takes an element and its model and
+    returns `True` if the element should not be translated (same for
+    `transform()`).
+    """
+    print('Extracting handles from {} ...'.format(path))
+
+    handle_to_id = {}
+    for elem in _iterate_items(path):
+        item_handle = elem.get('handle')
+        if item_handle:
+            handle_to_id[item_handle] = elem.get('id')
+
+    print('Extracting and transforming items from {} ...'.format(path))
+
+    def _find_items():
+        model = None
+        for elem in _iterate_items(path):
+            tags = (etree.QName(elem.getparent()).localname,
+                    etree.QName(elem).localname)
+            if tags not in TAGS_TO_MODEL:
+                continue
+
+            if TAGS_TO_MODEL[tags] != model:
+                model = TAGS_TO_MODEL[tags]
+                print('  * {}'.format(model.__name__))
+
+            if not (skip and skip(elem, model)):
+                yield elem, model
+
+    return _translate_items(_find_items(), handle_to_id, workers)
+
+
+def _iterate_items(path):
+    """
+    Yields the top-level items (e.g. ``<people><person>``) one by one.
+    Each item is removed from the tree as soon as the next one is requested,
+    so only the current item is kept in memory.
+    """
+    depth = 0
+    with _open_xml(path) as f:
+        for event, elem in etree.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+
+            depth -= 1
+
+            # root → group → item
+            if depth == 2:
+                yield elem
+
+                elem.clear()
+                # the parent still refers to the processed siblings
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+
+def _translate_items(items, handle_to_id, workers=1):
+    """
+    Translates `(elem, model)` pairs and yields `(elem, model, data)`.
+
+    With multiple workers, the elements are serialized and sent in chunks to
+    a pool of processes; the order of items is preserved.  The yielded
+    `elem` is then the serialized XML.
+    """
+    if workers <= 1:
+        for elem, model in items:
+            yield elem, model, _translate(elem, model, handle_to_id)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(handle_to_id,)) as executor:
+        pending = deque()
+        for model, chunk in _chunk_items(items):
+            future = executor.submit(_translate_chunk, model, chunk)
+            pending.append((model, chunk, future))
+
+            # keep the workers busy but don't read too far ahead
+            if len(pending) > workers * 2:
+                yield from _get_chunk_results(*pending.popleft())
+
+        while pending:
+            yield from _get_chunk_results(*pending.popleft())
+
+
+def _chunk_items(items, size=CHUNK_SIZE):
+    """
+    Groups `(elem, model)` pairs into `(model, [serialized_elem, ...])`.
+    """
+    chunk_model = None
+    chunk = []
+    for elem, model in items:
+        if chunk and (model != chunk_model or len(chunk) >= size):
+            yield chunk_model, chunk
+            chunk = []
+        chunk_model = model
+        chunk.append(etree.tostring(elem))
+
+    if chunk:
+        yield chunk_model, chunk
+
+
+def _get_chunk_results(model, chunk, future):
+    for elem_xml, data in zip(chunk, future.result()):
+        yield elem_xml, model, data
+
+
+# the mapping is sent to each worker process once, not with every chunk
+_worker_handle_to_id = None
+
+
+def _init_worker(handle_to_id):
+    global _worker_handle_to_id
+    _worker_handle_to_id = handle_to_id
+
+
+def _translate_chunk(model, chunk):
+    return [_translate(etree.fromstring(x), model, _worker_handle_to_id)
+            for x in chunk]
+
+
+def _translate(elem, model, handle_to_id):
+    _, _, ItemTranslator = MODEL_TO_TAG[model]
+    translator = ItemTranslator()
+    try:
+        return translator.from_xml(elem, handle_to_id=handle_to_id)
+    except Exception as e:
+        tag_ln = etree.QName(elem.tag).localname
+        print('=====================================================')
+        print()
+        print('ERROR transforming (deserializing) {} tag:'.format(tag_ln))
+        print(etree.tostring(elem, encoding='unicode', pretty_print=True))
+
+        raise e
+
+
+def load(items, db, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Validates the documents and inserts them in batches (one per collection).
+    Returns the number of inserted documents by model.
+    """
+    requests = ((elem, model, data, InsertOne(data))
+                for elem, model, data in items)
+    return _write_in_batches(requests, db, batch_size)
+
 
-        for elem in elems:
-            translator = ItemTranslator()
-            try:
-                data = translator.from_xml(elem, handle_to_id=handle_to_id)
-            except Exception as e:
-                tag_ln = etree.QName(elem.tag).localname
-                print('=====================================================')
-                print()
-                print('ERROR transforming (deserializing) {} tag:'.format(tag_ln))
-                print(etree.tostring(elem, encoding='unicode', pretty_print=True))
+def verify_counts(db, counts):
+    """
+    Makes sure that the collections contain exactly given numbers of
+    documents (by model), e.g. that nothing was lost during a fresh import.
+    """
+    print('Verifying document counts ...')
 
-                raise e
+    mismatches = []
+    for model in MODELS:
+        found = db[model.entity_name].count_documents({})
+        if found != counts[model]:
+            mismatches.append('{}: {} instead of {}'.format(
+                model.entity_name, found, counts[model]))
 
-            yield elem, model, data
+    if mismatches:
+        raise ValueError('Unexpected document counts in {}: {}'.format(
+            db.name, ', '.join(mismatches)))
 
 
-def load(items, db):
-    for elem, model, data in items:
-        # TODO: can we avoid repeating this?
-        model._get_database = lambda: db
+def load_incrementally(items, db, stored, batch_size=DEFAULT_BATCH_SIZE,
+                       delete_missing=False):
+    """
+    Inserts new documents and replaces changed ones (the unchanged ones
+    are expected to be filtered out by `stored.is_unchanged()` before they
+    are even translated).  Optionally deletes the documents which were not
+    found in the imported file.  Prints a summary.
 
+    :param stored: `StoredChanges` for given database.
+    """
+    counts = defaultdict(Counter)
+
+    def _get_requests():
+        for elem, model, data in items:
+            handle = data.get('handle')
+            if handle:
+                stored.seen_handles[model].add(handle)
+                if stored.is_new(model, handle):
+                    action = 'inserted'
+                else:
+                    action = 'updated'
+                request = ReplaceOne({'handle': handle}, data, upsert=True)
+            else:
+                # items without handles (e.g. name maps) are looked up by
+                # their natural keys and compared as is
+                pk, is_same = stored.find_same(model, data)
+                if is_same:
+                    counts[model]['unchanged'] += 1
+                    continue
+                elif pk is None:
+                    action = 'inserted'
+                    request = InsertOne(data)
+                else:
+                    action = 'updated'
+                    request = ReplaceOne({'_id': pk}, data)
+
+            counts[model][action] += 1
+            yield elem, model, data, request
+
+    _write_in_batches(_get_requests(), db, batch_size)
+
+    for model in MODELS:
+        counts[model]['unchanged'] += stored.unchanged[model]
+
+        if delete_missing:
+            collection = db[model.entity_name]
+            handles = list(stored.get_missing_handles(model))
+            if handles:
+                collection.delete_many({'handle': {'$in': handles}})
+            pks = list(stored.get_missing_pks(model))
+            if pks:
+                collection.delete_many({'_id': {'$in': pks}})
+            counts[model]['deleted'] = len(handles) + len(pks)
+
+    print('Summary:')
+    for model in MODELS:
+        if not any(counts[model].values()):
+            continue
+        print('  * {}: {}'.format(model.entity_name, ', '.join(
+            '{} {}'.format(counts[model][action], action)
+            for action in ('inserted', 'updated', 'deleted', 'unchanged'))))
+
+
+class StoredChanges:
+    """
+    What is already stored in the database: the `change` timestamps of items
+    (by handle) and the contents of the items without handles (by their
+    `NATURAL_KEYS`).  Used by the incremental import to skip the unchanged
+    items and to find the ones missing from the imported file.
+    """
+    def __init__(self, db):
+        self.db = db
+        self._changes = {}
+        self._contents = {}
+
+        # what was found in the imported file
+        self.seen_handles = defaultdict(set)
+        self.seen_pks = defaultdict(set)
+        self.unchanged = Counter()
+
+    def get_changes(self, model):
+        if model not in self._changes:
+            docs = self.db[model.entity_name].find(
+                {'handle': {'$exists': True}},
+                projection={'_id': False, 'handle': True, 'change': True})
+            self._changes[model] = dict((x['handle'], x.get('change'))
+                                        for x in docs)
+        return self._changes[model]
+
+    def get_contents(self, model):
+        if model not in self._contents:
+            docs = self.db[model.entity_name].find(
+                {'handle': {'$exists': False}})
+            self._contents[model] = dict(
+                (self._get_natural_key(model, x),
+                 (x['_id'], self._get_content_key(x)))
+                for x in docs)
+        return self._contents[model]
+
+    def is_unchanged(self, elem, model):
+        handle = elem.get('handle')
+        if not handle:
+            return False
+
+        self.seen_handles[model].add(handle)
+
+        changes = self.get_changes(model)
+        if handle not in changes:
+            return False
+
+        change = normalize_attr_value(elem.get('change'), datetime.datetime)
+        if changes[handle] != change:
+            return False
+
+        self.unchanged[model] += 1
+        return True
+
+    def is_new(self, model, handle):
+        return handle not in self.get_changes(model)
+
+    def find_same(self, model, data):
+        """
+        Returns the `_id` of the stored item without handle which has the
+        same natural key as given data (or `None`) and whether its content
+        is the same too.
+        """
+        known = self.get_contents(model).get(
+            self._get_natural_key(model, data))
+        if known is None:
+            return None, False
+        pk, content_key = known
+        self.seen_pks[model].add(pk)
+        return pk, content_key == self._get_content_key(data)
+
+    def get_missing_handles(self, model):
+        return set(self.get_changes(model)) - self.seen_handles[model]
+
+    def get_missing_pks(self, model):
+        pks = set(pk for pk, _ in self.get_contents(model).values())
+        return pks - self.seen_pks[model]
+
+    @classmethod
+    def _get_natural_key(cls, model, data):
+        if model not in NATURAL_KEYS:
+            return cls._get_content_key(data)
+        return tuple(data.get(k) for k in NATURAL_KEYS[model])
+
+    @staticmethod
+    def _get_content_key(data):
+        # the translators always produce the keys in the same order, and
+        # MongoDB preserves it
+        return bson.encode(dict((k, v) for k, v in data.items() if k != '_id'))
+
+
+def _write_in_batches(requests, db, batch_size):
+    """
+    Validates the documents and writes them in batches (one per collection).
+    Returns the number of written documents by model.
+
+    :param requests: Iterable of `(elem, model, data, request)` tuples.
+    """
+    batches = {}
+    counts = Counter()
+
+    for elem, model, data, request in requests:
         try:
-            model(data).save()
+            model.validate_data(data)
         except Exception as e:
-            tag_ln = etree.QName(elem.tag).localname
-            print('=====================================================')
-            print()
-            print('ERROR loading (validating and saving) {} tag:'.format(tag_ln))
-            print(etree.tostring(elem, encoding='unicode', pretty_print=True))
-            pprint.pprint(data)
-
+            _report_load_error('validating', elem, data)
             raise e
 
+        batch = batches.setdefault(model, [])
+        batch.append((elem, data, request))
+        counts[model] += 1
+
+        if len(batch) >= batch_size:
+            _write_batch(model, batch, db)
+            batches[model] = []
+
+    for model, batch in batches.items():
+        if batch:
+            _write_batch(model, batch, db)
+
+    return counts
+
+
+def _write_batch(model, batch, db):
+    try:
+        db[model.entity_name].bulk_write([r for _, _, r in batch],
+                                         ordered=False)
+    except BulkWriteError as e:
+        # NOTE: in the streaming mode the elements have already been cleared
+        for error in e.details['writeErrors']:
+            elem, data, _ = batch[error['index']]
+            _report_load_error('saving', elem, data)
+            print(error['errmsg'])
+        raise e
+
+
+def _report_load_error(action, elem, data):
+    if isinstance(elem, bytes):
+        # serialized for a worker process, see `_translate_items()`
+        elem = etree.fromstring(elem)
+
+    tag_ln = etree.QName(elem.tag).localname
+    print('=====================================================')
+    print()
+    print('ERROR loading ({}) {} tag:'.format(action, tag_ln))
+    print(etree.tostring(elem, encoding='unicode', pretty_print=True))
+    pprint.pprint(data)
+
+
+def denormalize_parent_ids(db):
+    """
+    Stores the IDs of each person's parents (from all families where the
+    person is a child) as `parent_ids` so that MongoDB can walk the pedigree
+    on its own (see `Person.trace_ancestors()`).
+    """
+    print('Denormalizing parent IDs ...')
+
+    families = db[Family.entity_name].find(
+        {}, projection=['father', 'mother', 'childref'])
+
+    parent_ids_by_child = {}
+    for family in families:
+        parent_ids = [family[k]['id'] for k in ('mother', 'father')
+                      if family.get(k)]
+        for childref in family.get('childref', []):
+            known = parent_ids_by_child.setdefault(childref['id'], [])
+            known.extend(x for x in parent_ids if x not in known)
+
+    people = db[Person.entity_name]
+    key = Person.PARENT_IDS_KEY
+
+    # make sure that everyone has the key, even if there are no parents
+    people.update_many({'id': {'$nin': list(parent_ids_by_child)},
+                        key: {'$ne': []}},
+                       {'$set': {key: []}})
+
+    requests = [UpdateOne({'id': pk}, {'$set': {key: parent_ids}})
+                for pk, parent_ids in parent_ids_by_child.items()]
+    if requests:
+        people.bulk_write(requests, ordered=False)
+
+
+def denormalize_search_tokens(db, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stores the search tokens (see `search`) of each document of the models
+    with `SEARCH_FIELDS` so that type-ahead queries are answered by an
+    index (see `Entity.find_by_prefix()`).  People are also found by the
+    aliases of their surnames.
+    """
+    print('Denormalizing search tokens ...')
+
+    namemaps = db[NameMap.entity_name].find({'type': NameMap.TYPE_GROUP_AS},
+                                            projection=['key', 'value'])
+    group_as = dict((x['key'], x['value']) for x in namemaps)
+
+    for model in MODELS:
+        if not model.SEARCH_FIELDS:
+            continue
+
+        _store_computed(
+            db[model.entity_name], model.SEARCH_TOKENS_KEY,
+            lambda doc, model=model: make_search_tokens(
+                model.get_search_texts(doc, group_as=group_as)),
+            projection=model.SEARCH_FIELDS, batch_size=batch_size)
+
+
+def denormalize_phonetic_codes(db, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stores the Daitch–Mokotoff codes of each person's surnames (see
+    `phonetic`) so that the spelling variants are found by an index (see
+    `Person.find_by_phonetic()`).
+    """
+    print('Denormalizing phonetic codes ...')
+
+    _store_computed(
+        db[Person.entity_name], Person.PHONETIC_CODES_KEY,
+        lambda doc: make_phonetic_codes(Person.get_surnames(doc)),
+        projection=['name'], batch_size=batch_size)
+
+
+def _store_computed(collection, key, compute, projection,
+                    batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Sets `key` of each document in given collection to the value computed
+    from the document by `compute`.  Only the documents where the value has
+    changed are written (which is most of them on a full import and few on
+    an incremental one).
+
+    :param projection: The keys needed by `compute`.
+    """
+    projection = _make_projection(['id', key] + list(projection))
+
+    requests = []
+    for doc in collection.find({}, projection=projection):
+        value = compute(doc)
+        if doc.get(key) != value:
+            requests.append(UpdateOne({'_id': doc['_id']},
+                                      {'$set': {key: value}}))
+        if len(requests) >= batch_size:
+            collection.bulk_write(requests, ordered=False)
+            requests = []
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+
+
+class ImportProgress:
+    """
+    The current phase of an import and the number of items processed so far
+    by model.  Updated by the importing thread and safe to read from others
+    (e.g. by a status page).
+    """
+    def __init__(self):
+        self.phase = None
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def set_phase(self, phase):
+        self.phase = phase
+
+    def track(self, items):
+        """
+        Counts the `(elem, model, data)` items as they pass through.
+        """
+        for item in items:
+            with self._lock:
+                self._counts[item[1].entity_name] += 1
+            yield item
+
+    def get_counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+def import_from_xml(path, db, stream=False, batch_size=DEFAULT_BATCH_SIZE,
+                    workers=1, incremental=False, delete_missing=False,
+                    progress=None):
+    """
+    Imports given file into given database.  Without `incremental`, the
+    database is expected to be empty.
+
+    :param progress: `ImportProgress` to be updated along the way.
+    """
+    progress = progress or ImportProgress()
+
+    stored = None
+    skip = None
+    if incremental:
+        progress.set_phase('indexing')
+
+        # the upserts look items up by handle
+        ensure_indexes(db)
+
+        stored = StoredChanges(db)
+        skip = stored.is_unchanged
+
+    if stream:
+        transformed = extract_and_transform_iteratively(path, workers=workers,
+                                                        skip=skip)
+    else:
+        progress.set_phase('extracting')
+        extracted = extract(path)
+        transformed = transform(extracted, workers=workers, skip=skip)
+
+    # the items are extracted (in streaming mode), transformed and loaded
+    # one by one
+    progress.set_phase('loading')
+    transformed = progress.track(transformed)
+
+    if incremental:
+        load_incrementally(transformed, db, stored, batch_size=batch_size,
+                           delete_missing=delete_missing)
+    else:
+        counts = load(transformed, db, batch_size=batch_size)
+        progress.set_phase('verifying')
+        verify_counts(db, counts)
+
+    # before denormalization as it looks people up by ID
+    progress.set_phase('indexing')
+    ensure_indexes(db)
+
+    progress.set_phase('denormalizing')
+    denormalize_parent_ids(db)
+    denormalize_search_tokens(db, batch_size=batch_size)
+    denormalize_phonetic_codes(db, batch_size=batch_size)
 
-def import_from_xml(path, db):
-    extracted = extract(path)
-    transformed = transform(extracted)
-    loaded = load(transformed, db)
+    # the web app rebuilds it from the new data on next access
+    KinshipGraph.invalidate(db)
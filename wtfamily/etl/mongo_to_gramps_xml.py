@@ -41,16 +41,18 @@ Handles can be maintained solely for (almost) idempotent import/export.
 
 BTW, Gramps' GEDCOM export uses IDs and nothing else.
 """
+import codecs
 import datetime
+import gzip
+import itertools
 # NOTE: not bundled with Python but separate library; it can pretty-print.
 from lxml import etree
-import sys
 
-from models import (Entity, Person, Family, Event, Citation, Source, Place,
+from models import (Person, Family, Event, Citation, Source, Place,
                     Repository, MediaObject, Note, Bookmark, NameMap,
                     NameFormat)
 
-import etl.translators as s
+from etl.gramps_xml_to_mongo import MODEL_TO_TAG
 
 
 WTFAMILY_APP_NAME = 'WTFamily'
@@ -59,84 +61,155 @@ GRAMPS_XML_VERSION = '.'.join(str(i) for i in GRAMPS_XML_VERSION_TUPLE)
 GRAMPS_URL_HOMEPAGE = "http://gramps-project.org/"
 
 
+# same order as in Gramps' own export
+MODELS = (Person, Family, Event, Citation, Source, Place, Repository,
+          MediaObject, Note, Bookmark, NameMap, NameFormat)
+
+XML_NAMESPACE = '{}xml/{}/'.format(GRAMPS_URL_HOMEPAGE, GRAMPS_XML_VERSION)
+
+
 def export_to_xml(db):
-    declaration = (
+    """
+    Generates the Gramps XML document as a sequence of strings (roughly one
+    item per string).  Each item is translated, serialized and forgotten
+    before the next one is read from the database, so the memory usage does
+    not depend on the size of the database.
+    """
+    chunks = _ChunkCollector()
+
+    chunks.write(get_declaration().encode('utf-8'))
+
+    id_to_handle = get_id_to_handle(db)
+
+    with etree.xmlfile(chunks, encoding='utf-8') as xf:
+        with xf.element('database', {'xmlns': XML_NAMESPACE}):
+            xf.write('\n  ')
+            xf.write(_indent(make_header_element(), 1))
+
+            for model in MODELS:
+                group_tag, item_tag, ItemTranslator = MODEL_TO_TAG[model]
+                items = db[model.entity_name].find()
+
+                xf.write('\n  ')
+
+                first_item = next(items, None)
+                if first_item is None:
+                    xf.write(etree.Element(group_tag))
+                    continue
+
+                with xf.element(group_tag):
+                    for item in itertools.chain([first_item], items):
+                        item_el = ItemTranslator().to_xml(item_tag, item,
+                                                          id_to_handle)
+                        xf.write('\n    ')
+                        xf.write(_indent(item_el, 2))
+
+                        yield chunks.pop()
+
+                    xf.write('\n  ')
+
+            xf.write('\n')
+
+    chunks.write(b'\n')
+
+    yield chunks.pop()
+
+
+def export_to_file(db, f):
+    """
+    Writes the Gramps XML document to given file object (opened in text mode).
+    """
+    for chunk in export_to_xml(db):
+        f.write(chunk)
+
+
+def export_to_gzip_file(db, path):
+    """
+    Writes the Gramps XML document to a gzip-compressed file (i.e. the native
+    format of Gramps).
+    """
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        export_to_file(db, f)
+
+
+def get_declaration():
+    return (
         '<?xml version="1.0" encoding="UTF-8"?>\n'
         '<!DOCTYPE database PUBLIC "-//Gramps//DTD Gramps XML %s//EN"\n'
         '"%sxml/%s/grampsxml.dtd">\n'
         % (GRAMPS_XML_VERSION, GRAMPS_URL_HOMEPAGE, GRAMPS_XML_VERSION))
 
-    tree_el = build_xml(db)
 
-    yield declaration
-    yield etree.tostring(tree_el, encoding='unicode', pretty_print=True)
+def get_id_to_handle(db):
+    """
+    Gathers the mappings of IDs to internal Gramps IDs ("handles").
+    This requires a full iteration over all potentially referenced entities
+    before we try exporting them.
+    """
+    id_to_handle = {}
+    for model in MODELS:
+        collection = db[model.entity_name]
+        for item in collection.find({}, projection=['id', 'handle']):
+            item_handle = item.get('handle')
+            item_id = item.get('id')
+            if item_handle and item_id:
+                id_to_handle[item_id] = item_handle
+    return id_to_handle
 
 
 def build_xml(db):
+    """
+    Returns the whole Gramps XML tree.  See `export_to_xml()` for the
+    memory-friendly version.
+    """
     tree_el = etree.Element('database', {
-        'xmlns': '{}xml/{}/'.format(GRAMPS_URL_HOMEPAGE, GRAMPS_XML_VERSION)
+        'xmlns': XML_NAMESPACE
     })
 
     header = make_header_element()
     tree_el.append(header)
 
-    # monkey-patch to avoid the Flask app context/globals nonsense
-    Entity._get_database = lambda: db
-
-    model_to_tag = {
-        Person: ('people', 'person', s.PersonTranslator),
-        Family: ('families', 'family', s.FamilyTranslator),
-        Event: ('events', 'event', s.EventTranslator),
-        Source: ('sources', 'source', s.SourceTranslator),
-        Place: ('places', 'placeobj', s.PlaceTranslator),
-        MediaObject: ('objects', 'object', s.MediaObjectTranslator),
-        Repository: ('repositories', 'repository', s.RepositoryTranslator),
-        Note: ('notes', 'note', s.NoteTranslator),
-        # TODO: Tag: ('tags', 'tag', s.TagTranslator),
-        Citation: ('citations', 'citation', s.CitationTranslator),
-        Bookmark: ('bookmarks', 'bookmark', s.BookmarkTranslator),
-        NameMap: ('namemaps', 'map', s.NameMapTranslator),
-        NameFormat: ('name-formats', 'format', s.NameFormatTranslator),
-    }
-    models = (Person, Family, Event, Citation, Source, Place, Repository,
-              MediaObject, Note, Bookmark, NameMap, NameFormat)
-
-    # Gather the mappings of IDs to internal Gramps IDs ("handles").
-    # This requires a full iteration over all potentially referenced entities
-    # before we try exporting them.
-    id_to_handle = {}
-    for model in models:
-        collection = model._get_collection()
-        for item in collection.find({}, projection=['id', 'handle']):
-            item_handle = item.get('handle')
-            item_id = item.get('id')
-            if item_handle and item_id:
-                id_to_handle[item_id] = item_handle
+    id_to_handle = get_id_to_handle(db)
 
     # Now that we have the full mapping, proceed to export record by record.
-    for model in models:
-
-        # XXX debug stuff, remove once all translators are ready.
-        if model not in model_to_tag:
-            sys.stderr.write('ERROR: Model {.__name__} has no translator '
-                             'defined.\n'.format(model))
-            continue
-
-        group_tag, item_tag, ItemTranslator = model_to_tag[model]
+    for model in MODELS:
+        group_tag, item_tag, ItemTranslator = MODEL_TO_TAG[model]
 
         group_el = etree.SubElement(tree_el, group_tag)
 
-        items = model.find()
-
-        for item in items:
+        for item in db[model.entity_name].find():
             item_translator = ItemTranslator()
-            item_el = item_translator.to_xml(item_tag, item._data,
-                                             id_to_handle)
+            item_el = item_translator.to_xml(item_tag, item, id_to_handle)
             group_el.append(item_el)
 
     return tree_el
 
 
+class _ChunkCollector:
+    """
+    A file-like object for `etree.xmlfile()` which keeps whatever is written
+    until it is popped as a string.
+    """
+    def __init__(self):
+        self._chunks = []
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return self._decoder.decode(data)
+
+
+def _indent(el, level):
+    # the same whitespace as `etree.tostring(..., pretty_print=True)` would
+    # add if the element was serialized within the whole tree
+    etree.indent(el, level=level)
+    return el
+
+
 def make_header_element():
     today = str(datetime.date.today())
 
@@ -0,0 +1,480 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+Generator of synthetic Gramps XML files for benchmarks and tests.
+
+The data is random but shaped like a real family file: a few founders, then
+generation after generation of families with children (some of them marrying
+their cousins, so the pedigree collapses), people marrying into the family
+from outside, births, marriages and deaths in cities nested in regions and
+countries, citations of sources kept in repositories, notes and name maps
+for surname variants.
+
+The output only depends on the number of people and the seed::
+
+    with open('synthetic.xml', 'wb') as f:
+        write_gramps_xml(f, people=10000)
+
+The genealogy is kept in memory as lists of numbers (a few hundred bytes per
+person); the XML itself is written item by item.
+"""
+import random
+
+# NOTE: not bundled with Python but separate library; it can pretty-print.
+from lxml import etree
+
+from .mongo_to_gramps_xml import (GRAMPS_XML_VERSION, XML_NAMESPACE,
+                                  get_declaration)
+
+
+DEFAULT_PEOPLE = 1000
+DEFAULT_SEED = 0
+
+FIRST_YEAR = 1700
+LAST_YEAR = 2018
+
+# the `change` attribute of all items (2018-04-14)
+CHANGE_TIMESTAMP = 1523700000
+
+MALE_NAMES = ('Ivan', 'Pyotr', 'Pavel', 'Mikhail', 'Andrey', 'Nikolai',
+              'Alexander', 'Fyodor', 'Grigory', 'Semyon', 'Yakov', 'Vasily')
+FEMALE_NAMES = ('Maria', 'Anna', 'Olga', 'Yelena', 'Tatiana', 'Natalia',
+                'Yekaterina', 'Praskovia', 'Avdotia', 'Irina', 'Sofia', 'Vera')
+
+# the first spelling is the main one, the rest are mapped to it
+SURNAMES = (
+    ('Petrov', 'Petroff'), ('Ivanov', 'Iwanow'), ('Sidorov',),
+    ('Smirnov', 'Smirnoff'), ('Kuznetsov', 'Kusnezow'), ('Popov',),
+    ('Sokolov', 'Sokoloff'), ('Lebedev',), ('Kozlov', 'Koslow'),
+    ('Novikov',), ('Morozov', 'Morosow'), ('Volkov', 'Wolkow'),
+)
+
+COUNTRIES = ('Russia', 'Lithuania', 'Poland')
+REGIONS_PER_COUNTRY = 4
+PEOPLE_PER_CITY = 200
+MIN_CITIES = 12
+
+PEOPLE_PER_SOURCE = 500
+PEOPLE_PER_CITATION = 4
+SOURCES_PER_REPOSITORY = 20
+
+FOUNDERS_PER_MILLE = 20
+MARRIAGE_RATE = 0.8
+COUSIN_MARRIAGE_RATE = 0.05
+CITATION_RATE = 0.5
+NOTE_RATE = 0.1
+CHILDREN_WEIGHTS = (10, 15, 25, 20, 15, 10, 5)    # for 0, 1, 2… children
+
+MALE, FEMALE = 'M', 'F'
+NOBODY = -1
+
+
+def write_gramps_xml(f, people=DEFAULT_PEOPLE, seed=DEFAULT_SEED):
+    """
+    Writes a synthetic Gramps XML document with given number of people to
+    given binary file object.
+    """
+    tree = SyntheticTree(people, seed)
+
+    f.write(get_declaration().encode('utf-8'))
+
+    with etree.xmlfile(f, encoding='utf-8') as xf:
+        with xf.element('database', {'xmlns': XML_NAMESPACE}):
+            header_el = etree.Element('header')
+            etree.SubElement(header_el, 'created', date='2018-04-14',
+                             version=GRAMPS_XML_VERSION)
+            xf.write('\n  ')
+            _write_item(xf, header_el, 1)
+
+            for group_tag, make_items in (
+                    ('events', tree.make_events),
+                    ('people', tree.make_people),
+                    ('families', tree.make_families),
+                    ('citations', tree.make_citations),
+                    ('sources', tree.make_sources),
+                    ('places', tree.make_places),
+                    ('repositories', tree.make_repositories),
+                    ('notes', tree.make_notes),
+                    ('bookmarks', tree.make_bookmarks),
+                    ('namemaps', tree.make_namemaps)):
+                xf.write('\n  ')
+                with xf.element(group_tag):
+                    for item_el in make_items():
+                        xf.write('\n    ')
+                        _write_item(xf, item_el, 2)
+                    xf.write('\n  ')
+            xf.write('\n')
+
+    f.write(b'\n')
+
+    return tree
+
+
+def _write_item(xf, el, level):
+    etree.indent(el, level=level)
+    xf.write(el)
+
+
+class SyntheticTree:
+    """
+    The genealogy behind a synthetic file.  People and families are numbered
+    from zero; relations are kept in lists indexed by these numbers.
+    """
+    def __init__(self, people=DEFAULT_PEOPLE, seed=DEFAULT_SEED):
+        self.rng = random.Random(seed)
+
+        # by person number
+        self.genders = []
+        self.first_names = []
+        self.surnames = []
+        self.birth_years = []
+        self.death_years = []
+        self.parent_families = []
+        self.families_by_person = []
+
+        # by family number
+        self.fathers = []
+        self.mothers = []
+        self.children = []
+        self.marriage_years = []
+
+        self.num_cities = max(MIN_CITIES, people // PEOPLE_PER_CITY)
+        self.num_sources = people // PEOPLE_PER_SOURCE + 1
+        self.num_citations = people // PEOPLE_PER_CITATION + 1
+        self.num_repositories = (self.num_sources // SOURCES_PER_REPOSITORY
+                                 + 1)
+
+        self._populate(people)
+
+        # the cited people and the ones with notes are picked once so that
+        # the items and the references to them agree
+        rng = self.rng
+        self.citations = [rng.randrange(self.num_citations)
+                          if rng.random() < CITATION_RATE else NOBODY
+                          for _ in self.genders]
+        self.notes = []
+        self.person_notes = []
+        for _ in self.genders:
+            if rng.random() < NOTE_RATE:
+                self.person_notes.append(len(self.notes))
+                self.notes.append(rng.choice(SURNAMES)[0])
+            else:
+                self.person_notes.append(NOBODY)
+
+    def __len__(self):
+        return len(self.genders)
+
+    def _populate(self, total):
+        rng = self.rng
+
+        founders = max(2, total * FOUNDERS_PER_MILLE // 1000)
+        generation = [self._add_person(rng.choice((MALE, FEMALE)),
+                                       rng.randint(FIRST_YEAR, FIRST_YEAR + 30))
+                      for _ in range(min(founders, total))]
+
+        while len(self) < total:
+            next_generation = []
+
+            for family in self._marry(generation, total):
+                year = self.marriage_years[family]
+                surname = self.surnames[self.fathers[family]]
+                num_children = rng.choices(range(len(CHILDREN_WEIGHTS)),
+                                           CHILDREN_WEIGHTS)[0]
+                for i in range(num_children):
+                    if len(self) >= total:
+                        break
+                    child = self._add_person(rng.choice((MALE, FEMALE)),
+                                             year + 1 + i * 2, surname)
+                    self.parent_families[child].append(family)
+                    self.children[family].append(child)
+                    next_generation.append(child)
+
+            if not next_generation:
+                # everyone died out; start over with new founders
+                next_generation = [
+                    self._add_person(rng.choice((MALE, FEMALE)),
+                                     self.birth_years[-1])
+                    for _ in range(min(founders, total - len(self)))]
+
+            generation = next_generation
+
+    def _marry(self, generation, total):
+        """
+        Creates families for (some of) the people of a generation and returns
+        their numbers.  Most partners marry in from outside; some people marry
+        their cousins.
+        """
+        rng = self.rng
+
+        # grandparent → grandchildren in this generation
+        cousins = {}
+        for person in generation:
+            for grandparent in self._get_grandparents(person):
+                cousins.setdefault(grandparent, []).append(person)
+
+        families = []
+        for person in rng.sample(generation, len(generation)):
+            # a partner from outside may be needed
+            if self.families_by_person[person] or len(self) + 1 >= total:
+                continue
+            if rng.random() > MARRIAGE_RATE:
+                continue
+
+            gender = self.genders[person]
+            year = self.birth_years[person] + rng.randint(18, 30)
+
+            partner = NOBODY
+            if rng.random() < COUSIN_MARRIAGE_RATE:
+                partner = self._find_cousin(person, cousins)
+            if partner == NOBODY:
+                partner = self._add_person(
+                    FEMALE if gender == MALE else MALE,
+                    self.birth_years[person] + rng.randint(-5, 5))
+
+            if gender == MALE:
+                families.append(self._add_family(person, partner, year))
+            else:
+                families.append(self._add_family(partner, person, year))
+
+        return families
+
+    def _get_grandparents(self, person):
+        for family in self.parent_families[person]:
+            for parent in (self.fathers[family], self.mothers[family]):
+                for parent_family in self.parent_families[parent]:
+                    yield self.fathers[parent_family]
+                    yield self.mothers[parent_family]
+
+    def _find_cousin(self, person, cousins):
+        siblings = set(child for family in self.parent_families[person]
+                       for child in self.children[family])
+        for grandparent in self._get_grandparents(person):
+            for cousin in cousins.get(grandparent, []):
+                if (cousin not in siblings
+                        and self.genders[cousin] != self.genders[person]
+                        and not self.families_by_person[cousin]):
+                    return cousin
+        return NOBODY
+
+    def _add_person(self, gender, birth_year, surname=None):
+        rng = self.rng
+        names = MALE_NAMES if gender == MALE else FEMALE_NAMES
+        death_year = birth_year + rng.randint(0, 90)
+
+        self.genders.append(gender)
+        self.first_names.append(rng.choice(names))
+        self.surnames.append(surname or rng.choice(rng.choice(SURNAMES)))
+        self.birth_years.append(birth_year)
+        self.death_years.append(death_year if death_year < LAST_YEAR else None)
+        self.parent_families.append([])
+        self.families_by_person.append([])
+        return len(self.genders) - 1
+
+    def _add_family(self, father, mother, year):
+        family = len(self.fathers)
+        self.fathers.append(father)
+        self.mothers.append(mother)
+        self.children.append([])
+        self.marriage_years.append(year)
+        self.families_by_person[father].append(family)
+        self.families_by_person[mother].append(family)
+        return family
+
+    # The items.  Events are numbered as follows: person's birth is `3 * n`,
+    # death is `3 * n + 1`, marriage in family is `3 * n + 2`.
+
+    def make_events(self):
+        rng = self.rng
+        for person, birth_year in enumerate(self.birth_years):
+            description = 'Birth of {} {}'.format(self.first_names[person],
+                                                  self.surnames[person])
+            yield self._make_event(3 * person, 'Birth', birth_year,
+                                   description, self.citations[person])
+
+            if self.death_years[person] is not None:
+                yield self._make_event(3 * person + 1, 'Death',
+                                       self.death_years[person])
+
+        for family, year in enumerate(self.marriage_years):
+            el = self._make_event(3 * family + 2, 'Marriage', year)
+            if rng.random() < CITATION_RATE:
+                etree.SubElement(el, 'citationref', hlink=_handle(
+                    'c', rng.randrange(self.num_citations)))
+            yield el
+
+    def _make_event(self, number, event_type, year, description=None,
+                    citation=NOBODY):
+        rng = self.rng
+        el = _make_item('event', 'e', number, 'E')
+        etree.SubElement(el, 'type').text = event_type
+        date = '{}-{:02}-{:02}'.format(year, rng.randint(1, 12),
+                                       rng.randint(1, 28))
+        if rng.random() < 0.2:
+            etree.SubElement(el, 'dateval', val=str(year), type='about',
+                             quality='estimated')
+        else:
+            etree.SubElement(el, 'dateval', val=date)
+        etree.SubElement(el, 'place', hlink=_handle(
+            'pl', self._get_city(rng.randrange(self.num_cities))))
+        if description:
+            etree.SubElement(el, 'description').text = description
+        if citation != NOBODY:
+            etree.SubElement(el, 'citationref', hlink=_handle('c', citation))
+        return el
+
+    def make_people(self):
+        for person, gender in enumerate(self.genders):
+            el = _make_item('person', 'p', person, 'I')
+            etree.SubElement(el, 'gender').text = gender
+
+            name_el = etree.SubElement(el, 'name', type='Birth Name')
+            etree.SubElement(name_el, 'first').text = self.first_names[person]
+            etree.SubElement(name_el, 'surname').text = self.surnames[person]
+
+            etree.SubElement(el, 'eventref', hlink=_handle('e', 3 * person),
+                             role='Primary')
+            if self.death_years[person] is not None:
+                etree.SubElement(el, 'eventref',
+                                 hlink=_handle('e', 3 * person + 1),
+                                 role='Primary')
+            for family in self.families_by_person[person]:
+                etree.SubElement(el, 'eventref',
+                                 hlink=_handle('e', 3 * family + 2),
+                                 role='Family')
+            for family in self.parent_families[person]:
+                etree.SubElement(el, 'childof', hlink=_handle('f', family))
+            for family in self.families_by_person[person]:
+                etree.SubElement(el, 'parentin', hlink=_handle('f', family))
+            if self.person_notes[person] != NOBODY:
+                etree.SubElement(el, 'noteref', hlink=_handle(
+                    'n', self.person_notes[person]))
+            yield el
+
+    def make_families(self):
+        for family, children in enumerate(self.children):
+            el = _make_item('family', 'f', family, 'F')
+            etree.SubElement(el, 'rel', type='Married')
+            etree.SubElement(el, 'father',
+                             hlink=_handle('p', self.fathers[family]))
+            etree.SubElement(el, 'mother',
+                             hlink=_handle('p', self.mothers[family]))
+            etree.SubElement(el, 'eventref', hlink=_handle('e', 3 * family + 2),
+                             role='Family')
+            for child in children:
+                etree.SubElement(el, 'childref', hlink=_handle('p', child))
+            yield el
+
+    def make_citations(self):
+        rng = self.rng
+        for citation in range(self.num_citations):
+            el = _make_item('citation', 'c', citation, 'C')
+            etree.SubElement(el, 'page').text = 'p. {}'.format(
+                rng.randint(1, 500))
+            etree.SubElement(el, 'confidence').text = str(rng.randint(0, 4))
+            etree.SubElement(el, 'sourceref', hlink=_handle(
+                's', rng.randrange(self.num_sources)))
+            yield el
+
+    def make_sources(self):
+        rng = self.rng
+        for source in range(self.num_sources):
+            el = _make_item('source', 's', source, 'S')
+            etree.SubElement(el, 'stitle').text = (
+                'Metrical book #{}'.format(source))
+            etree.SubElement(el, 'sauthor').text = 'Church'
+            etree.SubElement(el, 'reporef', hlink=_handle(
+                'r', rng.randrange(self.num_repositories)), medium='Book',
+                callno='F.{}'.format(source))
+            yield el
+
+    # Places are numbered as follows: countries, regions, cities.
+
+    def _get_region(self, number):
+        return len(COUNTRIES) + number
+
+    def _get_city(self, number):
+        return len(COUNTRIES) * (1 + REGIONS_PER_COUNTRY) + number
+
+    def make_places(self):
+        rng = self.rng
+
+        for country, name in enumerate(COUNTRIES):
+            el = _make_item('placeobj', 'pl', country, 'P', type='Country')
+            etree.SubElement(el, 'pname', value=name)
+            yield el
+
+        for region in range(len(COUNTRIES) * REGIONS_PER_COUNTRY):
+            number = self._get_region(region)
+            el = _make_item('placeobj', 'pl', number, 'P', type='Region')
+            etree.SubElement(el, 'pname', value='Region {}'.format(region))
+            etree.SubElement(el, 'placeref', hlink=_handle(
+                'pl', region // REGIONS_PER_COUNTRY))
+            yield el
+
+        for city in range(self.num_cities):
+            number = self._get_city(city)
+            el = _make_item('placeobj', 'pl', number, 'P', type='City')
+            etree.SubElement(el, 'pname', value='City {}'.format(city))
+            etree.SubElement(el, 'coord',
+                             long='{:.4f}'.format(rng.uniform(20, 40)),
+                             lat='{:.4f}'.format(rng.uniform(50, 60)))
+            etree.SubElement(el, 'placeref', hlink=_handle(
+                'pl', self._get_region(rng.randrange(
+                    len(COUNTRIES) * REGIONS_PER_COUNTRY))))
+            yield el
+
+    def make_repositories(self):
+        for repository in range(self.num_repositories):
+            el = _make_item('repository', 'r', repository, 'R')
+            etree.SubElement(el, 'rname').text = (
+                'Archive #{}'.format(repository))
+            etree.SubElement(el, 'type').text = 'Archive'
+            yield el
+
+    def make_notes(self):
+        for note, surname in enumerate(self.notes):
+            el = _make_item('note', 'n', note, 'N', type='General')
+            etree.SubElement(el, 'text').text = (
+                'The {} family is mentioned in the parish records.'
+                .format(surname))
+            yield el
+
+    def make_bookmarks(self):
+        for person in range(min(3, len(self))):
+            yield etree.Element('bookmark', target='person',
+                                hlink=_handle('p', person))
+
+    def make_namemaps(self):
+        for spellings in SURNAMES:
+            for variant in spellings[1:]:
+                yield etree.Element('map', type='group_as', key=variant,
+                                    value=spellings[0])
+
+
+def _handle(prefix, number):
+    # real handles are longer and random but this is enough for uniqueness
+    return '_{}{:012x}'.format(prefix, number)
+
+
+def _make_item(tag, handle_prefix, number, id_prefix, **attrs):
+    el = etree.Element(tag, handle=_handle(handle_prefix, number),
+                       change=str(CHANGE_TIMESTAMP),
+                       id='{}{:04}'.format(id_prefix, number))
+    el.attrib.update(attrs)
+    return el
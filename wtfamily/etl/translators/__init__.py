@@ -42,17 +42,11 @@ from .generic import (
 
     # functions
     tag_translator_factory,
+    get_localname,
     _debug
 )
 
 
-def _get_child(el, wanted_child_tag):
-    for child_el in el.getchildren():
-        child_tag = etree.QName(child_el.tag).localname
-        if child_tag == wanted_child_tag:
-            return child_el
-
-
 def _dict_from_keys(src_data, verbatim_keys, renamed_keys=None):
     data = {}
 
@@ -123,22 +117,22 @@ class DateContributor(TagTranslatorContributor):
 
     @classmethod
     def from_xml(cls, el):
-        datestr_el = _get_child(el, 'datestr')
-        dateval_el = _get_child(el, 'dateval')
-        daterange_el = _get_child(el, 'daterange')
-        datespan_el = _get_child(el, 'datespan')
-
-        # can't say just `foo or bar` because Element.__bool__ is deprecated :(
-        elems = datestr_el, dateval_el, daterange_el, datespan_el
-        present_els = [x for x in elems if x is not None]
+        # the first element of each kind, found in a single pass
+        date_els = {}
+        for child_el in el:
+            child_tag = get_localname(child_el.tag)
+            if child_tag in cls.TAG_NAMES and child_tag not in date_els:
+                date_els[child_tag] = child_el
 
         # we expect exactly one or none
         # TODO: container should be able to also require exactly one
-        try:
-            present_el = present_els[0]
-        except IndexError as e:
+        if not date_els:
             return {}
 
+        # in the order of preference (same as in TAG_NAMES)
+        present_el = next(date_els[x] for x in cls.TAG_NAMES
+                          if x in date_els)
+
         date = _dict_from_keys(present_el.attrib,
                                verbatim_keys=['start', 'stop', 'quality'],
                                renamed_keys={'val': 'value'})
@@ -152,11 +146,11 @@ class DateContributor(TagTranslatorContributor):
                 if date.get(key):
                     date['value'][key] = date.pop(key)
 
-        if datestr_el is not None:
+        if 'datestr' in date_els:
             modifier = cls.MOD_TEXTONLY
-        elif daterange_el is not None:
+        elif 'daterange' in date_els:
             modifier = cls.MOD_RANGE
-        elif datespan_el is not None:
+        elif 'datespan' in date_els:
             modifier = cls.MOD_SPAN
         else:
             modifier = present_el.get('type')
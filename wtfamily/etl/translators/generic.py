@@ -24,6 +24,7 @@ Extract, Transform, Load: Generic Translators
 Mapping of XML to native Python data.
 """
 import datetime
+import functools
 import itertools
 import sys
 
@@ -95,6 +96,30 @@ def normalize_attr_value(value, target_type=None):
                          .format(type(value).__name__, value, target_type))
 
 
+def get_attr_value_normalizer(target_type=None):
+    """
+    Returns a function which does `normalize_attr_value(value, target_type)`.
+    """
+    try:
+        return ATTR_VALUE_NORMALIZERS_BY_TYPE[target_type]
+    except KeyError:
+        # will complain about the type when (and if) it's called
+        return functools.partial(normalize_attr_value, target_type=target_type)
+
+
+# qualified tag name → local name, e.g.
+# "{http://gramps-project.org/xml/1.7.1/}name" → "name"
+_localnames = {}
+
+
+def get_localname(tag):
+    try:
+        return _localnames[tag]
+    except KeyError:
+        localname = _localnames[tag] = etree.QName(tag).localname
+        return localname
+
+
 class AbstractTagCardinality:
     SINGLE_VALUE = False
 
@@ -167,6 +192,71 @@ def tag_translator_factory(tags=None, attrs=None, contributors=None,
     return AdHocTagTranslator
 
 
+# marks nested tags which are neither declared nor contributed
+_UNEXPECTED = object()
+
+
+class CompiledTagTranslator:
+    """
+    Lookup tables for a `TagTranslator` class, see `TagTranslator.compile()`.
+
+    The nested tags are mapped (by qualified name, as the elements have it)
+    to handlers: `(key, from_xml, is_list)` tuples where `from_xml` belongs
+    to a translator instance shared by all elements; the tags handled by
+    contributors are mapped to `None`.  Qualified names are only known when
+    the elements are seen, so this table is filled lazily.
+    """
+    def __init__(self, translator_class):
+        tags = translator_class.TAGS
+        contributed = [c.TAG_NAMES for c in translator_class.CONTRIBUTORS]
+
+        self.expected_tag_names = list(itertools.chain(tags.keys(),
+                                                       *contributed))
+        self.contributed_tag_names = set(itertools.chain(*contributed))
+
+        attrs = translator_class.ATTRS
+        self.attr_normalizers = dict(
+            (attr, get_attr_value_normalizer(
+                attrs[attr] if isinstance(attrs, dict) else None))
+            for attr in attrs)
+
+        # local tag name → handler
+        self.handlers = {}
+        # `(tag, translator, cardinality)` in serialization order
+        self.serializers = []
+
+        for tag in sorted(tags):
+            Translator = tags[tag]
+            translator = Translator()
+
+            cardinality = None
+            is_list = True
+            if isinstance(Translator, AbstractTagCardinality):
+                cardinality = Translator
+                if Translator.SINGLE_VALUE:
+                    is_list = False
+
+            self.handlers[tag] = tag, translator.from_xml, is_list
+            self.serializers.append((tag, translator, cardinality))
+
+        # qualified tag name → handler
+        self.dispatch = {}
+
+    def resolve(self, qualified_tag):
+        tag = get_localname(qualified_tag)
+
+        if tag in self.handlers:
+            handler = self.handlers[tag]
+        elif tag in self.contributed_tag_names:
+            handler = None
+        else:
+            handler = _UNEXPECTED
+
+        self.dispatch[qualified_tag] = handler
+
+        return handler
+
+
 # TODO: rename to TagTranslator?
 class TagTranslator:
     TAGS = {}
@@ -181,29 +271,37 @@ class TagTranslator:
             # the GrampsXML DTD.
             raise ValueError('TAGS and AS_TEXT are mutually exclusive.')
 
+    @classmethod
+    def compile(cls):
+        """
+        Returns the `CompiledTagTranslator` for this class, building it on
+        first access.  Each subclass gets its own.
+        """
+        try:
+            return cls.__dict__['_compiled']
+        except KeyError:
+            compiled = cls._compiled = CompiledTagTranslator(cls)
+            return compiled
+
     @property
     def expected_tag_names(self):
-        declared = self.TAGS.keys()
-        contributed = [c.TAG_NAMES for c in self.CONTRIBUTORS]
-
-        return list(itertools.chain(declared, *contributed))
+        return self.compile().expected_tag_names
 
     def from_xml(self, el, handle_to_id=None):
+        compiled = self.compile()
         data = {}
         attrs = {}
 
-        for attr in el.attrib:
-            if attr not in self.ATTRS:
+        normalizers = compiled.attr_normalizers
+        for attr, value in el.attrib.items():
+            try:
+                normalizer = normalizers[attr]
+            except KeyError:
                 _debug('{}: unexpected attr {}'.format(el.tag, attr))
 
                 continue
 
-            target_type = None
-            if isinstance(self.ATTRS, dict):
-                target_type = self.ATTRS[attr]
-
-            value = el.get(attr)
-            attrs[attr] = normalize_attr_value(value, target_type)
+            attrs[attr] = normalizer(value)
 
         try:
             attrs = self.post_normalize_attrs(attrs, handle_to_id)
@@ -219,31 +317,25 @@ class TagTranslator:
         if self.TEXT_UNDER_KEY:
             data[self.TEXT_UNDER_KEY] = el.text
 
+        dispatch = compiled.dispatch
         for nested_el in el:
-            # Use the local name instead of the qualified one,
-            # i.e. "{http://gramps-project.org/xml/1.7.1/}name" → "name"
-            nested_tag = etree.QName(nested_el.tag).localname
-
-            if nested_tag not in self.TAGS:
-                # sanity check
-                if nested_tag not in self.expected_tag_names:
-                    _debug('{}: nested tag {} not in expected {}'
-                           .format(el.tag, nested_tag, self.expected_tag_names))
+            try:
+                handler = dispatch[nested_el.tag]
+            except KeyError:
+                handler = compiled.resolve(nested_el.tag)
 
+            if handler is None:
                 # expected to be handled by a TagTranslatorContributor
                 continue
 
-            Translator = self.TAGS[nested_tag]
-            translator = Translator()
-
-            is_list = True
-            if isinstance(Translator, AbstractTagCardinality):
-                if Translator.SINGLE_VALUE:
-                    is_list = False
+            if handler is _UNEXPECTED:
+                _debug('{}: nested tag {} not in expected {}'
+                       .format(el.tag, get_localname(nested_el.tag),
+                               compiled.expected_tag_names))
+                continue
 
-            #key = translator.KEY or nested_tag
-            key = nested_tag
-            value = translator.from_xml(nested_el, handle_to_id=handle_to_id)
+            key, from_xml, is_list = handler
+            value = from_xml(nested_el, handle_to_id=handle_to_id)
 
             if is_list:
                 data.setdefault(key, []).append(value)
@@ -268,9 +360,7 @@ class TagTranslator:
             if value is not None:
                 el.set(attr, serialize_attr_value(value))
 
-        for nested_tag in sorted(self.TAGS):
-            Translator = self.TAGS[nested_tag]
-
+        for nested_tag, translator, cardinality in self.compile().serializers:
             # NOTE: subtag == key, but may be different
             values = data.get(nested_tag)
 
@@ -279,11 +369,10 @@ class TagTranslator:
             elif not isinstance(values, list):
                 values = [values]
 
-            if isinstance(Translator, AbstractTagCardinality):
-                Translator.validate_values(values)
+            if cardinality is not None:
+                cardinality.validate_values(values)
 
             for value in values:
-                translator = Translator()
                 nested_el = translator.to_xml(nested_tag, value, id_to_handle)
                 el.append(nested_el)
 
@@ -0,0 +1,296 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+Generations of the database.
+
+A full import does not touch the database being served.  It goes to a new
+database (a "generation") named after the configured one, e.g.
+``wtfamily-from-grampsxml-20180414120000000000``; once it is complete,
+the web app is switched to it by updating a pointer document.  The previous
+generations are kept for a rollback until they are garbage-collected.
+
+The pointer and the list of generations are stored in the `generations`
+collection of the configured database.  Without the pointer (i.e. before
+the first switch) the configured database itself is the current one::
+
+    generations = DatabaseGenerations(mongo_client, 'wtfamily')
+    db = generations.create()
+    ...    # import into `db`
+    generations.switch(db.name)
+"""
+import datetime
+import threading
+import time
+
+from pymongo.errors import DuplicateKeyError
+
+
+COLLECTION = 'generations'
+POINTER_ID = 'current'
+
+# statuses of generations
+STAGING = 'staging'
+LIVE = 'live'
+RETIRED = 'retired'
+FAILED = 'failed'
+
+# seconds between the checks of the pointer by a running app
+CHECK_INTERVAL = 1
+
+
+class DatabaseGenerations:
+    """
+    The generations of the database with given (configured) name.
+    """
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.control = client[name][COLLECTION]
+
+        # the generation used by this process (see `get_current()`)
+        self._current = None
+        self._pending_name = None
+        self._checked_at = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+        # separate as the versions are needed while preparing a generation
+        self._versions_lock = threading.Lock()
+
+    def get_pointer(self):
+        return self.control.find_one({'_id': POINTER_ID}) or {
+            'name': self.name,
+            'history': [],
+        }
+
+    def get_current_name(self):
+        return self.get_pointer()['name']
+
+    def get_current(self, prepare=None, release=None):
+        """
+        Returns the current generation as a `Database`.  Meant to be called
+        on every request: the pointer is checked at most once per
+        `CHECK_INTERVAL` seconds.
+
+        When the pointer changes, `prepare` is called with the new database
+        in a background thread (e.g. to warm up caches) and the old database
+        is returned until it is done; then `release` is called with the old
+        one.  Only the very first call waits for `prepare`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._current is not None and now - self._checked_at < CHECK_INTERVAL:
+                return self._current
+            self._checked_at = now
+
+            name = self.get_current_name()
+
+            if self._current is None:
+                db = self.client[name]
+                if prepare:
+                    prepare(db)
+                self._current = db
+            elif name not in (self._current.name, self._pending_name):
+                self._pending_name = name
+                threading.Thread(target=self._activate,
+                                 args=(name, prepare, release),
+                                 daemon=True).start()
+
+            return self._current
+
+    def _activate(self, name, prepare, release):
+        db = self.client[name]
+        try:
+            if prepare:
+                prepare(db)
+        except Exception as e:
+            print('Could not switch to database "{}": {}'.format(name, e))
+            with self._lock:
+                # try again on next check
+                self._pending_name = None
+            return
+
+        with self._lock:
+            old_db = self._current
+            self._current = db
+            self._pending_name = None
+
+        print('Switched to database "{}"'.format(name))
+
+        if release:
+            release(old_db)
+
+    def get_version(self, name):
+        """
+        Returns the revision of given generation and the time it was last
+        modified (`None` if unknown).  Together with the name they identify
+        the content of the database, e.g. for HTTP caching.  Like the
+        pointer, the version is checked at most once per `CHECK_INTERVAL`
+        seconds.
+        """
+        with self._versions_lock:
+            now = time.monotonic()
+            checked_at, version = self._versions.get(name, (0, None))
+            if version is None or now - checked_at >= CHECK_INTERVAL:
+                generation = self.control.find_one({'_id': name}) or {}
+                version = (generation.get('revision', 0),
+                           generation.get('modified'))
+                self._versions[name] = now, version
+            return version
+
+    def find(self):
+        """
+        Returns the known generations, newest first.
+        """
+        return self.control.find({'_id': {'$ne': POINTER_ID}},
+                                 sort=[('created', -1)])
+
+    def find_current(self):
+        """
+        Returns the description of the current generation (`None` if it is
+        the configured database itself).
+        """
+        return self.control.find_one({'_id': self.get_current_name()})
+
+    def create(self, **info):
+        """
+        Registers a new generation and returns it as an (empty) `Database`.
+        Extra keyword arguments (e.g. the checksum of the imported file) are
+        stored along with it.
+        """
+        created = datetime.datetime.utcnow()
+        name = '{}-{}'.format(self.name, created.strftime('%Y%m%d%H%M%S%f'))
+        self.control.insert_one(dict(info, **{
+            '_id': name,
+            'status': STAGING,
+            'created': created,
+        }))
+        return self.client[name]
+
+    def update(self, name, **info):
+        self.control.update_one({'_id': name}, {'$set': info})
+
+    def touch(self, name):
+        """
+        Bumps the revision of given generation after its data has changed
+        (see `get_version()`).  The configured database is registered as a
+        generation on its first change.
+        """
+        now = datetime.datetime.utcnow()
+        self.control.update_one({'_id': name}, {
+            '$inc': {'revision': 1},
+            '$set': {'modified': now},
+            '$setOnInsert': {'status': LIVE, 'created': now},
+        }, upsert=True)
+
+    def mark_failed(self, name):
+        self._set_status(name, FAILED)
+
+    def switch(self, name):
+        """
+        Makes given generation the current one.  The pointer is a single
+        document, so the switch is atomic; it fails if the pointer has been
+        changed by someone else in the meantime.
+        """
+        current = self.get_current_name()
+        if name == current:
+            return
+
+        self._update_pointer(current, {
+            '$set': {'name': name},
+            '$push': {'history': {'$each': [current], '$position': 0}},
+        })
+
+        self._set_status(current, RETIRED)
+        self._set_status(name, LIVE)
+
+    def rollback(self):
+        """
+        Switches back to the previous generation.  The abandoned generation
+        is removed from the history (and will be garbage-collected).
+        Returns the name of the now current generation.
+        """
+        pointer = self.get_pointer()
+        if not pointer['history']:
+            raise ValueError('There is no previous generation')
+
+        current = pointer['name']
+        previous = pointer['history'][0]
+
+        self._update_pointer(current, {
+            '$set': {'name': previous},
+            '$pop': {'history': -1},
+        })
+
+        self._set_status(current, RETIRED)
+        self._set_status(previous, LIVE)
+
+        return previous
+
+    def collect_garbage(self, keep=1, include_staging=False):
+        """
+        Drops the retired and failed generations, except for the `keep` most
+        recent ones in the history (for rollbacks).  Generations being
+        imported are only dropped with `include_staging`.
+
+        The configured database is never dropped as it holds the pointer;
+        only its data collections are.
+
+        Returns the names of the dropped generations.
+        """
+        pointer = self.get_pointer()
+        kept = set([pointer['name']] + pointer['history'][:keep])
+
+        candidates = pointer['history'][keep:] + [
+            x['_id'] for x in self.find()
+            if include_staging or x['status'] != STAGING]
+
+        dropped = []
+        for name in candidates:
+            if name not in kept and name not in dropped:
+                dropped.append(name)
+
+        for name in dropped:
+            if name == self.name:
+                db = self.client[name]
+                for collection_name in db.list_collection_names():
+                    if collection_name != COLLECTION:
+                        db.drop_collection(collection_name)
+            else:
+                self.client.drop_database(name)
+                self.control.delete_one({'_id': name})
+
+        self.control.update_one({'_id': POINTER_ID}, {
+            '$push': {'history': {'$each': [], '$slice': keep}},
+        })
+
+        return dropped
+
+    def _update_pointer(self, expected_name, update):
+        update['$set']['switched'] = datetime.datetime.utcnow()
+        try:
+            # the upsert only happens on the very first switch; otherwise
+            # it means that the pointer has been changed concurrently
+            self.control.update_one({'_id': POINTER_ID, 'name': expected_name},
+                                    update, upsert=True)
+        except DuplicateKeyError:
+            raise RuntimeError('The current generation has been changed '
+                               'by another process; please try again')
+
+    def _set_status(self, name, status):
+        self.update(name, status=status)
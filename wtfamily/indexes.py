@@ -0,0 +1,153 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+MongoDB indexes for the lookups done by the models.
+
+The fields are not listed by hand; they are derived from the models:
+
+* `id` gets a unique index if the schema requires it (and `handle` gets
+  a regular one in that case);
+* every key in `REFERENCES` (e.g. `eventref.id`) gets a regular index, which
+  MongoDB turns into a multikey one as these are lists;
+* same for the extra keys in `INDEXES` (e.g. `Person.parent_ids`);
+* the keys in `SEARCH_FIELDS` get a text index (there can be only one per
+  collection) and the search tokens made of them get a regular one.
+"""
+from pymongo import ASCENDING, TEXT, IndexModel
+
+from models import (Person, Family, Event, Citation, Source, Place,
+                    Repository, MediaObject, Note, Bookmark, NameMap,
+                    NameFormat)
+
+
+MODELS = (Person, Family, Event, Citation, Source, Place, Repository,
+          MediaObject, Note, Bookmark, NameMap, NameFormat)
+
+# query plan stage meaning that no index was used
+COLLSCAN = 'COLLSCAN'
+
+# names are not words of a natural language: no stemming and no stop words
+TEXT_INDEX_NAME = 'search'
+TEXT_INDEX_LANGUAGE = 'none'
+
+
+def get_index_specs(model):
+    """
+    Returns a list of `(key, is_unique)` pairs for given model.
+    """
+    references = model.REFERENCES
+    if references is NotImplemented:
+        references = {}
+    keys = set(references.values()) | set(model.INDEXES)
+    if model.SEARCH_FIELDS:
+        keys.add(model.SEARCH_TOKENS_KEY)
+
+    specs = []
+    if 'id' in model.schema:
+        specs.append(('id', True))
+        # Gramps objects with IDs also have handles (see incremental import)
+        keys.add('handle')
+
+    specs.extend((key, False) for key in sorted(keys) if key != 'id')
+
+    return specs
+
+
+def ensure_indexes(db, models=MODELS):
+    """
+    Creates missing indexes for given models.  Existing indexes are left
+    intact, so it is safe to call this repeatedly.
+    """
+    print('Ensuring indexes ...')
+
+    for model in models:
+        specs = get_index_specs(model)
+        if not specs:
+            continue
+        indexes = [IndexModel([(key, ASCENDING)], unique=is_unique)
+                   for key, is_unique in specs]
+        if model.SEARCH_FIELDS:
+            indexes.append(get_text_index(model))
+        db[model.entity_name].create_indexes(indexes)
+
+        print('  * {}: {}'.format(model.entity_name, ', '.join(
+            key + (' (unique)' if is_unique else '')
+            for key, is_unique in specs)))
+        if model.SEARCH_FIELDS:
+            print('    text: {}'.format(', '.join(model.SEARCH_FIELDS)))
+
+
+def get_text_index(model):
+    """
+    Returns the text index for the `SEARCH_FIELDS` of given model (see
+    `Entity.find_matching()`).
+    """
+    return IndexModel([(key, TEXT) for key in model.SEARCH_FIELDS],
+                      name=TEXT_INDEX_NAME,
+                      default_language=TEXT_INDEX_LANGUAGE)
+
+
+def get_sample_workload(db, models=MODELS):
+    """
+    Generates `(model, conditions)` pairs mimicking the lookups done by the
+    models: by `id`, by a list of IDs and by each referencing key.  The values
+    don't matter much for the query plan; an existing ID is used anyway.
+    """
+    for model in models:
+        collection = db[model.entity_name]
+        sample = collection.find_one({}, projection=['id'])
+        if not sample:
+            continue
+        pk = sample.get('id', '')
+
+        if 'id' in model.schema:
+            yield model, {'id': pk}
+            yield model, {'id': {'$in': [pk]}}
+
+        for key, _ in get_index_specs(model):
+            if key != 'id':
+                yield model, {key: pk}
+
+
+def find_collection_scans(db, models=MODELS):
+    """
+    Runs the sample workload with `explain()` and returns the
+    `(model, conditions)` pairs which are not covered by an index.
+    """
+    unindexed = []
+    for model, conditions in get_sample_workload(db, models):
+        plan = db[model.entity_name].find(conditions).explain()
+        if COLLSCAN in _get_plan_stages(plan['queryPlanner']['winningPlan']):
+            unindexed.append((model, conditions))
+    return unindexed
+
+
+def _get_plan_stages(plan):
+    """
+    Returns the names of all stages in a (nested) query plan.
+    The layout differs between MongoDB versions, so we simply walk the tree.
+    """
+    if isinstance(plan, dict):
+        stages = [plan['stage']] if 'stage' in plan else []
+        for value in plan.values():
+            stages.extend(_get_plan_stages(value))
+        return stages
+    if isinstance(plan, list):
+        return [stage for x in plan for stage in _get_plan_stages(x)]
+    return []
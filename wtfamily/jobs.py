@@ -0,0 +1,135 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+Background jobs (e.g. imports started from the web app).
+
+The jobs run in a pool of threads within the web app process, so the request
+which started a job returns immediately and the job can be polled for its
+status.  The pool has a single thread by default: imports switch the
+database when they are done and should not overlap.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import traceback
+import uuid
+
+from etl.gramps_xml_to_mongo import ImportProgress
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# finished jobs to remember
+MAX_FINISHED_JOBS = 100
+
+
+class Job:
+    """
+    A function running in the background.  It is called with the job's
+    `ImportProgress` as `progress` and is expected to return an iterable of
+    output lines (like the ETL commands do).
+    """
+    def __init__(self, func, description):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.description = description
+        self.status = QUEUED
+        self.progress = ImportProgress()
+        self.output = []
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return '<{} {} {}>'.format(self.__class__.__name__, self.id,
+                                   self.status)
+
+    def run(self):
+        self.status = RUNNING
+        self.started = time.time()
+        try:
+            for line in self.func(progress=self.progress):
+                self.output.append(line)
+        except Exception as e:
+            traceback.print_exc()
+            self.error = '{}: {}'.format(e.__class__.__name__, e)
+            self.status = FAILED
+        else:
+            self.status = DONE
+        finally:
+            self.finished = time.time()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0
+        return (self.finished or time.time()) - self.started
+
+    def get_public_data(self):
+        return {
+            'id': self.id,
+            'description': self.description,
+            'status': self.status,
+            'phase': self.progress.phase,
+            'items': self.progress.get_counts(),
+            'elapsed': round(self.elapsed, 1),
+            'output': list(self.output),
+            'error': self.error,
+        }
+
+
+class JobQueue:
+    def __init__(self, workers=1):
+        self._executor = ThreadPoolExecutor(workers)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, description=''):
+        """
+        Schedules `func` (see `Job`) and returns the `Job` right away.
+        """
+        job = Job(func, description)
+        with self._lock:
+            self._forget_finished()
+            self._jobs[job.id] = job
+        self._executor.submit(job.run)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def find(self):
+        """
+        Returns the known jobs, newest first.
+        """
+        with self._lock:
+            return self._sort(self._jobs.values())
+
+    @staticmethod
+    def _sort(jobs):
+        return sorted(jobs, key=lambda x: x.created, reverse=True)
+
+    def _forget_finished(self):
+        finished = [x for x in self._sort(self._jobs.values()) if x.finished]
+        for job in finished[MAX_FINISHED_JOBS:]:
+            del self._jobs[job.id]
@@ -0,0 +1,233 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+In-memory index of kinship between people.
+
+The relations between people are only stored indirectly, through families,
+so walking the tree hop by hop costs a couple of queries per person.  The
+graph is built once from the `people` and `families` collections and answers
+the same questions without touching the database.  It only deals with IDs;
+use `Person.find_by_pks()` to get the actual people.
+"""
+import threading
+
+from models import Family, Person
+
+
+NO_ONE = -1
+
+
+def _ref_ids(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return [value['id']]
+    return [x['id'] if isinstance(x, dict) else x for x in value]
+
+
+def _unique(items):
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+
+class KinshipGraph:
+    """
+    People and families are numbered; relations are kept as tuples of these
+    numbers indexed by person (or family) number::
+
+        graph = KinshipGraph.for_database(db)
+        graph.parents_of('I0001')    # → ['I0002', 'I0003']
+
+    The order of relatives mirrors the order of references in the documents
+    (and hence the order used by `Person.get_parents()` and friends).
+    """
+    # `(revision, graph)` pairs by database name
+    _instances = {}
+    _lock = threading.Lock()
+
+    def __init__(self, people, families):
+        """
+        :param people: Iterable of person documents (only `id`, `childof`
+            and `parentin` are used).
+        :param families: Iterable of family documents (only `id`, `father`,
+            `mother` and `childref` are used).
+        """
+        people = list(people)
+        families = list(families)
+
+        self.person_ids = [p['id'] for p in people]
+        self.family_ids = [f['id'] for f in families]
+        self._person_index = dict((pk, i) for i, pk in enumerate(self.person_ids))
+        self._family_index = dict((pk, i) for i, pk in enumerate(self.family_ids))
+
+        def _people(pks):
+            return tuple(self._person_index[pk] for pk in pks
+                         if pk in self._person_index)
+
+        def _families(pks):
+            return tuple(self._family_index[pk] for pk in pks
+                         if pk in self._family_index)
+
+        def _person(ref):
+            pks = _people(_ref_ids(ref))
+            return pks[0] if pks else NO_ONE
+
+        # by family number
+        self._fathers = [_person(f.get('father')) for f in families]
+        self._mothers = [_person(f.get('mother')) for f in families]
+        self._family_children = [_people(_ref_ids(f.get('childref')))
+                                 for f in families]
+
+        # by person number
+        self._parent_families = [_families(_ref_ids(p.get('childof')))
+                                 for p in people]
+        self._families = [_families(_ref_ids(p.get('parentin')))
+                          for p in people]
+
+        # adjacency: child → parents, parent → children, spouse ↔ spouse
+        self._parents = [
+            self._collect(fs, lambda f: (self._mothers[f], self._fathers[f]))
+            for fs in self._parent_families]
+        self._children = [
+            self._collect(fs, lambda f: self._family_children[f])
+            for fs in self._families]
+        self._spouses = [
+            tuple(x for x in self._collect(
+                fs, lambda f: (self._fathers[f], self._mothers[f])) if x != i)
+            for i, fs in enumerate(self._families)]
+
+    def __contains__(self, pk):
+        return pk in self._person_index
+
+    def __len__(self):
+        return len(self.person_ids)
+
+    def __repr__(self):
+        return '<{} of {} people in {} families>'.format(
+            self.__class__.__name__, len(self.person_ids), len(self.family_ids))
+
+    @classmethod
+    def from_database(cls, db):
+        people = db[Person.entity_name].find(
+            {}, projection=['id', 'childof', 'parentin'])
+        families = db[Family.entity_name].find(
+            {}, projection=['id', 'father', 'mother', 'childref'])
+        return cls(people, families)
+
+    @classmethod
+    def for_database(cls, db, revision=None):
+        """
+        Returns the graph for given database, building it on first access.
+        It is rebuilt when given revision of the data differs from the one
+        it was built from (see `DatabaseGenerations.get_version()`), e.g.
+        after an incremental import into the same database.
+        """
+        with cls._lock:
+            known = cls._instances.get(db.name)
+            if known is not None and known[0] == revision:
+                return known[1]
+            graph = cls.from_database(db)
+            cls._instances[db.name] = revision, graph
+            return graph
+
+    @classmethod
+    def invalidate(cls, db):
+        """
+        Drops the graph built for given database (e.g. after an import).
+        """
+        with cls._lock:
+            cls._instances.pop(db.name, None)
+
+    @staticmethod
+    def _collect(family_numbers, get_members):
+        members = (m for f in family_numbers for m in get_members(f))
+        return tuple(_unique(m for m in members if m != NO_ONE))
+
+    def _to_ids(self, numbers):
+        return [self.person_ids[i] for i in numbers]
+
+    def parents_of(self, pk):
+        return self._to_ids(self._parents[self._person_index[pk]])
+
+    def children_of(self, pk):
+        return self._to_ids(self._children[self._person_index[pk]])
+
+    def partners_of(self, pk):
+        return self._to_ids(self._spouses[self._person_index[pk]])
+
+    def siblings_of(self, pk):
+        i = self._person_index[pk]
+        siblings = self._collect(self._parent_families[i],
+                                 lambda f: self._family_children[f])
+        return self._to_ids(x for x in siblings if x != i)
+
+    def related_to(self, pk):
+        """
+        Returns IDs of parents, siblings, partners and children (in this
+        order, without duplicates).
+        """
+        related = (self.parents_of(pk) + self.siblings_of(pk) +
+                   self.partners_of(pk) + self.children_of(pk))
+        return list(_unique(related))
+
+    def parent_families_of(self, pk):
+        i = self._person_index[pk]
+        return [self.family_ids[f] for f in self._parent_families[i]]
+
+    def families_of(self, pk):
+        i = self._person_index[pk]
+        return [self.family_ids[f] for f in self._families[i]]
+
+    def family_parents(self, family_pk):
+        """
+        Returns a `(father_id, mother_id)` tuple; either can be `None`.
+        """
+        f = self._family_index[family_pk]
+        return tuple(None if x == NO_ONE else self.person_ids[x]
+                     for x in (self._fathers[f], self._mothers[f]))
+
+    def ancestors_of(self, pk):
+        """
+        Returns IDs of given person and all their ancestors.
+        Each person is only listed once, even with pedigree collapse.
+        """
+        return self._to_ids(self._walk(self._person_index[pk], self._parents))
+
+    def descendants_of(self, pk):
+        """
+        Returns IDs of given person and all their descendants.
+        """
+        return self._to_ids(self._walk(self._person_index[pk], self._children))
+
+    @staticmethod
+    def _walk(start, adjacency):
+        seen = set()
+        stack = [start]
+        while stack:
+            i = stack.pop()
+            if i in seen:
+                continue
+            seen.add(i)
+            yield i
+            stack.extend(adjacency[i])
@@ -16,17 +16,22 @@
 #
 #    You should have received a copy of the GNU Lesser General Public License
 #    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+from collections import OrderedDict
+import copy
 import datetime
 import functools
 import itertools
 import re
 
 from cached_property import cached_property
-from flask import g
+from flask import g, has_app_context
 from dateutil.parser import parse as parse_date
 import geopy.distance
 
+from pagination import make_after_conditions
+import phonetic
 from schema import *
+import search
 
 
 RELATED_KEY_PREFIX = 'related_'
@@ -48,6 +53,265 @@ def icount(iterable):
     return sum(1 for _ in iterable)
 
 
+def _strip_id_suffix(key):
+    """
+    Turns a MongoDB lookup key into a document key: 'eventref.id' → 'eventref'
+    """
+    if key.endswith('.id'):
+        key = key.partition('.id')[0]
+    return key
+
+
+def _raw(key):
+    """
+    A pretty field (see `Entity.PRETTY_FIELDS`) with the document value as is.
+    """
+    return (key,), lambda obj: obj._data.get(key)
+
+
+def _refs(key):
+    """
+    A pretty field with the IDs referenced by the document value.
+    """
+    return (key,), lambda obj: _simplified_refs(obj._data.get(key))
+
+
+def _make_projection(keys):
+    """
+    Returns a MongoDB projection including given (possibly dotted) document
+    keys.  Keys within other included keys are dropped as MongoDB rejects
+    such "path collisions".
+    """
+    keys = set(keys)
+    return dict((key, True) for key in sorted(keys)
+                if not any(key.startswith(k + '.') for k in keys))
+
+
+class IdentityMap:
+    """
+    Keeps one instance per `(model, id)` pair within a unit of work (normally
+    a single web request), so that a document is fetched and wrapped only once
+    no matter how many relationships point to it.
+    """
+    def __init__(self):
+        self._instances = {}
+
+    def __len__(self):
+        return len(self._instances)
+
+    def get(self, model, pk):
+        return self._instances.get((model, pk))
+
+    def add(self, instance):
+        """
+        Registers given instance and returns the canonical one (which may be
+        a previously registered instance with the same model and ID).
+        """
+        key = type(instance), instance.id
+        return self._instances.setdefault(key, instance)
+
+    def clear(self):
+        self._instances.clear()
+
+
+class Ref:
+    """
+    A relationship where the referenced IDs are stored in the document
+    itself, e.g. `Family.father` (``{'father': {'id': 'I0001'}}``).
+    """
+    def __init__(self, model_name, key):
+        self.model_name = model_name
+        self.key = _strip_id_suffix(key)
+
+    @property
+    def model(self):
+        return _get_model(self.model_name)
+
+    @property
+    def cache_key(self):
+        return 'ref', self.model, self.key
+
+    def prefetch(self, instances):
+        pks_by_instance = [(obj, _extract_ids(obj, self.key))
+                           for obj in instances]
+        all_pks = itertools.chain(*(pks for _, pks in pks_by_instance))
+        related = self.model.find_by_pks(all_pks)
+        related_by_pk = dict((x.id, x) for x in related)
+
+        for obj, pks in pks_by_instance:
+            obj._prefetched[self.cache_key] = [
+                related_by_pk[pk] for pk in pks if pk in related_by_pk]
+
+        return related
+
+
+class BackRef:
+    """
+    A relationship where the *other* model references this one (using the key
+    declared in its `REFERENCES`), e.g. `Event.people`.
+    """
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    @property
+    def model(self):
+        return _get_model(self.model_name)
+
+    def get_cache_key(self, owner_model):
+        key = self.model.REFERENCES[owner_model.__name__]
+        return 'backref', self.model, key
+
+    def prefetch(self, instances):
+        owner_model = type(instances[0])
+        cache_key = self.get_cache_key(owner_model)
+        _, model, key = cache_key
+
+        pks = [obj.id for obj in instances]
+        related = list(model.find({key: {'$in': pks}}))
+
+        related_by_pk = {}
+        for obj in related:
+            for pk in _extract_ids(obj, _strip_id_suffix(key)):
+                related_by_pk.setdefault(pk, []).append(obj)
+
+        for obj in instances:
+            obj._prefetched[cache_key] = related_by_pk.get(obj.id, [])
+
+        return related
+
+
+def prefetch_related(instances, *names):
+    """
+    Loads given relationships (see `Entity.RELATIONS`) for all instances at
+    once, issuing one query per relationship instead of one per instance.
+    Nested relationships are separated by dots::
+
+        prefetch_related(families, 'children', 'father.events')
+
+    Returns the instances (as a list).
+    """
+    instances = list(instances)
+    if not instances:
+        return instances
+
+    nested_by_name = OrderedDict()
+    for name in names:
+        head, _, tail = name.partition('.')
+        nested = nested_by_name.setdefault(head, [])
+        if tail:
+            nested.append(tail)
+
+    model = type(instances[0])
+    for name, nested in nested_by_name.items():
+        try:
+            relation = model.RELATIONS[name]
+        except KeyError:
+            raise ValueError('{.__name__} has no relation "{}"'
+                             .format(model, name)) from None
+        related = relation.prefetch(instances)
+        if nested:
+            prefetch_related(related, *nested)
+
+    return instances
+
+
+class ResultSet:
+    """
+    A lazy query returned by `Entity.find()`.  The query runs when the result
+    set is iterated over; until then it can be refined::
+
+        Family.find().prefetch('father', 'mother', 'children', 'events')
+    """
+    def __init__(self, model, conditions=None):
+        self.model = model
+        self.conditions = conditions
+        self._prefetch = ()
+        self._sort = None
+        self._after = None
+        self._limit = 0
+        self._fields = None
+
+    def __repr__(self):
+        return '<{} {.__name__} {}>'.format(self.__class__.__name__,
+                                            self.model, self.conditions)
+
+    def __iter__(self):
+        instances = self._iter_instances()
+        if self._prefetch:
+            instances = prefetch_related(instances, *self._prefetch)
+        return iter(instances)
+
+    def _clone(self, **kwargs):
+        clone = copy.copy(self)
+        clone.__dict__.update(kwargs)
+        return clone
+
+    def _iter_instances(self):
+        cls = self.model
+        conditions = self.conditions
+        if self._after is not None:
+            conditions = {'$and': [
+                conditions or {},
+                make_after_conditions(self._sort, self._after),
+            ]}
+        projection = None
+        if self._fields is not None:
+            projection = _make_projection(self._fields)
+        items = cls._get_collection().find(conditions, projection,
+                                           sort=self._sort, limit=self._limit)
+        for item in items:
+            try:
+                yield cls._from_document(item,
+                                         partial=projection is not None)
+            except ValidationError as e:
+                import sys
+                import pprint
+                sys.stderr.write('ERROR in {.__name__}:\n{}\n'
+                                 .format(cls, pprint.pformat(item)))
+                raise e
+
+    def prefetch(self, *names):
+        """
+        Batch-loads given relationships for all found instances.
+        See `prefetch_related()`.
+        """
+        return self._clone(_prefetch=self._prefetch + names)
+
+    def sort(self, sort):
+        """
+        Sorts by given `(key, direction)` pairs (see `pagination`).
+        """
+        return self._clone(_sort=list(sort))
+
+    def after(self, values):
+        """
+        Only finds the items which come after the one with given values of
+        the sort keys (i.e. the cursor, see `pagination`).
+        """
+        if values is not None and not self._sort:
+            raise ValueError('Cannot paginate unsorted results')
+        return self._clone(_after=values)
+
+    def limit(self, limit):
+        return self._clone(_limit=limit or 0)
+
+    def only(self, keys):
+        """
+        Only fetches given document keys (see `Entity.get_document_keys()`).
+        The instances are partial: they are not validated and not shared
+        via the identity map.
+        """
+        return self._clone(_fields=list(keys))
+
+    def count(self):
+        """
+        Returns the number of matching documents (regardless of the cursor
+        and the limit).
+        """
+        collection = self.model._get_collection()
+        return collection.count_documents(self.conditions or {})
+
+
 class Entity:
     entity_name = NotImplemented
     sort_key = None
@@ -55,14 +319,43 @@ class Entity:
 
     REFERENCES = NotImplemented
 
+    # relationships that can be batch-loaded with `ResultSet.prefetch()`
+    RELATIONS = {}
+
+    # fields (other than `id` and those in `REFERENCES`) used in lookups;
+    # see `indexes.ensure_indexes()`
+    INDEXES = ()
+
+    # fields of `get_pretty_data()`: name → (document keys, function which
+    # returns the value for an instance)
+    PRETTY_FIELDS = {}
+
+    # document keys searched by `find_matching()`; they get a text index
+    # (see `indexes.ensure_indexes()`)
+    SEARCH_FIELDS = ()
+
+    # normalized words from `SEARCH_FIELDS` and their prefixes, stored on
+    # import (see `find_by_prefix()`)
+    SEARCH_TOKENS_KEY = 'search_tokens'
+
+    # document keys the lists can be sorted by (see `pagination`); only
+    # scalar ones as the cursor can't point into an array
+    SORT_KEYS = ('id', 'handle', 'change')
+
+    # the key which makes the sort order unique (see `pagination`)
+    UNIQUE_KEY = 'id'
+
     # let them access the exception class by Entity (sub)class attribute
     ObjectNotFound = ObjectNotFound
 
-    def __init__(self, data):
+    def __init__(self, data, partial=False):
         self._data = data
 
+        # related instances batch-loaded by `prefetch_related()`
+        self._prefetched = {}
+
         # XXX degrades performance, don't use in production
-        if __debug__:
+        if __debug__ and not partial:
             self.validate()
 
     def __eq__(self, other):
@@ -81,6 +374,39 @@ class Entity:
 
         return g.mongo_db
 
+    @classmethod
+    def _get_identity_map(cls):
+        """
+        Returns the request-scoped identity map or `None` if there's none
+        (e.g. in the ETL or the debug shell).  Can be monkey-patched, too.
+        """
+        if not has_app_context():
+            return None
+
+        return g.get('identity_map')
+
+    @classmethod
+    def _from_document(cls, item, partial=False):
+        """
+        Wraps a raw document into a model instance, reusing the instance
+        already known to the identity map (if any).  Partial documents (see
+        `ResultSet.only()`) are always wrapped anew.
+        """
+        identity_map = cls._get_identity_map()
+        pk = item.get('id')
+
+        if partial:
+            return cls(item, partial=True)
+
+        if identity_map is None or pk is None:
+            return cls(item)
+
+        known = identity_map.get(cls, pk)
+        if known is not None:
+            return known
+
+        return identity_map.add(cls(item))
+
     @classmethod
     def _get_collection(cls):
         database = cls._get_database()
@@ -91,8 +417,12 @@ class Entity:
         # 'eventref.id' is fine for MongoDB lookups, but not for `__getitem__`.
         # We just strip the inner part here, it will be conditionally tried
         # anyway by `_extract_refs()` below.
-        if key.endswith('.id'):
-            key = key.partition('.id')[0]
+        key = _strip_id_suffix(key)
+
+        try:
+            return list(self._prefetched['ref', model, key])
+        except KeyError:
+            pass
 
         try:
             refs = self._data[key]
@@ -108,11 +438,7 @@ class Entity:
         if not isinstance(pks, list):
             pks = [pks]
 
-        return model.find({
-            'id': {
-                '$in': pks
-            }
-        })
+        return model.find_by_pks(pks)
 
     def find_related(self, other_cls, by_key=None):
         """
@@ -151,6 +477,12 @@ class Entity:
         assert issubclass(other_cls, Entity)
         key = cls.REFERENCES[other_cls.__name__]
 
+        if isinstance(other_cls_or_obj, Entity):
+            try:
+                return list(other_instance._prefetched['backref', cls, key])
+            except KeyError:
+                pass
+
         return cls.find({key: other_id})
 
     @classmethod
@@ -163,35 +495,97 @@ class Entity:
 
     @classmethod
     def find(cls, conditions=None):
-        for item in cls._get_collection().find(conditions):
-            try:
-                yield cls(item)
-            except ValidationError as e:
-                import sys
-                import pprint
-                sys.stderr.write('ERROR in {.__name__}:\n{}\n'
-                                 .format(cls, pprint.pformat(item)))
-                raise e
+        return ResultSet(cls, conditions)
+
+    @classmethod
+    def find_matching(cls, query):
+        """
+        Returns a `ResultSet` of the instances which have all words of given
+        query in their `SEARCH_FIELDS`.  The words are matched as a whole,
+        regardless of case and diacritics.
+        """
+        if not cls.SEARCH_FIELDS:
+            raise ValueError('{.__name__} cannot be searched'.format(cls))
+
+        # quoted words must all be present (unquoted ones are OR'ed)
+        words = query.replace('"', ' ').split()
+        if not words:
+            return cls.find()
+        search = ' '.join('"{}"'.format(word) for word in words)
+        return cls.find({'$text': {'$search': search}})
+
+    @classmethod
+    def find_by_prefix(cls, query):
+        """
+        Returns a `ResultSet` of the instances which have words starting
+        with each word of given query (e.g. for type-ahead).  See `search`.
+        """
+        if not cls.SEARCH_FIELDS:
+            raise ValueError('{.__name__} cannot be searched'.format(cls))
+
+        words = search.split_words(query)
+        if not words:
+            return cls.find()
+        return cls.find({cls.SEARCH_TOKENS_KEY: {'$all': words}})
+
+    @classmethod
+    def get_search_texts(cls, data, group_as=None):
+        """
+        Returns the strings found in given document under `SEARCH_FIELDS`.
+
+        :param group_as: Dictionary of name group aliases by surname (see
+            `NameMap`), for the models which have them.
+        """
+        texts = []
+        for key in cls.SEARCH_FIELDS:
+            texts.extend(_find_strings(data, key.split('.')))
+        return texts
 
     @classmethod
     def find_one(cls, conditions=None):
+        # a lookup by ID alone can be answered by the identity map
+        pk = (conditions or {}).get('id')
+        if isinstance(pk, str) and len(conditions) == 1:
+            identity_map = cls._get_identity_map()
+            if identity_map is not None:
+                known = identity_map.get(cls, pk)
+                if known is not None:
+                    return known
+
         item = cls._get_collection().find_one(conditions)
         if item:
-            return cls(item)
+            return cls._from_document(item)
+
+    @classmethod
+    def find_by_pks(cls, pks):
+        """
+        Returns a list of instances with given IDs (in the same order,
+        without duplicates).  Only the IDs not yet known to the identity map
+        are fetched from the database, all in one query.
+        """
+        pks = list(OrderedDict.fromkeys(pks))
+        identity_map = cls._get_identity_map()
+
+        found = {}
+        if identity_map is not None:
+            for pk in pks:
+                known = identity_map.get(cls, pk)
+                if known is not None:
+                    found[pk] = known
+
+        missing = [pk for pk in pks if pk not in found]
+        if missing:
+            for obj in cls.find({'id': {'$in': missing}}):
+                found[obj.id] = obj
+
+        return [found[pk] for pk in pks if pk in found]
 
-    # FIXME optimize! this is insane.
     @classmethod
     def find_by_event_ref(cls, pk):
         # anything except Event can reference to an Event
         return cls.find({
-            'eventref': pk
+            cls.REFERENCES['Event']: pk
         })
-        for obj in cls.find():
-            refs = obj._data.get('eventref')
-            if not refs:
-                continue
-            if pk in _extract_refs(refs):
-                yield obj
 
     @classmethod
     def aggregate(cls, conditions, *related_models):
@@ -289,12 +683,16 @@ class Entity:
         return self._data['handle']
 
     def validate(self):
+        self.validate_data(self._data)
+
+    @classmethod
+    def validate_data(cls, data):
         try:
-            validate(self.schema, self._data)
+            validate(cls.schema, data)
         except ValidationError as e:
             import pprint
-            pprint.pprint(self.schema)
-            pprint.pprint(self._data)
+            pprint.pprint(cls.schema)
+            pprint.pprint(data)
             raise e from None
 
     @property
@@ -305,13 +703,15 @@ class Entity:
     def is_private(self):
         return self._data.get('priv', False)
 
-    def get_public_data(self, protect=True):
+    def get_public_data(self, protect=True, fields=None):
         """
         Object data in a simplified and predictable format.
         No string-or-list-of-dicts and such nonsense.
         Main purpose: to display the item without extra logic in the View.
+
+        :param fields: Names of the fields to compute (all by default).
         """
-        data = self.get_pretty_data()
+        data = self.get_pretty_data(fields)
         def _protect_value(value):
             if protect:
                 if isinstance(value, str):
@@ -329,21 +729,40 @@ class Entity:
         else:
             return data
 
-    def get_pretty_data(self):
+    def get_pretty_data(self, fields=None):
         related_keys = [k for k in self._data.keys() if
-                        k.startswith(RELATED_KEY_PREFIX)]
+                        k.startswith(RELATED_KEY_PREFIX) and
+                        (fields is None or k in fields)]
         related_data = {}
         for key in related_keys:
             #related_data[key] = [_strip_objectid(x) for x in self._data[key]]
             related_data[key] = [x.get_pretty_data() for x in self._data[key]]
 
-        return dict(related_data, **self._get_pretty_data())
+        return dict(related_data, **self._get_pretty_data(fields))
 
-    def _get_pretty_data(self):
-        raise NotImplementedError
+    def _get_pretty_data(self, fields=None):
+        return dict((name, func(self))
+                    for name, (_, func) in self.PRETTY_FIELDS.items()
+                    if fields is None or name in fields)
 
-    def matches_query(self, query):
-        raise NotImplementedError
+    @classmethod
+    def get_document_keys(cls, fields):
+        """
+        Returns the document keys needed to compute given pretty fields (see
+        `ResultSet.only()`).  Raises `ValueError` for unknown fields.
+        """
+        keys = {'id', 'priv'}
+        for name in fields:
+            if name == 'id' or name.startswith(RELATED_KEY_PREFIX):
+                # related data is only there if aggregated
+                continue
+            try:
+                field_keys, _ = cls.PRETTY_FIELDS[name]
+            except KeyError:
+                raise ValueError('{.__name__} has no field "{}"'
+                                 .format(cls, name)) from None
+            keys.update(field_keys)
+        return keys
 
     def save(self):
         self.validate()
@@ -355,33 +774,36 @@ class Entity:
 class Family(Entity):
     entity_name = 'families'
     schema = FAMILY_SCHEMA
+    SORT_KEYS = Entity.SORT_KEYS + ('rel.type',)
     REFERENCES = {
         'Event': 'events.id',
     }
+    RELATIONS = {
+        'father': Ref('Person', 'father'),
+        'mother': Ref('Person', 'mother'),
+        'children': Ref('Person', 'childref'),
+        'events': Ref('Event', 'events.id'),
+    }
 
     def __repr__(self):
         return '{} + {}'.format(self.father or '?',
                                 self.mother or '?')
 
     def _get_participant(self, key):
-        try:
-            pk = self._data[key]['id']
-        except KeyError:
-            return None
-        else:
-            return Person.find_one({'id': pk})
+        refs = self._find_refs(key, Person)
+        if refs:
+            return refs[0]
 
-    def _get_pretty_data(self):
-        return {
-            # TODO use foo_id for IDs
-            'father': self._data.get('father'),
-            'mother': self._data.get('mother'),
-            'citation_ids': _simplified_refs(self._data.get('citationref')),
-            'note_ids': self._data.get('noteref'),
-            'child_ids': _simplified_refs(self._data.get('childref')),
-            'event_ids': _simplified_refs(self._data.get('events')),
-            'attributes': self._data.get('attribute'),
-        }
+    PRETTY_FIELDS = {
+        # TODO use foo_id for IDs
+        'father': _raw('father'),
+        'mother': _raw('mother'),
+        'citation_ids': _refs('citationref'),
+        'note_ids': _raw('noteref'),
+        'child_ids': _refs('childref'),
+        'event_ids': _refs('events'),
+        'attributes': _raw('attribute'),
+    }
 
     @property
     def father(self):
@@ -427,13 +849,40 @@ class Family(Entity):
 class Person(Entity):
     entity_name = 'people'
     schema = PERSON_SCHEMA
+    SORT_KEYS = Entity.SORT_KEYS + ('gender',)
     REFERENCES = {
         'Citation': 'citationref.id',
         'Event': 'eventref.id',
         'MediaObject': 'objectref.id',
     }
+    RELATIONS = {
+        'events': Ref('Event', 'eventref.id'),
+        'citations': Ref('Citation', 'citationref.id'),
+        'parent_families': Ref('Family', 'childof'),
+        'families': Ref('Family', 'parentin'),
+    }
     NAME_TEMPLATE = '{first} {patronymic} {primary} ({nonpatronymic})'
 
+    # IDs of parents from all families, denormalized on import
+    PARENT_IDS_KEY = 'parent_ids'
+
+    # Daitch–Mokotoff codes of all surnames, computed on import
+    PHONETIC_CODES_KEY = 'phonetic_codes'
+
+    # surnames are either strings or dicts
+    SEARCH_FIELDS = (
+        'name.first',
+        'name.surname',
+        'name.surname.text',
+        'name.nick',
+        'name.group',
+    )
+
+    INDEXES = (
+        PARENT_IDS_KEY,
+        PHONETIC_CODES_KEY,
+    )
+
     # these are for templates, etc.
     GENDER_MALE = 'M'
     GENDER_FEMALE = 'F'
@@ -449,26 +898,27 @@ class Person(Entity):
     def _format_one_name(self, template=NAME_TEMPLATE):
         return self._format_all_names(template)[0]
 
-    def _get_pretty_data(self):
-        return {
-            # TODO use foo_id for IDs
-            'group_names': list(self.group_names),
-            'group_name': self.group_name,
-            'names': self.names,
-            'name': self.name,
-            'first_and_last_names': self.first_and_last_names,
-            'initials': self.initials,
-            'gender': self.gender,
-            'birth': str(self.birth),
-            'death': str(self.death),
-            'age': self.age,
-            'attributes': self.attributes,
-            'child_in_families': _simplified_refs(self._data.get('childof')),
-            'parent_in_families': _simplified_refs(self._data.get('parentin')),
-            'citation_ids': _simplified_refs(self._data.get('citationref')),
-            'note_ids': _simplified_refs(self._data.get('noteref')),
-            'event_ids': _simplified_refs(self._data.get('eventref')),
-        }
+    PRETTY_FIELDS = {
+        # TODO use foo_id for IDs
+        'group_names': (('name',), lambda x: list(x.group_names)),
+        'group_name': (('name',), lambda x: x.group_name),
+        'names': (('name',), lambda x: x.names),
+        'name': (('name',), lambda x: x.name),
+        'first_and_last_names': (('name',),
+                                 lambda x: x.first_and_last_names),
+        'initials': (('name',), lambda x: x.initials),
+        'gender': (('gender',), lambda x: x.gender),
+        # birth, death and age are derived from events
+        'birth': (('eventref',), lambda x: str(x.birth)),
+        'death': (('eventref',), lambda x: str(x.death)),
+        'age': (('eventref',), lambda x: x.age),
+        'attributes': (('attribute',), lambda x: x.attributes),
+        'child_in_families': _refs('childof'),
+        'parent_in_families': _refs('parentin'),
+        'citation_ids': _refs('citationref'),
+        'note_ids': _refs('noteref'),
+        'event_ids': _refs('eventref'),
+    }
 
     @property
     def names(self):
@@ -563,7 +1013,30 @@ class Person(Entity):
     def get_families(self):
         return self.find_related(Family, by_key='parentin')
 
+    @classmethod
+    def _get_kinship_graph(cls):
+        """
+        Returns the in-memory kinship index (see `kinship.KinshipGraph`) or
+        `None` if there's none (e.g. outside of a request).
+        """
+        if not has_app_context():
+            return None
+
+        return g.get('kinship_graph')
+
+    def _get_kin_from_graph(self, method_name):
+        graph = self._get_kinship_graph()
+        if graph is None or self.id not in graph:
+            return None
+        pks = getattr(graph, method_name)(self.id)
+        return Person.find_by_pks(pks)
+
     def get_parents(self):
+        kin = self._get_kin_from_graph('parents_of')
+        if kin is not None:
+            yield from kin
+            return
+
         for family in self.get_parent_families():
             if family.mother:
                 yield family.mother
@@ -571,12 +1044,22 @@ class Person(Entity):
                 yield family.father
 
     def get_siblings(self):
+        kin = self._get_kin_from_graph('siblings_of')
+        if kin is not None:
+            yield from kin
+            return
+
         for family in self.get_parent_families():
             for child in family.children:
                 if child != self:
                     yield child
 
     def get_partners(self):
+        kin = self._get_kin_from_graph('partners_of')
+        if kin is not None:
+            yield from kin
+            return
+
         for family in self.get_families():
             partners = family.father, family.mother
             for partner in partners:
@@ -584,29 +1067,123 @@ class Person(Entity):
                     yield partner
 
     def get_children(self):
+        kin = self._get_kin_from_graph('children_of')
+        if kin is not None:
+            yield from kin
+            return
+
         for family in self.get_families():
             for child in family.children:
                 yield child
 
-    def find_ancestors(self):
-        stack = [self]
-        while stack:
-            p = stack.pop()
-            yield p
-            for parent in p.get_parents():
-                stack.append(parent)
-
-    def find_descendants(self):
-        stack = [self]
-        while stack:
-            p = stack.pop()
-            yield p
-            for child in p.get_children():
-                stack.append(child)
+    def find_ancestors(self, max_generations=None):
+        """
+        Yields this person and their ancestors, each one only once.
+        See `trace_ancestors()`.
+        """
+        for generation, person in self.trace_ancestors(max_generations):
+            yield person
+
+    def find_descendants(self, max_generations=None):
+        """
+        Yields this person and their descendants, each one only once.
+        See `trace_descendants()`.
+        """
+        for generation, person in self.trace_descendants(max_generations):
+            yield person
+
+    def find_hourglass(self, max_generations=None):
+        """
+        Returns a list of this person, their ancestors and descendants.
+        """
+        people = itertools.chain(self.find_ancestors(max_generations),
+                                 self.find_descendants(max_generations))
+        return list(OrderedDict((p.id, p) for p in people).values())
+
+    def trace_ancestors(self, max_generations=None):
+        """
+        Returns a list of `(generation, person)` pairs sorted by generation:
+        this person (generation 0), their parents (1), grandparents (2) and so
+        on, up to `max_generations` (unlimited if `None`).  Each person is
+        listed once, with the nearest generation, even with pedigree collapse.
+
+        The walk is done by MongoDB in a single aggregation (`$graphLookup`
+        over `parent_ids`, denormalized from families on import).
+        """
+        return self._trace_kin(max_generations, start_with='$parent_ids',
+                               connect_from='parent_ids', connect_to='id',
+                               get_next=Person.get_parents)
+
+    def trace_descendants(self, max_generations=None):
+        """
+        Same as `trace_ancestors()` but for children, grandchildren, etc.
+        """
+        return self._trace_kin(max_generations, start_with='$id',
+                               connect_from='id', connect_to='parent_ids',
+                               get_next=Person.get_children)
+
+    def _trace_kin(self, max_generations, start_with, connect_from,
+                   connect_to, get_next):
+        if max_generations is not None and max_generations < 1:
+            return [(0, self)]
+
+        if self.PARENT_IDS_KEY not in self._data:
+            # imported before `parent_ids` were denormalized
+            return self._walk_kin(max_generations, get_next)
+
+        lookup = {
+            'from': self.entity_name,
+            'startWith': start_with,
+            'connectFromField': connect_from,
+            'connectToField': connect_to,
+            'as': 'kin',
+            'depthField': 'depth',
+        }
+        if max_generations is not None:
+            lookup['maxDepth'] = max_generations - 1
+
+        pipeline = [
+            {'$match': {'id': self.id}},
+            {'$graphLookup': lookup},
+            {'$project': {'kin': True}},
+        ]
+
+        traced = [(0, self)]
+        for item in self._get_collection().aggregate(pipeline):
+            for doc in item['kin']:
+                generation = doc.pop('depth') + 1
+                if doc['id'] != self.id:
+                    traced.append((generation, self._from_document(doc)))
+
+        return sorted(traced, key=lambda pair: pair[0])
+
+    def _walk_kin(self, max_generations, get_next):
+        "Breadth-first walk; slow fallback for `_trace_kin()`"
+        traced = [(0, self)]
+        seen = {self.id}
+        current = [self]
+        generation = 0
+        while current and (max_generations is None
+                           or generation < max_generations):
+            generation += 1
+            found = []
+            for person in current:
+                for relative in get_next(person):
+                    if relative.id not in seen:
+                        seen.add(relative.id)
+                        found.append(relative)
+                        traced.append((generation, relative))
+            current = found
+        return traced
 
     @cached_property
     @as_list
     def related_people(self):
+        kin = self._get_kin_from_graph('related_to')
+        if kin is not None:
+            yield from kin
+            return
+
         parents = list(self.get_parents())
         siblings = list(self.get_siblings())
         partners = list(self.get_partners())
@@ -658,6 +1235,44 @@ class Person(Entity):
     def is_female(self):
         return self.gender == self.GENDER_FEMALE
 
+    @classmethod
+    def get_search_texts(cls, data, group_as=None):
+        texts = super().get_search_texts(data)
+        if group_as:
+            # same as `group_names`, but without a database lookup per name
+            for name_node in data.get('name', []):
+                _, primary_surnames, _, _ = cls._get_name_parts(name_node)
+                texts.extend(group_as[x] for x in primary_surnames
+                             if x in group_as)
+        return texts
+
+    @classmethod
+    def find_by_phonetic(cls, query):
+        """
+        Returns a `ResultSet` of people whose surnames sound like each word
+        of given query, whatever the spelling or script (see `phonetic`).
+        """
+        conditions = []
+        for word in phonetic.split_words(query):
+            codes = phonetic.encode(word)
+            conditions.append({cls.PHONETIC_CODES_KEY: {'$in': codes}})
+        if not conditions:
+            return cls.find()
+        return cls.find({'$and': conditions})
+
+    @classmethod
+    def get_surnames(cls, data):
+        """
+        Returns all surnames (including patronymic ones) from all names in
+        given document.
+        """
+        surnames = []
+        for name_node in data.get('name', []):
+            _, primary, patronymic, nonpatronymic = cls._get_name_parts(
+                name_node)
+            surnames.extend(primary + patronymic + nonpatronymic)
+        return surnames
+
     @classmethod
     def _get_name_parts(cls, name_node):
 
@@ -715,12 +1330,6 @@ class Person(Entity):
             nonpatronymic = ', '.join(nonpatronymic),
         ).replace(' ()', '').strip()
 
-    def matches_query(self, query):
-        patterns = query.lower().split()
-        raw_tokens = itertools.chain(self.names, self.group_names)
-        tokens = [t.lower().strip() for t in raw_tokens]
-        return all(any(p in t.lower() for t in tokens) for p in patterns)
-
 
 def _format_dateval(dateval):
     if not dateval:
@@ -747,10 +1356,17 @@ class Event(Entity):
     entity_name = 'events'
     sort_key = lambda item: item.date
     schema = EVENT_SCHEMA
+    SORT_KEYS = Entity.SORT_KEYS + ('type', 'description')
     REFERENCES = {
         'Place': 'place.id',
         'Citation': 'citationref.id',
     }
+    RELATIONS = {
+        'place': Ref('Place', 'place.id'),
+        'citations': Ref('Citation', 'citationref.id'),
+        'people': BackRef('Person'),
+        'families': BackRef('Family'),
+    }
 
     TYPE_BIRTH = 'Birth'
     TYPE_DEATH = 'Death'
@@ -759,20 +1375,21 @@ class Event(Entity):
         #return 'Event {}'.format(self._data)
         return '{0.date} {0.type} {0.summary} {0.place}'.format(self)
 
-    def _get_pretty_data(self):
+    PRETTY_FIELDS = {
+        # TODO use foo_id for IDs
+        'type': (('type',), lambda x: x.type),
+        'date': (('date',), lambda x: str(x.date)),
+        'date_year': (('date',), lambda x: str(x.date.year)),
+        'summary': (('description',), lambda x: x.summary),
+        'place_id': (('place',), lambda x: x._get_first_place_ref()),
+        'citation_ids': _refs('citationref'),
+    }
+
+    def _get_first_place_ref(self):
         first_place_ref = _simplified_refs(self._data.get('place'))
         if isinstance(first_place_ref, list):
             first_place_ref = first_place_ref[0]
-
-        return {
-            # TODO use foo_id for IDs
-            'type': self.type,
-            'date': str(self.date),
-            'date_year': str(self.date.year),
-            'summary': self.summary,
-            'place_id': first_place_ref,
-            'citation_ids': _simplified_refs(self._data.get('citationref')),
-        }
+        return first_place_ref
 
     @property
     def type(self):
@@ -819,25 +1436,29 @@ class Place(Entity):
         'Citation': 'citationref.id',
         'Place': 'placeref.id'
     }
+    RELATIONS = {
+        'parent_places': Ref('Place', 'placeref.id'),
+        'nested_places': BackRef('Place'),
+        'events': BackRef('Event'),
+    }
     schema = PLACE_SCHEMA
+    SORT_KEYS = Entity.SORT_KEYS + ('ptitle', 'type')
+    SEARCH_FIELDS = (
+        'pname.value',
+    )
 
     def __repr__(self):
         return '{0.name}'.format(self)
 
-    def _get_pretty_data(self):
-        return {
-            # TODO use foo_id for IDs
-            'name': self.name,
-            'other_names': self.alt_names,
-            'coords': self.coords,
-            'parent_place_ids': _simplified_refs(self._data.get('placeref')),
-            'citation_ids': _simplified_refs(self._data.get('citationref')),
-            'note_ids': _simplified_refs(self._data.get('noteref')),
-        }
-
-    def matches_query(self, query):
-        patterns = query.lower().split()
-        return all(any(p in n.lower() for n in self.names) for p in patterns)
+    PRETTY_FIELDS = {
+        # TODO use foo_id for IDs
+        'name': (('pname',), lambda x: x.name),
+        'other_names': (('pname',), lambda x: x.alt_names),
+        'coords': (('coord',), lambda x: x.coords),
+        'parent_place_ids': _refs('placeref'),
+        'citation_ids': _refs('citationref'),
+        'note_ids': _refs('noteref'),
+    }
 
     @property
     def name(self):
@@ -955,27 +1576,32 @@ class Place(Entity):
 class Source(Entity):
     entity_name = 'sources'
     schema = SOURCE_SCHEMA
+    SORT_KEYS = Entity.SORT_KEYS + ('stitle', 'sauthor', 'spubinfo',
+                                    'sabbrev')
     sort_key = lambda item: item.title
+    RELATIONS = {
+        'citations': BackRef('Citation'),
+        'repository': Ref('Repository', 'reporef'),
+        'notes': Ref('Note', 'noteref.id'),
+    }
+    SEARCH_FIELDS = (
+        'stitle',
+        'sauthor',
+        'spubinfo',
+    )
 
     def __repr__(self):
         return str(self.title)
 
-    def _get_pretty_data(self):
-        return {
-            # TODO use foo_id for IDs
-            'title': self.title,
-            'author': self.author,
-            'pubinfo': self.pubinfo,
-            'abbrev': self.abbrev,
-            'repository': _simplified_refs(self._data.get('reporef')),
-            'note_ids': _simplified_refs(self._data.get('noteref')),
-        }
-
-    def matches_query(self, query):
-        patterns = query.lower().split()
-        raw_tokens = self.title, self.author, self.pubinfo
-        tokens = [t.lower() for t in raw_tokens if t]
-        return all(any(p in t for t in tokens) for p in patterns)
+    PRETTY_FIELDS = {
+        # TODO use foo_id for IDs
+        'title': _raw('stitle'),
+        'author': _raw('sauthor'),
+        'pubinfo': _raw('spubinfo'),
+        'abbrev': _raw('sabbrev'),
+        'repository': _refs('reporef'),
+        'note_ids': _refs('noteref'),
+    }
 
     @property
     def title(self):
@@ -1005,26 +1631,32 @@ class Source(Entity):
 class Citation(Entity):
     entity_name = 'citations'
     schema = CITATION_SCHEMA
+    SORT_KEYS = Entity.SORT_KEYS + ('page', 'confidence', 'sourceref.id')
 
     REFERENCES = {
         'Source': 'sourceref.id',
         'Note': 'noteref.id',
         'MediaObject': 'objref.id',
     }
+    RELATIONS = {
+        'source': Ref('Source', 'sourceref'),
+        'notes': Ref('Note', 'noteref.id'),
+        'events': BackRef('Event'),
+        'people': BackRef('Person'),
+    }
 
     def __repr__(self):
         if self.page:
             return self.page
         return str(self.id)
 
-    def _get_pretty_data(self):
-        return {
-            'page': self.page,
-            'date': str(self.date),
-            'source': _simplified_refs(self._data.get('sourceref')),
-            'note_ids': _simplified_refs(self._data.get('noteref')),
-            'media_ids': _simplified_refs(self._data.get('objref')),
-        }
+    PRETTY_FIELDS = {
+        'page': _raw('page'),
+        'date': (('date',), lambda x: str(x.date)),
+        'source': _refs('sourceref'),
+        'note_ids': _refs('noteref'),
+        'media_ids': _refs('objref'),
+    }
 
     @property
     def source(self):
@@ -1068,17 +1700,17 @@ class Citation(Entity):
 class Note(Entity):
     entity_name = 'notes'
     schema = NOTE_SCHEMA
+    SORT_KEYS = Entity.SORT_KEYS + ('type',)
     REFERENCES = {
         'MediaObject': 'objref.id',
     }
 
-    def _get_pretty_data(self):
-        return {
-            # TODO use foo_id for IDs
-            'text': self.text,
-            'type': self.type,
-            'media': _simplified_refs(self._data.get('objref')),
-        }
+    PRETTY_FIELDS = {
+        # TODO use foo_id for IDs
+        'text': (('text',), lambda x: x.text),
+        'type': (('type',), lambda x: x.type),
+        'media': _refs('objref'),
+    }
 
     @property
     def text(self):
@@ -1097,6 +1729,10 @@ class Bookmark(Entity):
     entity_name = 'bookmarks'
     schema = BOOKMARK_SCHEMA
 
+    # these have no IDs
+    SORT_KEYS = ('target', 'hlink')
+    UNIQUE_KEY = '_id'
+
 
 class NameMap(Entity):
     entity_name = 'namemaps'
@@ -1104,17 +1740,25 @@ class NameMap(Entity):
 
     TYPE_GROUP_AS = 'group_as'
 
+    INDEXES = (
+        'type',
+    )
+
+    # these have no IDs
+    SORT_KEYS = ('type', 'key', 'value')
+    UNIQUE_KEY = '_id'
+
+    # `(data version, {key: value})` pairs by database name
     _cache_by_group_as = {}
 
     def __repr__(self):
         return '<{} "{}" → "{}">'.format(self.type, self.key, self.value)
 
-    def _get_pretty_data(self):
-        return {
-            'type': self.type,
-            'key': self.key,
-            'value': self.value,
-        }
+    PRETTY_FIELDS = {
+        'type': _raw('type'),
+        'key': _raw('key'),
+        'value': _raw('value'),
+    }
 
     @property
     def type(self):
@@ -1129,7 +1773,7 @@ class NameMap(Entity):
         return self._data.get('value')
 
     @classmethod
-    def group_as(self, key):
+    def group_as(cls, key):
         # XXX optimization for in-memory store.
         # This was the original (slow) version:
         #
@@ -1137,24 +1781,41 @@ class NameMap(Entity):
         #       if item.type == self.TYPE_GROUP_AS and item.key == key:
         #           return item.value
         #
-        if not self._cache_by_group_as:
-            for item in self.find():
-                if item.type == self.TYPE_GROUP_AS:
-                    self._cache_by_group_as[item.key] = item.value
-        try:
-            return self._cache_by_group_as[key]
-        except KeyError:
-            return None
+        return cls._get_group_aliases().get(key)
+
+    @classmethod
+    def _get_group_aliases(cls):
+        """
+        Returns the `group_as` mapping of current database.  It is loaded
+        once per version of the data (see `g.db_version`), so an import or
+        a switch to another generation is picked up.
+        """
+        db_name = cls._get_database().name
+        version = g.get('db_version') if has_app_context() else None
+
+        known = cls._cache_by_group_as.get(db_name)
+        if known is not None and known[0] == version:
+            return known[1]
+
+        aliases = dict((item.key, item.value) for item in
+                       cls.find({'type': cls.TYPE_GROUP_AS}))
+        cls._cache_by_group_as[db_name] = version, aliases
+        return aliases
 
 
 class NameFormat(Entity):
     entity_name = 'name-formats'
     schema = NAME_FORMAT_SCHEMA
 
+    # these have no IDs
+    SORT_KEYS = ('name', 'number')
+    UNIQUE_KEY = '_id'
+
 
 class MediaObject(Entity):
     entity_name = 'objects'
     schema = MEDIA_OBJECT_SCHEMA
+    SORT_KEYS = Entity.SORT_KEYS + ('file.description', 'file.mime')
 
     @property
     def src(self):
@@ -1183,6 +1844,7 @@ class MediaObject(Entity):
 class Repository(Entity):
     entity_name = 'repositories'
     schema = REPOSITORY_SCHEMA
+    SORT_KEYS = Entity.SORT_KEYS + ('rname', 'type')
 
     def __repr__(self):
         return '<Repository {type} {rname}>'.format(**self._data)
@@ -1204,6 +1866,28 @@ def _extract_refs(ref):
 
     return [x['id'] if isinstance(x, dict) else x for x in ref]
 
+def _find_strings(value, key_parts):
+    """
+    Returns the strings under given (split) dotted key, looking into lists
+    along the way.
+    """
+    if isinstance(value, list):
+        return [x for item in value for x in _find_strings(item, key_parts)]
+    if not key_parts:
+        return [value] if isinstance(value, str) else []
+    if isinstance(value, dict) and key_parts[0] in value:
+        return _find_strings(value[key_parts[0]], key_parts[1:])
+    return []
+
+def _get_model(name):
+    """
+    Returns the model class by its name (as used in `REFERENCES`).
+    """
+    model = globals().get(name)
+    if not (isinstance(model, type) and issubclass(model, Entity)):
+        raise LookupError('Unknown model "{}"'.format(name))
+    return model
+
 def _extract_ids(obj, key):
     value = obj._data.get(key)
     if not value:
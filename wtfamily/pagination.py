@@ -0,0 +1,181 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+Cursor-based (keyset) pagination.
+
+A page is requested by the values of the sort keys of the last item on the
+previous page (the "cursor") rather than by an offset, so the database can
+jump straight to it using an index and the pages don't shift when items are
+added or removed.  The sort always ends with a unique key (`id` unless the
+model declares another one, see `Entity.UNIQUE_KEY`), so the order is
+stable.
+
+Cursors are opaque URL-safe strings for the clients.  Lists which are not
+MongoDB queries are paginated in memory the same way (see `paginate()`).
+"""
+import base64
+import functools
+
+from bson import json_util
+
+
+ASCENDING = 1
+DESCENDING = -1
+
+# the default tie-breaker
+UNIQUE_KEY = 'id'
+
+
+def parse_sort(value, allowed_keys=None, unique_key=UNIQUE_KEY):
+    """
+    Turns e.g. ``"-change,name"`` into ``[('change', -1), ('name', 1),
+    ('id', 1)]``.
+
+    :param allowed_keys: The keys which can be sorted by (any by default).
+        They must be scalar: MongoDB sorts by the elements of arrays, which
+        a cursor cannot express.
+    :param unique_key: The key which ends the sort order.  It must be
+        present and unique in every document, or items are skipped.
+    """
+    sort = []
+    for key in (value or '').split(','):
+        key = key.strip()
+        direction = ASCENDING
+        if key.startswith('-'):
+            key = key[1:]
+            direction = DESCENDING
+        if not key:
+            continue
+        if key.startswith('$') or '..' in key:
+            raise ValueError('Bad sort key "{}"'.format(key))
+        if allowed_keys is not None and key not in allowed_keys:
+            raise ValueError('Cannot sort by "{}"'.format(key))
+        sort.append((key, direction))
+
+    if unique_key not in (key for key, _ in sort):
+        sort.append((unique_key, ASCENDING))
+
+    return sort
+
+
+def encode_cursor(values):
+    data = json_util.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        values = json_util.loads(data.decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValueError('Bad cursor "{}"'.format(cursor)) from None
+    if not isinstance(values, list):
+        raise ValueError('Bad cursor "{}"'.format(cursor))
+    return values
+
+
+def get_sort_values(document, sort):
+    """
+    Returns the values of the sort keys (which may be dotted) in given
+    document, i.e. the cursor pointing at it.
+    """
+    values = []
+    for key, _ in sort:
+        value = document
+        for part in key.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        values.append(value)
+    return values
+
+
+def make_after_conditions(sort, values):
+    """
+    Returns MongoDB conditions matching the documents which come after the
+    one with given sort values.  For ``a, b`` sorted in ascending order
+    that's ``a > x or (a == x and b > y)``.
+
+    MongoDB puts missing values (`None`) before anything else and does not
+    compare them with `$gt` and `$lt`, hence the special cases.
+    """
+    if len(values) != len(sort):
+        raise ValueError('The cursor does not match the sort order')
+
+    alternatives = []
+    for i, ((key, direction), value) in enumerate(zip(sort, values)):
+        equal_before = dict((k, v) for (k, _), v in zip(sort[:i], values[:i]))
+
+        if value is None:
+            if direction == DESCENDING:
+                # nothing comes after a missing value
+                continue
+            after = {key: {'$ne': None}}
+        elif direction == ASCENDING:
+            after = {key: {'$gt': value}}
+        else:
+            after = {'$or': [{key: {'$lt': value}}, {key: None}]}
+
+        alternatives.append(dict(equal_before, **after) if equal_before
+                            else after)
+
+    if not alternatives:
+        # an impossible condition: this was the last document
+        return {UNIQUE_KEY: {'$in': []}}
+    return {'$or': alternatives}
+
+
+def compare_sort_values(a, b, sort):
+    """
+    Compares two lists of sort values the way MongoDB would.
+    Returns a negative number, zero or a positive number.
+    """
+    for (_, direction), x, y in zip(sort, a, b):
+        if x == y:
+            continue
+        if x is None:
+            result = -1
+        elif y is None:
+            result = 1
+        else:
+            result = -1 if x < y else 1
+        return result * direction
+    return 0
+
+
+def paginate(items, sort, limit=None, after=None, get_document=None):
+    """
+    Same as a MongoDB query with `make_after_conditions()`, sorting and
+    limit, but in memory.  Returns the page as a list.
+
+    :param get_document: Function which returns the document for an item
+        (by default the items are documents themselves).
+    """
+    get_document = get_document or (lambda x: x)
+
+    decorated = [(get_sort_values(get_document(x), sort), x) for x in items]
+    decorated.sort(key=functools.cmp_to_key(
+        lambda x, y: compare_sort_values(x[0], y[0], sort)))
+
+    if after is not None:
+        decorated = [(values, x) for values, x in decorated
+                     if compare_sort_values(values, after, sort) > 0]
+
+    if limit:
+        decorated = decorated[:limit]
+
+    return [x for _, x in decorated]
@@ -0,0 +1,181 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+Daitch–Mokotoff soundex codes of surnames.
+
+The coding was designed for Germanic and Slavic (notably Jewish) surnames
+and maps the spellings of the same name to the same six-digit code, e.g.
+"Kusnezow" and "Kuznetsov" are both ``546470``.  Some letters sound
+differently depending on the language (e.g. "CH" is either "kh" or "tch"),
+so a name may have several codes::
+
+    >>> encode('Auerbach')
+    ['097400', '097500']
+
+Cyrillic names are transliterated first, so that "Кузнецов" matches
+"Kusnezow" as well.  The codes of the surnames are stored on import and
+covered by a multikey index (see `Person.find_by_phonetic()`).
+"""
+import re
+
+from search import normalize
+
+
+CODE_LENGTH = 6
+
+VOWELS = 'AEIOU'
+
+# pattern: [(at the start, before a vowel, elsewhere), alternative, ...]
+# (an empty string means that the letters are not coded)
+RULES = {}
+
+for patterns, codes in [
+    ('AI AJ AY', [('0', '1', '')]),
+    ('AU', [('0', '7', '')]),
+    ('A', [('0', '', '')]),
+    ('B', [('7', '7', '7')]),
+    ('CHS', [('5', '54', '54')]),
+    ('CH', [('5', '5', '5'), ('4', '4', '4')]),
+    ('CK', [('5', '5', '5'), ('45', '45', '45')]),
+    ('CZ CS CSZ CZS', [('4', '4', '4')]),
+    ('C', [('5', '5', '5'), ('4', '4', '4')]),
+    ('DRZ DRS DS DSH DSZ DZ DZH DZS', [('4', '4', '4')]),
+    ('D DT', [('3', '3', '3')]),
+    ('EI EJ EY', [('0', '1', '')]),
+    ('EU', [('1', '1', '')]),
+    ('E', [('0', '', '')]),
+    ('FB F', [('7', '7', '7')]),
+    ('G', [('5', '5', '5')]),
+    ('H', [('5', '5', '')]),
+    ('IA IE IO IU', [('1', '', '')]),
+    ('I', [('0', '', '')]),
+    ('J', [('1', '', ''), ('4', '4', '4')]),
+    ('KS', [('5', '54', '54')]),
+    ('KH K Q', [('5', '5', '5')]),
+    ('L', [('8', '8', '8')]),
+    ('MN NM', [('66', '66', '66')]),
+    ('M N', [('6', '6', '6')]),
+    ('OI OJ OY', [('0', '1', '')]),
+    ('O', [('0', '', '')]),
+    ('P PF PH', [('7', '7', '7')]),
+    ('RZ RS', [('94', '94', '94'), ('4', '4', '4')]),
+    ('R', [('9', '9', '9')]),
+    ('SCHTSCH SCHTSH SCHTCH SHTCH SHCH SHTSH STCH STSCH SC STRZ STRS STSH '
+     'SZCZ SZCS', [('2', '4', '4')]),
+    ('SHT SCHT SCHD ST SZT SHD SZD SD', [('2', '43', '43')]),
+    ('SCH SH SZ S', [('4', '4', '4')]),
+    ('TCH TTCH TTSCH TRZ TRS TSCH TSH TS TTS TTSZ TC TZ TTZ TZS TSZ',
+     [('4', '4', '4')]),
+    ('TH T', [('3', '3', '3')]),
+    ('UI UJ UY', [('0', '1', '')]),
+    ('U UE', [('0', '', '')]),
+    ('V W', [('7', '7', '7')]),
+    ('X', [('5', '54', '54')]),
+    ('Y', [('1', '', '')]),
+    ('ZDZ ZDZH ZHDZH', [('2', '4', '4')]),
+    ('ZD ZHD', [('2', '43', '43')]),
+    ('ZH ZS ZSCH ZSH Z', [('4', '4', '4')]),
+]:
+    for pattern in patterns.split():
+        RULES[pattern] = codes
+
+MAX_PATTERN_LENGTH = max(len(x) for x in RULES)
+
+# a transliteration which the coding understands, e.g. "ч" is "tch" rather
+# than "ch" (which would be coded as "kh" too)
+CYRILLIC = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'ґ': 'g', 'д': 'd', 'е': 'e',
+    'ё': 'e', 'є': 'ye', 'ж': 'zh', 'з': 'z', 'и': 'i', 'і': 'i', 'ї': 'yi',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ў': 'u', 'ф': 'f', 'х': 'kh',
+    'ц': 'ts', 'ч': 'tch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y',
+    'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+})
+
+# letters which the coding knows of; anything else (apostrophes, other
+# scripts) is ignored
+WORD_RE = re.compile(r'[A-Z]+')
+
+
+def transliterate(text):
+    """
+    Returns given text in Latin letters (only Cyrillic is supported; other
+    letters are kept as is).
+    """
+    return text.casefold().translate(CYRILLIC)
+
+
+def split_words(text):
+    """
+    Returns the words of given text as the coding expects them: in upper
+    case, transliterated and without diacritics.
+    """
+    return WORD_RE.findall(normalize(transliterate(text)).upper())
+
+
+def encode(word):
+    """
+    Returns the sorted Daitch–Mokotoff codes of given word (empty if there
+    are no letters to code).
+    """
+    words = split_words(word)
+    if not words:
+        return []
+    letters = ''.join(words)
+
+    # each branch is the code so far and the last coded sound (adjacent
+    # letters with the same sound are coded once)
+    branches = [('', None)]
+    i = 0
+    while i < len(letters):
+        for length in range(min(MAX_PATTERN_LENGTH, len(letters) - i), 0, -1):
+            pattern = letters[i:i + length]
+            if pattern in RULES:
+                break
+
+        following = letters[i + length:i + length + 1]
+        if i == 0:
+            column = 0
+        elif following and following in VOWELS:
+            column = 1
+        else:
+            column = 2
+
+        branches = set(
+            (code if last is not None and last.endswith(sound)
+             else code + sound, sound)
+            for code, last in branches
+            for sound in (x[column] for x in RULES[pattern]))
+
+        i += length
+
+    return sorted(set(code[:CODE_LENGTH].ljust(CODE_LENGTH, '0')
+                      for code, _ in branches))
+
+
+def make_phonetic_codes(texts):
+    """
+    Returns the sorted unique codes of all words in given texts (e.g.
+    surnames).
+    """
+    codes = set()
+    for text in texts:
+        for word in split_words(text):
+            codes.update(encode(word))
+    return sorted(codes)
@@ -0,0 +1,279 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+Server-side cache of complete responses.
+
+The data only changes when it is imported, so the responses of the heavy
+views are cached by the version of the database generation they were made
+from (see `DatabaseGenerations.get_version()`), the URL path and the query
+arguments.  An import changes the version, so the new data is computed on
+the first request and the old entries are never hit again; they are
+eventually evicted (the cache is an LRU one with a TTL, bounded both by
+the number of entries and by their total size).
+
+Concurrent requests for the same missing entry wait for the first one to
+compute it instead of computing it too.  Streamed responses (the lists) are
+sent as they are made and only cached once they are complete, so the other
+requests wait until the first one is sent.  The large ones are never
+buffered as a whole: as soon as a response turns out to be too large to be
+cached, the waiting requests make it themselves::
+
+    @cached
+    def family_list():
+        ...
+"""
+from collections import OrderedDict
+import functools
+import sys
+import threading
+import time
+
+from flask import Response, g, make_response, request
+
+
+# entries (responses) to keep
+MAX_SIZE = 256
+
+# total size of the entries (bytes); larger ones are not cached at all
+MAX_BYTES = 64 * 1024 * 1024
+MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
+# seconds to keep an entry
+TTL = 60 * 60
+
+# seconds to wait for another thread to compute an entry (e.g. to send a
+# streamed response to a slow client) before computing it anyway
+WAIT_TIMEOUT = 30
+
+
+class ResponseCache:
+    """
+    A thread-safe LRU cache with a TTL and "single-flight" computation of
+    the missing values.
+
+    :param get_size: Function which returns the size of a value in bytes.
+    """
+    def __init__(self, max_size=MAX_SIZE, max_bytes=MAX_BYTES,
+                 max_entry_bytes=MAX_ENTRY_BYTES, ttl=TTL,
+                 wait_timeout=WAIT_TIMEOUT, get_size=sys.getsizeof):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.get_size = get_size
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._items = OrderedDict()    # key -> (expires, size, value)
+        self._pending = {}             # key -> threading.Event
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, compute):
+        """
+        Returns the cached value for given key.  If there's none, calls
+        `compute` and caches what it returns (unless it's `None`).  If the
+        value is already being computed by another thread, waits for it.
+        """
+        value, ticket = self.acquire(key)
+        if value is not None:
+            return value
+
+        try:
+            value = compute()
+            return value
+        finally:
+            self.release(key, ticket, value)
+
+    def acquire(self, key):
+        """
+        Returns the cached value for given key and `None`, or `None` and
+        a "ticket" if the caller is to compute the value.  It must then pass
+        the ticket to `release()`, even if it fails.  Until then the other
+        callers wait for it (at most `wait_timeout` seconds, after which they
+        get `None` and no ticket, i.e. compute the value too).
+        """
+        while True:
+            with self._lock:
+                value = self._get_fresh(key)
+                if value is not None:
+                    self.hits += 1
+                    return value, None
+
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    return None, pending
+
+            # either the value is there once the other thread is done, or
+            # it failed to compute it and we'll try ourselves
+            if not pending.wait(self.wait_timeout):
+                with self._lock:
+                    self.misses += 1
+                return None, None
+
+    def release(self, key, ticket, value=None):
+        """
+        Caches given value computed with given ticket (see `acquire()`),
+        unless it's `None`, and wakes up the callers waiting for it.  Can be
+        called more than once.
+        """
+        if value is not None:
+            self.set(key, value)
+        if ticket is None:
+            return
+        with self._lock:
+            if self._pending.get(key) is ticket:
+                del self._pending[key]
+        ticket.set()
+
+    def set(self, key, value):
+        """
+        Caches given value unless it's larger than `max_entry_bytes`.
+        """
+        size = self.get_size(value)
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._delete(key)
+            self._items[key] = time.monotonic() + self.ttl, size, value
+            self._bytes += size
+            while (len(self._items) > self.max_size or
+                   self._bytes > self.max_bytes):
+                self._delete(next(iter(self._items)))
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _get_fresh(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires, _, value = item
+        if expires <= time.monotonic():
+            self._delete(key)
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def _delete(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+
+
+def _get_response_size(frozen):
+    data, _, _ = frozen
+    return len(data)
+
+
+response_cache = ResponseCache(get_size=_get_response_size)
+
+
+def cached(view):
+    """
+    Caches the successful responses of given Flask view (see the module
+    docstring).  The version of the data is expected in `g.db_version`;
+    without it the view is not cached.
+    """
+    @functools.wraps(view)
+    def _wrapper(*args, **kwargs):
+        version = g.get('db_version')
+        if version is None or request.method != 'GET':
+            return view(*args, **kwargs)
+
+        key = (request.endpoint, request.path,
+               tuple(sorted(request.args.items(multi=True)))) + version
+
+        frozen, ticket = response_cache.acquire(key)
+        if frozen is not None:
+            data, status, headers = frozen
+            return Response(data, status=status, headers=headers)
+
+        try:
+            resp = make_response(view(*args, **kwargs))
+        except BaseException:
+            response_cache.release(key, ticket)
+            raise
+
+        if resp.status_code == 200 and resp.is_streamed:
+            # cached (and the waiting requests woken up) once it's sent
+            resp.response = _iter_and_cache(resp.response, key, ticket,
+                                            resp.status_code,
+                                            list(resp.headers))
+            # in case it's never sent
+            resp.call_on_close(
+                functools.partial(response_cache.release, key, ticket))
+            return resp
+
+        frozen = None
+        if resp.status_code == 200:
+            frozen = resp.get_data(), resp.status_code, list(resp.headers)
+        response_cache.release(key, ticket, frozen)
+        return resp
+
+    return _wrapper
+
+
+def _iter_and_cache(chunks, key, ticket, status, headers):
+    """
+    Yields given chunks of a streamed response and caches the response once
+    they are all sent, unless it's too large (then the chunks are no longer
+    kept and the requests waiting for the response are woken up right away)
+    or the client has gone away.  See `ResponseCache.acquire()`.
+    """
+    kept = []
+    size = 0
+    try:
+        for chunk in chunks:
+            if kept is not None:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                size += len(chunk)
+                if size > response_cache.max_entry_bytes:
+                    kept = None
+                    response_cache.release(key, ticket)
+                else:
+                    kept.append(chunk)
+            yield chunk
+    except BaseException:
+        response_cache.release(key, ticket)
+        raise
+
+    frozen = None
+    if kept is not None:
+        frozen = b''.join(kept), status, headers
+    response_cache.release(key, ticket, frozen)
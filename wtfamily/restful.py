@@ -16,20 +16,32 @@
 #
 #    You should have received a copy of the GNU Lesser General Public License
 #    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
-import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import functools
+import hashlib
 import itertools
-import os.path
+import os
+import tempfile
 from time import time
+import traceback
 
 from confu import Configurable
-from flask import Blueprint, Response, abort, jsonify, request, render_template
+from flask import (Blueprint, Response, abort, current_app, g, json,
+                   jsonify, request, render_template, stream_with_context,
+                   url_for)
+from lxml import etree
 from pymongo.database import Database
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
+from werkzeug.sansio.multipart import (Data, Epilogue, Field, File,
+                                       MultipartDecoder, NeedData)
 
 from etl import WTFamilyETL
+from etl.gramps_xml_to_mongo import spool_chunks
+from jobs import JobQueue
 
 from models import (
+    IdentityMap,
     Person,
     Event,
     Family,
@@ -39,10 +51,37 @@ from models import (
     Note,
     NameMap,
     #MediaObject,
+    ResultSet,
+    Ref,
+    prefetch_related,
 )
+from pagination import (parse_sort, encode_cursor, decode_cursor,
+                        get_sort_values, paginate)
+from response_cache import cached, response_cache
 
 ALLOW_ANY_HOST = True
 
+# list items encoded at a time (their relationships are prefetched at once)
+STREAM_BATCH_SIZE = 100
+
+# sub-requests of a batch request (see `RESTfulService.batch()`) processed
+# concurrently
+BATCH_WORKERS = 4
+
+# what the app needs on the first page view (see the TODO on the strategy
+# for the family tree)
+BOOTSTRAP_REQUESTS = [
+    {'slug': 'families'},
+    {'slug': 'person_name_groups'},
+]
+
+# headers of the sub-responses passed to the client
+BATCH_HEADERS = 'X-Total-Count', 'X-Next-Cursor'
+
+# what the sub-requests share with the batch request (see `flask.g`); each
+# of them gets its own identity map as they run concurrently
+BATCH_SHARED_STATE = 'mongo_db', 'db_version', 'kinship_graph'
+
 
 def jsonify_with_cors(*args, **kwargs):
     resp = jsonify(*args, **kwargs)
@@ -51,26 +90,200 @@ def jsonify_with_cors(*args, **kwargs):
     return resp
 
 
+def stream_json_with_cors(batches, get_included=None):
+    """
+    Returns a response with a JSON array of items which is encoded and sent
+    batch by batch as the batches are generated, so that neither the items
+    nor the whole JSON are ever kept in memory.
+
+    If `get_included` is given, the array is wrapped as
+    ``{"data": [...], "included": ...}`` with whatever that function returns
+    once all batches are sent.
+
+    The status is sent before the batches are generated, so an error while
+    generating them can't change it.  Instead, the error is appended to the
+    unfinished JSON (which makes it invalid) and the response is aborted.
+    Run the query before calling this (see `_start()`) to report its errors
+    properly.
+    """
+    def _dumps(value):
+        return json.dumps(value, separators=(',', ':'))
+
+    def _generate():
+        yield '{"data":[' if get_included else '['
+        separator = ''
+        try:
+            for batch in batches:
+                if batch:
+                    yield separator + ','.join(_dumps(x) for x in batch)
+                    separator = ','
+            if get_included:
+                yield '],"included":' + _dumps(get_included()) + '}\n'
+            else:
+                yield ']\n'
+        except Exception as e:
+            traceback.print_exc()
+            yield '\n' + _dumps({'error': '{}: {}'.format(
+                e.__class__.__name__, e)}) + '\n'
+            raise
+
+    resp = Response(stream_with_context(_generate()),
+                    mimetype='application/json')
+    if ALLOW_ANY_HOST:
+        resp.headers.add('Access-Control-Allow-Origin', '*')
+    return resp
+
+
+def _start(items):
+    """
+    Returns an iterator over given items, already advanced to the first one,
+    so that e.g. a lazy query runs (and fails) right away.
+    """
+    items = iter(items)
+    for first in items:
+        return itertools.chain([first], items)
+    return iter(())
+
+
+def _iter_batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def parse_model_sort(model):
+    """
+    Returns the sort order requested with ``sort=-change`` (see
+    `pagination.parse_sort()`), limited to the `SORT_KEYS` of given model
+    and ending with its `UNIQUE_KEY`.
+    """
+    return parse_sort(request.values.get('sort'), model.SORT_KEYS,
+                      model.UNIQUE_KEY)
+
+
+def paginate_list(obj_list, model):
+    """
+    Applies the `sort`, `limit` and `after` request values to given objects
+    of given model (see `pagination`).  Queries are paginated by MongoDB,
+    other lists in memory.  Returns the page and the headers with the total
+    number of objects and the cursor of the next page (if any).
+
+    Without these values the objects are returned as is.
+    """
+    limit = request.values.get('limit', type=int)
+    cursor = request.values.get('after')
+    sort_value = request.values.get('sort')
+
+    if limit is not None and limit < 1:
+        raise ValueError('Bad limit {}'.format(limit))
+
+    if not (limit or cursor or sort_value):
+        return obj_list, {}
+
+    sort = parse_model_sort(model)
+    after = decode_cursor(cursor) if cursor else None
+    # one more to tell whether there's the next page
+    limit_plus_one = limit + 1 if limit else None
+
+    if isinstance(obj_list, ResultSet):
+        total = obj_list.count()
+        page = list(obj_list.sort(sort).after(after).limit(limit_plus_one))
+    else:
+        obj_list = list(obj_list)
+        total = len(obj_list)
+        page = paginate(obj_list, sort, limit_plus_one, after,
+                        get_document=lambda obj: obj._data)
+
+    headers = {
+        'X-Total-Count': str(total),
+        'Access-Control-Expose-Headers': 'X-Total-Count, X-Next-Cursor',
+    }
+    if limit and len(page) > limit:
+        page = page[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(
+            get_sort_values(page[-1]._data, sort))
+
+    return page, headers
+
+
+def parse_fields():
+    """
+    Returns the set of field names requested with ``fields=name,birth``
+    or `None` if all fields are requested.
+    """
+    value = request.values.get('fields')
+    if not value:
+        return None
+    return set(x.strip() for x in value.split(',') if x.strip())
+
+
+def parse_include(model):
+    """
+    Returns the names of the relationships (see `Entity.RELATIONS`) whose
+    objects are requested with ``include=people,place``.
+    """
+    value = request.values.get('include')
+    if not value:
+        return []
+    names = [x.strip() for x in value.split(',') if x.strip()]
+    for name in names:
+        if name not in model.RELATIONS:
+            raise ValueError('{.__name__} has no relation "{}"'
+                             .format(model, name))
+    return names
+
+
+def _filter_prefetch(model, names, keys):
+    """
+    Drops the relationships stored in the document keys which were not
+    fetched (i.e. not needed for the requested fields).
+    """
+    def _is_needed(name):
+        relation = model.RELATIONS[name.partition('.')[0]]
+        return not isinstance(relation, Ref) or relation.key in keys
+    return tuple(name for name in names if _is_needed(name))
+
+
 class GenericModelAdapter:
+    # relationships used by `prepare_obj()`, batch-loaded for the whole list
+    PREFETCH = ()
+
+    @classmethod
+    def get_prefetch(cls):
+        return cls.PREFETCH
+
     @classmethod
     def provide_list(cls, model):
         only_these_raw = request.values.get('ids', '')
         only_these_ids = [x for x in only_these_raw.split(',') if x]
         by_query = request.values.get('q')
+        by_prefix = request.values.get('prefix')
 
         if only_these_ids:
             return model.find({'id': {'$in': only_these_ids}})
         elif by_query:
-            xs = model.find()
-            # TODO: optimize: use class methods FooModel.find_matching()
-            # (i.e. they'd know which fields to search with $or)
-            return (p for p in xs if p.matches_query(by_query))
+            return model.find_matching(by_query)
+        elif by_prefix:
+            # type-ahead
+            return model.find_by_prefix(by_prefix)
         else:
             return model.find()
 
     @classmethod
-    def prepare_obj(cls, obj, protect=False):
-        return dict(obj.get_public_data(protect=protect), id=obj.id)
+    def get_document_keys(cls, model, fields):
+        """
+        Returns the document keys needed by `prepare_obj()` for given
+        fields (see `Entity.get_document_keys()`).
+        """
+        return model.get_document_keys(fields)
+
+    @classmethod
+    def prepare_obj(cls, obj, protect=False, fields=None):
+        return dict(obj.get_public_data(protect=protect, fields=fields),
+                    id=obj.id)
 
 
 class PlaceModelAdapter(GenericModelAdapter):
@@ -80,7 +293,8 @@ class PlaceModelAdapter(GenericModelAdapter):
     def provide_list(cls, model):
         assert model == cls.model
 
-        #return super().provide_list(model)
+        if request.values.get('q') or request.values.get('prefix'):
+            return super().provide_list(model)
 
         # TODO: do this only on special request
         return model.aggregate({}, Event)
@@ -88,6 +302,19 @@ class PlaceModelAdapter(GenericModelAdapter):
 class PersonModelAdapter(GenericModelAdapter):
     model = Person
 
+    # birth, death and age are derived from events
+    PREFETCH = 'events',
+
+    @classmethod
+    def get_prefetch(cls):
+        names = super().get_prefetch()
+
+        if request.values.get('with_related_people_ids'):
+            names += ('parent_families.father', 'parent_families.mother',
+                      'families.father', 'families.mother')
+
+        return names
+
     @classmethod
     def provide_list(cls, model):
         assert model == cls.model
@@ -95,21 +322,40 @@ class PersonModelAdapter(GenericModelAdapter):
         relatives_of_id = request.values.get('relatives_of')
         by_event_id = request.values.get('by_event')
         by_namegroup = request.values.get('by_namegroup')
+        by_phonetic = request.values.get('phonetic')
 
         if relatives_of_id:
             central_person = model.get(relatives_of_id)
+            generations = request.values.get('generations', type=int)
+            if generations:
+                # an hourglass chart plus partners and siblings
+                people = itertools.chain(
+                    central_person.related_people,
+                    central_person.find_hourglass(generations))
+                return list(OrderedDict((p.id, p) for p in people).values())
             return central_person.related_people
         elif by_event_id:
             return model.find_all_referencing(Event, by_event_id)
         elif by_namegroup:
             xs = super().provide_list(model)
             return (p for p in xs if p.group_name == by_namegroup)
+        elif by_phonetic:
+            # surnames which sound alike, e.g. "Kusnezow" for "Кузнецов"
+            return model.find_by_phonetic(by_phonetic)
         else:
             return super().provide_list(model)
 
     @classmethod
-    def prepare_obj(cls, obj, protect=False):
-        data = super().prepare_obj(obj, protect)
+    def get_document_keys(cls, model, fields):
+        keys = super().get_document_keys(model, fields)
+        if request.values.get('with_related_people_ids'):
+            # the fallback when there's no kinship graph
+            keys.update(['childof', 'parentin'])
+        return keys
+
+    @classmethod
+    def prepare_obj(cls, obj, protect=False, fields=None):
+        data = super().prepare_obj(obj, protect, fields)
 
         # FIXME pass request values explicitly
         with_related_people_ids = bool(request.values.get('with_related_people_ids'))
@@ -137,7 +383,8 @@ class EventModelAdapter(GenericModelAdapter):
         if place_id:
             return Event.find_all_referencing(Place, place_id)
         elif citation_ids:
-            citations = Citation.find({'id': {'$in': citation_ids}})
+            citations = (Citation.find({'id': {'$in': citation_ids}})
+                                 .prefetch('events'))
             events_by_citation = [c.events for c in citations]
             chained = itertools.chain(*events_by_citation)
             return set(chained)
@@ -170,12 +417,65 @@ class NameGroupModelAdapter(GenericModelAdapter):
         return model.find({'type': NameMap.TYPE_GROUP_AS})
 
     @classmethod
-    def prepare_obj(cls, obj, protect=False):
-        data = obj.get_public_data()
-        data.pop('type')
+    def prepare_obj(cls, obj, protect=False, fields=None):
+        data = obj.get_public_data(fields=fields)
+        data.pop('type', None)
         return data
 
 
+class UploadedFile:
+    """
+    The uploaded file as an iterable of byte strings, read from the request
+    stream as it is being received (rather than parsed by Werkzeug as a form
+    first).  Either the `file` field of a multipart form or the whole body.
+    The checksum is computed along the way.
+    """
+    # bytes read from the request at a time
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, request):
+        self.request = request
+        self.filename = None
+        self.checksum = hashlib.sha256()
+
+    def __iter__(self):
+        for chunk in self._read():
+            self.checksum.update(chunk)
+            yield chunk
+
+    def _read(self):
+        if self.request.mimetype != 'multipart/form-data':
+            yield from self._read_stream()
+            return
+
+        boundary = self.request.mimetype_params.get('boundary', '')
+        decoder = MultipartDecoder(boundary.encode('ascii'))
+        field_name = None
+        found = False
+
+        for chunk in itertools.chain(self._read_stream(), [None]):
+            decoder.receive_data(chunk)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, (Field, File)):
+                    field_name = event.name
+                    if field_name == 'file':
+                        if isinstance(event, File) and not event.filename:
+                            raise ValueError('no selected file')
+                        self.filename = getattr(event, 'filename', None)
+                        found = True
+                elif isinstance(event, Data) and field_name == 'file':
+                    yield event.data
+                event = decoder.next_event()
+
+        if not found:
+            raise ValueError('no file part')
+
+    def _read_stream(self):
+        stream = self.request.stream
+        return iter(functools.partial(stream.read, self.READ_SIZE), b'')
+
+
 class RESTfulService(Configurable):
     needs = {
         'mongo_db': Database,
@@ -197,6 +497,11 @@ class RESTfulService(Configurable):
             NameMap: ('namegroups', NameGroupModelAdapter),
         }
 
+        # for the related objects (see `_include_related()`)
+        self.slugs = dict((model, slug) for model, (slug, _) in mapping.items())
+        self.adapters = dict((model, adapter)
+                             for model, (_, adapter) in mapping.items())
+
         for model, settings in mapping.items():
             slug, adapter = settings
             url_list = '/{}/'.format(slug)
@@ -207,32 +512,127 @@ class RESTfulService(Configurable):
             handler_detail = functools.partial(self._detail, model, adapter,
                                                self.debug)
             handler_detail.__name__ = '{}_detail'.format(slug)
-            blueprint.route(url_list, methods=['GET'])(handler_list)
-            blueprint.route(url_detail, methods=['GET'])(handler_detail)
+            blueprint.route(url_list, methods=['GET'])(cached(handler_list))
+            blueprint.route(url_detail, methods=['GET'])(
+                cached(handler_detail))
 
-        blueprint.route('/person_name_groups', methods=['GET'])(self.person_name_group_list)
+        blueprint.route('/person_name_groups', methods=['GET'])(
+            cached(self.person_name_group_list))
+        blueprint.route('/cache', methods=['GET'])(self.cache_stats)
+        blueprint.route('/batch', methods=['POST'])(self.batch)
+        blueprint.route('/batch/bootstrap', methods=['GET'])(
+            self.batch_bootstrap)
 
         blueprint.route('/etl/gramps_xml', methods=['GET', 'POST'])(
             self.etl_gramps_xml)
+        blueprint.route('/etl/jobs/', methods=['GET'])(self.etl_job_list)
+        blueprint.route('/etl/jobs/<string:job_id>', methods=['GET'])(
+            self.etl_job_detail)
+
+        # imports run in the background, one at a time
+        self.import_jobs = JobQueue()
+
+        self.batch_executor = ThreadPoolExecutor(BATCH_WORKERS)
 
         return blueprint
 
     def _list(self, model, adapter, debug):
-        before = time()
+        """
+        Returns the list of objects as JSON.  Only the fields listed in the
+        `fields` request value are computed (and the document keys needed
+        for them fetched) if it's given, e.g. ``?fields=name,birth``.
 
-        obj_list = adapter.provide_list(model)
+        The objects related to the listed ones can be requested along with
+        them, e.g. ``/r/events/?include=people,place``.  The response is
+        then ``{"data": [...], "included": {"people": [...], ...}}``.
+        """
+        before = time()
 
+        fields = parse_fields()
+        prefetch = adapter.get_prefetch()
         protect = not debug
-        pure_data_items = [adapter.prepare_obj(obj, protect) for obj in obj_list]
-        resp = jsonify_with_cors(pure_data_items)
 
-        after = time()
-
-        print('Generated JSON for', model.__name__, 'list in', (after - before), 'sec')
-        print('JSON response for', model.__name__, 'is', len(resp.response[0]), 'bytes')
+        # slug → ID → data
+        included = OrderedDict()
+
+        def _prepare_batches():
+            count = 0
+            for batch in _iter_batches(obj_list, STREAM_BATCH_SIZE):
+                batch = prefetch_related(batch, *prefetch)
+                if include:
+                    self._include_related(model, batch, include, included,
+                                          protect)
+                yield [adapter.prepare_obj(obj, protect, fields)
+                       for obj in batch]
+                count += len(batch)
+
+                # the batch is already encoded; don't keep the instances
+                # until the end of the request
+                identity_map = g.get('identity_map')
+                if identity_map is not None:
+                    identity_map.clear()
+
+            after = time()
+            print('Streamed JSON for', count, model.__name__, 'items in',
+                  (after - before), 'sec')
+
+        def _get_included():
+            return dict((slug, list(items.values()))
+                        for slug, items in included.items())
 
+        try:
+            obj_list = adapter.provide_list(model)
+            include = parse_include(model)
+            for name in include:
+                if model.RELATIONS[name].model not in self.slugs:
+                    raise ValueError('Cannot include "{}"'.format(name))
+
+            if fields is not None:
+                keys = adapter.get_document_keys(model, fields)
+                prefetch = _filter_prefetch(model, prefetch, keys)
+                # the references to the included objects
+                keys.update(model.RELATIONS[name].key for name in include
+                            if isinstance(model.RELATIONS[name], Ref))
+                if isinstance(obj_list, ResultSet):
+                    # the cursor is made of the values of the sort keys
+                    sort = parse_model_sort(model)
+                    keys.update(key for key, _ in sort)
+                    obj_list = obj_list.only(keys)
+            obj_list, headers = paginate_list(obj_list, model)
+
+            # the query runs here, before the status is sent, so that its
+            # errors are reported with a proper status
+            batches = _start(_prepare_batches())
+        except ValueError as e:
+            resp = jsonify_with_cors({'error': str(e)})
+            resp.status_code = 400
+            return resp
+
+        resp = stream_json_with_cors(batches,
+                                     _get_included if include else None)
+        resp.headers.extend(headers)
         return resp
 
+    def _include_related(self, model, instances, names, included, protect):
+        """
+        Adds the objects related to given instances by given relationships
+        to `included` (by slug and ID).  Each relationship is loaded with
+        a single query for all instances.
+        """
+        for name in names:
+            relation = model.RELATIONS[name]
+            related_model = relation.model
+            adapter = self.adapters[related_model]
+            known = included.setdefault(self.slugs[related_model],
+                                        OrderedDict())
+
+            related = [obj for obj in relation.prefetch(instances)
+                       if obj.id not in known]
+            related = prefetch_related(related, *adapter.get_prefetch())
+            for obj in related:
+                if obj.id not in known:
+                    known[obj.id] = adapter.prepare_obj(obj, protect)
+
     def _detail(self, model, adapter, debug, id):
         before = time()
         try:
@@ -245,10 +645,8 @@ class RESTfulService(Configurable):
         print('Generated JSON for', model, 'detail in', (after - before), 'sec')
         return resp
 
-    @classmethod
-    @functools.lru_cache()
-    def person_name_group_list(cls):
-        "Runs once, caches the response (already in JSON)"
+    def person_name_group_list(self):
+        "Runs once per import, the response is cached (see `cached`)"
         before = time()
         seen_group_names = {}
         for p in Person.find():
@@ -264,6 +662,134 @@ class RESTfulService(Configurable):
         print('Generated JSON for surname_list in', (after - before), 'sec')
         return resp
 
+    def cache_stats(self):
+        """
+        Returns the size of the response cache and its hits and misses.
+        """
+        resp = jsonify_with_cors(response_cache.get_stats())
+        resp.cache_control.no_store = True
+        return resp
+
+    def batch(self):
+        """
+        Runs several requests to the list and detail endpoints at once::
+
+            POST /r/batch
+            {"requests": [
+                {"slug": "families"},
+                {"slug": "people", "params": {"ids": "I0001,I0002"}},
+                {"slug": "notes", "id": "N0001"}
+            ]}
+
+        The sub-requests share the database (and its version) of this
+        request and run concurrently.  Each of them is cached like a GET
+        request (see `response_cache`) and has its own status, even if it
+        fails.  The results are in the same order::
+
+            {"responses": [
+                {"status": 200, "headers": {...}, "body": [...]},
+                ...
+            ]}
+        """
+        data = request.get_json(silent=True) or {}
+        sub_requests = data.get('requests')
+        try:
+            if not isinstance(sub_requests, list):
+                raise ValueError('Expected {"requests": [...]}')
+            urls = [self._get_sub_request_url(x) for x in sub_requests]
+        except ValueError as e:
+            resp = jsonify_with_cors({'error': str(e)})
+            resp.status_code = 400
+            return resp
+
+        return self._run_batch(urls)
+
+    def batch_bootstrap(self):
+        """
+        Same as `batch()` with the `BOOTSTRAP_REQUESTS`: the data needed by
+        the app on the first page view, in one round trip.
+        """
+        return self._run_batch([self._get_sub_request_url(x)
+                                for x in BOOTSTRAP_REQUESTS])
+
+    def _get_sub_request_url(self, sub_request):
+        """
+        Returns the path and the query arguments for a sub-request of
+        `batch()`.
+        """
+        if not isinstance(sub_request, dict):
+            raise ValueError('Expected {"slug": ...}')
+
+        slug = sub_request.get('slug')
+        pk = sub_request.get('id')
+        params = sub_request.get('params') or {}
+
+        if not isinstance(params, dict):
+            raise ValueError('Expected "params" to be an object')
+
+        if slug == 'person_name_groups' and pk is None:
+            path = url_for('.person_name_group_list')
+        elif slug in self.slugs.values():
+            if pk is None:
+                path = url_for('.{}_list'.format(slug))
+            else:
+                path = url_for('.{}_detail'.format(slug), id=pk)
+        else:
+            raise ValueError('Unknown slug "{}"'.format(slug))
+
+        return path, params
+
+    def _run_batch(self, urls):
+        app = current_app._get_current_object()
+        shared = dict((key, g.get(key)) for key in BATCH_SHARED_STATE)
+
+        futures = [self.batch_executor.submit(self._run_sub_request, app,
+                                              shared, path, params)
+                   for path, params in urls]
+
+        parts = []
+        for future in futures:
+            status, headers, body = future.result()
+            parts.append('{{"status":{},"headers":{},"body":{}}}'.format(
+                status, json.dumps(headers), body))
+
+        resp = Response('{"responses":[' + ','.join(parts) + ']}\n',
+                        mimetype='application/json')
+        if ALLOW_ANY_HOST:
+            resp.headers.add('Access-Control-Allow-Origin', '*')
+        return resp
+
+    @staticmethod
+    def _run_sub_request(app, shared, path, params):
+        """
+        Dispatches a GET request to given path in a worker thread and returns
+        the status, the relevant headers and the body (as JSON).
+        """
+        with app.app_context():
+            # the current database, etc. (see `BATCH_SHARED_STATE`)
+            for key, value in shared.items():
+                setattr(g, key, value)
+            g.identity_map = IdentityMap()
+
+            with app.test_request_context(path, query_string=params):
+                view = app.view_functions[request.endpoint]
+                try:
+                    resp = app.make_response(view(**request.view_args))
+                    # streamed responses are generated here
+                    body = resp.get_data(as_text=True).strip()
+                except HTTPException as e:
+                    return e.code, {}, json.dumps({'error': e.description})
+                except Exception as e:
+                    traceback.print_exc()
+                    return 500, {}, json.dumps({
+                        'error': '{}: {}'.format(e.__class__.__name__, e)})
+
+                headers = dict((k, resp.headers[k]) for k in BATCH_HEADERS
+                               if k in resp.headers)
+                if not resp.is_json:
+                    body = json.dumps(body)
+                return resp.status_code, headers, body
+
     def etl_gramps_xml(self):
         """
         Usage::
@@ -271,42 +797,98 @@ class RESTfulService(Configurable):
           $ curl -F 'file=@data.gramps' http://localhost:5000/r/etl/gramps_xml
 
         (supposing that you have a file called `data.gramps` in current dir)
-        """
-        is_raw = request.args.get('raw', False)
+        or, without the multipart encoding::
 
-        if request.method == 'POST':
-            if 'file' not in request.files:
-                return jsonify_with_cors({'error': 'no file part',
-                                          'x':request.files})
-
-            file = request.files['file']
-
-            if not file.filename:
-                return jsonify_with_cors({'error': 'no selected file'})
+          $ curl --data-binary @data.gramps http://localhost:5000/r/etl/gramps_xml
 
-            filename = secure_filename(file.filename)
-            time_stamp =  datetime.datetime.now().strftime('%Y-%m-%d_%H%M')
-            filename_with_date = '{}-{}'.format(time_stamp, filename)
-            path = os.path.join('/tmp/', filename_with_date)
-            file.save(path)
+        The same file is not imported twice in a row.
 
-            output_generator = self.etl.import_gramps_xml(path, replace=True)
-            output = list(output_generator)
+        The file is imported in the background; the response contains the
+        job ID and the URL to poll for the job status.
+        """
+        is_raw = request.args.get('raw', False)
 
-            return jsonify_with_cors({
-                'status': 'success',
-                'output': output
+        if request.method == 'POST':
+            upload = UploadedFile(request)
+
+            # the document is checked while it is being received and
+            # imported from the file in the background, item by item (see
+            # `import_gramps_xml(stream=True)`)
+            with tempfile.NamedTemporaryFile(suffix='.gramps',
+                                             delete=False) as f:
+                path = f.name
+                try:
+                    spool_chunks(upload, f)
+                except (ValueError, etree.XMLSyntaxError) as e:
+                    os.remove(path)
+                    resp = jsonify_with_cors({'error': str(e)})
+                    resp.status_code = 400
+                    return resp
+                except BaseException:
+                    os.remove(path)
+                    raise
+
+            checksum = upload.checksum.hexdigest()
+            if checksum == self.etl.get_current_checksum(self.mongo_db.name):
+                os.remove(path)
+                return jsonify_with_cors({
+                    'status': 'unchanged',
+                    'output': ['The file has already been imported.'],
+                })
+
+            # the web app switches to the new database on its own
+            job = self.import_jobs.submit(
+                functools.partial(self._import_upload, path, checksum),
+                description='Import {}'.format(upload.filename or checksum))
+
+            resp = jsonify_with_cors({
+                'status': job.status,
+                'job': job.id,
+                'url': url_for('.etl_job_detail', job_id=job.id),
             })
+            resp.status_code = 202
+            return resp
 
-        exported = self.etl.export_gramps_xml()
+        exported = self.etl.iter_gramps_xml(db_name=self.mongo_db.name)
 
         if is_raw:
+            # chunked, the document is never kept in memory as a whole
             return Response(exported, mimetype='text/xml')
         return jsonify_with_cors({
             'format': 'xml',
-            'data': '\n'.join(exported)
+            'data': ''.join(exported)
         })
 
+    def _import_upload(self, path, checksum, progress):
+        """
+        Imports given uploaded file (see `etl_gramps_xml()`) and removes it.
+        """
+        try:
+            yield from self.etl.run_import(path, db_name=self.mongo_db.name,
+                                           progress=progress, stream=True,
+                                           checksum=checksum)
+        finally:
+            os.remove(path)
+
+    def etl_job_list(self):
+        resp = jsonify_with_cors([job.get_public_data()
+                                  for job in self.import_jobs.find()])
+        # the jobs change regardless of the data (see `conditional`)
+        resp.cache_control.no_store = True
+        return resp
+
+    def etl_job_detail(self, job_id):
+        """
+        Returns the status of an import job: the phase, the number of
+        processed items by collection, elapsed seconds, output and error.
+        """
+        job = self.import_jobs.get(job_id)
+        if not job:
+            abort(404)
+        resp = jsonify_with_cors(job.get_public_data())
+        resp.cache_control.no_store = True
+        return resp
+
 
 class RESTfulApp(Configurable):
     needs = {
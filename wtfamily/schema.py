@@ -44,6 +44,7 @@ COMMON_SCHEMA = {
     maybe-'handle': str,        # Gramps-specific internal ID
     maybe-'change': datetime.datetime,   # last changed timestamp
     maybe-'priv': False,        # is this a private record?
+    maybe-'search_tokens': [optional(str)],  # denormalized on import
 }
 COMMON_SCHEMA_WITH_ID = {
     'id': str,
@@ -254,6 +255,8 @@ PERSON_SCHEMA = {
 
     maybe-'childof': LIST_OF_IDS,   # families
     maybe-'parentin': LIST_OF_IDS,  # families
+    maybe-'parent_ids': [optional(str)], # people (denormalized from families)
+    maybe-'phonetic_codes': [optional(str)], # of surnames (denormalized)
 
     maybe-'url': LIST_OF_URLS,
     maybe-'address': [ ADDRESS_SCHEMA ],
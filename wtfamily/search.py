@@ -0,0 +1,76 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+"""
+Normalized search tokens for type-ahead.
+
+The words of the searchable texts (see `Entity.SEARCH_FIELDS`) are
+lower-cased, stripped of diacritics (so that "Łódź" is found by "lodz" and
+"Алёна" by "алена") and stored along with all their prefixes in a single
+array, which is covered by a multikey index::
+
+    >>> make_search_tokens(['Анна Łęcka'])
+    ['l', 'le', 'lec', 'leck', 'lecka', 'а', 'ан', 'анн', 'анна']
+
+A query matches a document if each of its (normalized) words is one of the
+document's tokens, i.e. a prefix of one of its words (see
+`Entity.find_by_prefix()`).  The tokens are computed on import.
+"""
+import re
+import unicodedata
+
+
+# letters without a decomposition into a base letter and a diacritic
+EXTRA_FOLDING = str.maketrans({
+    'ł': 'l',
+    'ø': 'o',
+    'đ': 'd',
+    'ß': 'ss',
+    'æ': 'ae',
+    'œ': 'oe',
+})
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """
+    Returns given text in lower case without diacritics.
+    """
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return unicodedata.normalize('NFC', stripped).translate(EXTRA_FOLDING)
+
+
+def split_words(text):
+    """
+    Returns the normalized words of given text.
+    """
+    return WORD_RE.findall(normalize(text))
+
+
+def make_search_tokens(texts):
+    """
+    Returns the sorted unique normalized words of given texts along with
+    all their prefixes.
+    """
+    tokens = set()
+    for text in texts:
+        for word in split_words(text):
+            tokens.update(word[:i] for i in range(1, len(word) + 1))
+    return sorted(tokens)
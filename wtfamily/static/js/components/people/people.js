@@ -5,6 +5,9 @@ define([
     'can/map/define',
     'can/view/mustache',
 ], function(Person) {
+    // people found while typing the name
+    var TYPEAHEAD_LIMIT = 50;
+
     var PersonViewModel = can.Map.extend({
         define: {
             selectedObject: {
@@ -21,11 +24,15 @@ define([
                         return $.when([]);
                     }
                     return Person.findAllSorted({
-                        q: query
+                        prefix: query,
+                        limit: TYPEAHEAD_LIMIT
                     });
                 },
             },
         },
+        typeahead: _.debounce(function(value) {
+            this.attr('filterQuery', value);
+        }, 200),
         selectObject: function(obj, elems, event) {
             this.attr('selectedObject', obj);
         },
@@ -7,6 +7,9 @@ define([
     'can/view/mustache',
     'can/route'
 ], function(Place, Event) {
+    // places found while typing the name
+    var TYPEAHEAD_LIMIT = 50;
+
     var PlaceViewModel = can.Map.extend({
         zoom: 13,
         selectedObject: null,
@@ -16,8 +19,12 @@ define([
             object_list: {
                 get: function() {
                     var query = this.attr('filterQuery');
+                    if (_.isEmpty(query)) {
+                        return Place.findAllSorted({});
+                    }
                     return Place.findAllSorted({
-                        q: query
+                        prefix: query,
+                        limit: TYPEAHEAD_LIMIT
                     });
                 },
             },
@@ -28,6 +35,9 @@ define([
                 }
             }
         },
+        typeahead: _.debounce(function(value) {
+            this.attr('filterQuery', value);
+        }, 200),
         selectObject: function(obj, elems, event) {
             this.attr('selectedObject', obj);
         },
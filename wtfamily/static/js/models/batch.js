@@ -0,0 +1,30 @@
+define([
+    'lodash'
+], function(_) {
+    // Several requests to the RESTful service in one round trip.
+    var Batch = {
+        // requests: [{slug: 'people', params: {ids: 'I0001'}}, ...]
+        // resolves to the list of response bodies in the same order
+        fetch: function(requests) {
+            return $.ajax({
+                url: '/r/batch',
+                method: 'POST',
+                contentType: 'application/json',
+                data: JSON.stringify({requests: requests})
+            }).then(function(response) {
+                return _.map(response.responses, 'body');
+            });
+        },
+        // the families and name groups needed on the first page view
+        bootstrap: function() {
+            return $.get('/r/batch/bootstrap').then(function(response) {
+                return {
+                    families: response.responses[0].body,
+                    nameGroups: response.responses[1].body
+                };
+            });
+        },
+    };
+
+    return Batch;
+});
@@ -7,12 +7,15 @@ define([
         findOne: 'GET /r/citations/{id}',
         findAll: 'GET /r/citations/',
         findWithRelated: function(params) {
-            return this.findAll(params).then(function(response) {
-                var sortedCitations = _.sortBy(response, 'date');
+            // the notes come along with the citations
+            var query = _.extend({}, params, {include: 'notes'});
+            return $.get('/r/citations/', query).then(function(response) {
+                var notesById = _.keyBy(response.included.notes, 'id');
+                var sortedCitations = _.sortBy(Citation.models(response.data), 'date');
                 return _.map(sortedCitations, function(citation) {
-                     var noteIds = _.join(citation.note_ids);
-                     if (noteIds) {
-                         citation.notes = Note.findAll({ids: noteIds});
+                     var notes = _.compact(_.at(notesById, citation.note_ids));
+                     if (!_.isEmpty(citation.note_ids)) {
+                         citation.notes = $.Deferred().resolve(Note.models(notes));
                      }
                      citation.events = Event.findWithRelated({proven_by: citation.id});
                      return citation
@@ -10,28 +10,28 @@ define([
         findAll: 'GET /r/events/',
         findOne: 'GET /r/events/{id}',
         findWithRelated: function(params) {
-            return this.findAll(params).then(function(events) {
-                var sortedEvents = _.sortBy(events, 'date');
-                return _.map(sortedEvents, function(event) {
-                    var placeQuery;
-                    var personQuery = Person.findAll({by_event: event.id});
+            // the people and places come along with the events
+            var query = _.extend({}, params, {include: 'people,place'});
+            return $.get('/r/events/', query).then(function(response) {
+                var peopleByEventId = {};
+                _.each(response.included.people, function(person) {
+                    _.each(person.event_ids, function(eventId) {
+                        peopleByEventId[eventId] = peopleByEventId[eventId] || [];
+                        peopleByEventId[eventId].push(person);
+                    });
+                });
+                var placesById = _.keyBy(response.included.places, 'id');
 
-                    event.people = new can.List(personQuery);
+                var sortedEvents = _.sortBy(Event.models(response.data), 'date');
+                return _.map(sortedEvents, function(event) {
+                    event.people = new can.List(
+                        Person.models(peopleByEventId[event.id] || []));
 
                     if (!_.isEmpty(event.place_id)) {
-                        placeQuery = Place.findOne({id: event.place_id});
-                        event.place = new can.List(placeQuery);
-                        //event.place = placeQuery;
-                        //event.place = placeQuery.promise();
-                        //event.place.done(function(x){console.log('GOT place', x)});
-                        //event.place = new can.Map(placeQuery);
-                        //placeQuery.done(function(place) {
-                        //    event.place = place;
-                        //});
+                        event.place = new can.List(
+                            Place.models(_.compact([placesById[event.place_id]])));
                     }
 
-                    console.log(event);
-
                     return event;
                 });
             });
@@ -6,11 +6,14 @@ define([
         findAll: 'GET /r/sources/',
         findOne: 'GET /r/sources/{id}',
         findWithNotes: function(params) {
-            return this.findAll(params).then(function(response) {
-                return _.map(response, function(obj) {
-                    var noteIds = _.join(obj.note_ids);
-                    if (noteIds) {
-                        obj.notes = Note.findAll({ids: noteIds});
+            // the notes come along with the sources
+            var query = _.extend({}, params, {include: 'notes'});
+            return $.get('/r/sources/', query).then(function(response) {
+                var notesById = _.keyBy(response.included.notes, 'id');
+                return _.map(Source.models(response.data), function(obj) {
+                    var notes = _.compact(_.at(notesById, obj.note_ids));
+                    if (!_.isEmpty(obj.note_ids)) {
+                        obj.notes = $.Deferred().resolve(Note.models(notes));
                     }
                     return obj
                 });
@@ -0,0 +1,91 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import pytest
+
+from models import Entity, IdentityMap
+
+
+class CountingDatabase:
+    """
+    A MongoDB database which records the collections queried by the models.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.name = db.name
+        self.queries = []
+
+    def __getitem__(self, name):
+        return CountingCollection(self, self.db[name])
+
+
+class CountingCollection:
+    def __init__(self, database, collection):
+        self._database = database
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def find(self, *args, **kwargs):
+        self._database.queries.append(self._collection.name)
+        return self._collection.find(*args, **kwargs)
+
+    def find_one(self, *args, **kwargs):
+        self._database.queries.append(self._collection.name)
+        return self._collection.find_one(*args, **kwargs)
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    """
+    An empty in-memory database used by the models.
+    """
+    mongomock = pytest.importorskip('mongomock')
+    database = CountingDatabase(mongomock.MongoClient()['test'])
+    monkeypatch.setattr(Entity, '_get_database', classmethod(
+        lambda cls: database))
+    return database
+
+
+@pytest.fixture
+def identity_map(monkeypatch):
+    identity_map = IdentityMap()
+    monkeypatch.setattr(Entity, '_get_identity_map', classmethod(
+        lambda cls: identity_map))
+    return identity_map
+
+
+@pytest.fixture
+def bulk_writes(monkeypatch):
+    """
+    Lets mongomock run the `UpdateOne` and `ReplaceOne` requests of
+    `bulk_write()`: pymongo passes them a `sort` which mongomock does not
+    know yet.
+    """
+    mongomock = pytest.importorskip('mongomock')
+    builder = mongomock.collection.BulkOperationBuilder
+
+    def _drop_sort(method):
+        def _wrapper(self, *args, sort=None, **kwargs):
+            return method(self, *args, **kwargs)
+        return _wrapper
+
+    for name in 'add_update', 'add_replace':
+        monkeypatch.setattr(builder, name,
+                            _drop_sort(getattr(builder, name)))
@@ -261,3 +261,38 @@ class TestMappingMultipleTagsToOneKey:
 
         # XML → data
         assert self._from_xml(xml) == data
+
+
+def test_namespaced_tags_and_subclasses():
+    class BaseTranslator(s.TagTranslator):
+        TAGS = {
+            'visitor': s.MaybeOne(s.TextTagTranslator),
+        }
+        CONTRIBUTORS = s.DateContributor,
+
+    class DerivedTranslator(BaseTranslator):
+        TAGS = {
+            'dish': s.OneOrMore(s.TextTagTranslator),
+        }
+
+    xml = trim('''
+    <cafe xmlns="http://example.com/">
+      <dish>spam</dish>
+      <visitor>Viking</visitor>
+      <dateval val="1970"/>
+      <datestr val="some time ago"/>
+      <dish>eggs</dish>
+    </cafe>
+    ''')
+    el = etree.fromstring(xml)
+
+    # the lookup tables are per class, not inherited
+    assert BaseTranslator().from_xml(el) == {
+        'visitor': 'Viking',
+        'date': {'modifier': 'textonly', 'value': 'some time ago'},
+    }
+    assert DerivedTranslator().from_xml(el) == {
+        'dish': ['spam', 'eggs'],
+        'date': {'modifier': 'textonly', 'value': 'some time ago'},
+    }
+    assert BaseTranslator.compile() is not DerivedTranslator.compile()
@@ -0,0 +1,100 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import datetime
+
+from flask import Flask, Response, request
+
+from conditional import get_build, make_etag, is_not_modified, set_validators
+
+
+app = Flask(__name__)
+
+MODIFIED = datetime.datetime(2018, 4, 14, 12, 0, 0, 123456)
+
+
+def test_make_etag():
+    with app.test_request_context('/r/people/?limit=10'):
+        etag = make_etag('wtfamily', 1, request)
+        assert etag == make_etag('wtfamily', 1, request)
+        assert etag != make_etag('wtfamily', 2, request)
+        assert etag != make_etag('wtfamily-20180414', 1, request)
+
+    with app.test_request_context('/r/people/?limit=20'):
+        assert etag != make_etag('wtfamily', 1, request)
+
+    # after a deploy
+    with app.test_request_context('/r/people/?limit=10'):
+        assert etag != make_etag('wtfamily', 1, request, build='abc')
+
+
+def test_get_build(tmpdir):
+    tmpdir.join('web.py').write('print(1)')
+    root = str(tmpdir)
+
+    version, built_at = get_build(root)
+    assert isinstance(built_at, datetime.datetime)
+
+    # bytecode is not a part of the build
+    tmpdir.mkdir('__pycache__').join('web.cpython-37.pyc').write('x')
+    get_build.cache_clear()
+    assert get_build(root)[0] == version
+
+    # computed once per process
+    tmpdir.mkdir('templates').join('base.html').write('<html>')
+    assert get_build(root)[0] == version
+    get_build.cache_clear()
+    assert get_build(root)[0] != version
+
+
+def test_is_not_modified_etag():
+    headers = {'If-None-Match': '"abc"'}
+    with app.test_request_context('/', headers=headers):
+        assert is_not_modified(request, 'abc')
+        assert not is_not_modified(request, 'def')
+
+    # If-Modified-Since is ignored along with If-None-Match
+    headers['If-Modified-Since'] = 'Sat, 14 Apr 2018 12:00:00 GMT'
+    with app.test_request_context('/', headers=headers):
+        assert not is_not_modified(request, 'def', MODIFIED)
+
+    with app.test_request_context('/', method='POST', headers=headers):
+        assert not is_not_modified(request, 'abc')
+
+
+def test_is_not_modified_date():
+    for date, expected in [('Sat, 14 Apr 2018 12:00:00 GMT', True),
+                           ('Sat, 14 Apr 2018 13:00:00 GMT', True),
+                           ('Sat, 14 Apr 2018 11:59:59 GMT', False)]:
+        headers = {'If-Modified-Since': date}
+        with app.test_request_context('/', headers=headers):
+            assert is_not_modified(request, 'abc', MODIFIED) == expected
+            assert not is_not_modified(request, 'abc')
+
+
+def test_set_validators():
+    resp = set_validators(Response('[]'), 'abc', MODIFIED)
+    assert resp.headers['ETag'] == '"abc"'
+    assert resp.headers['Last-Modified'] == 'Sat, 14 Apr 2018 12:00:00 GMT'
+
+    resp = Response('{}')
+    resp.cache_control.no_store = True
+    assert 'ETag' not in set_validators(resp, 'abc').headers
+
+    resp = Response('', status=404)
+    assert 'ETag' not in set_validators(resp, 'abc').headers
@@ -22,6 +22,10 @@ from lxml import etree
 import pytest
 import re
 
+from etl.gramps_xml_to_mongo import (extract,
+                                     extract_and_transform_iteratively, load,
+                                     transform)
+from etl.mongo_to_gramps_xml import build_xml, export_to_xml, get_declaration
 import etl.translators as s
 from etl.translators import generic
 
@@ -505,3 +509,68 @@ def test_extended_ref_tag_translator():
 
     # XML → data
     assert data == translator.from_xml(el, handle_to_id)
+
+
+ROUND_TRIP_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<database xmlns="http://gramps-project.org/xml/1.7.1/">
+  <events>
+    <event handle="_e1" change="1523700000" id="E0001">
+      <type>Birth</type>
+      <dateval val="1900-01-02"/>
+      <description>Рождение</description>
+    </event>
+  </events>
+  <people>
+    <person handle="_p1" change="1523700000" id="I0001">
+      <gender>M</gender>
+      <name type="Birth Name">
+        <first>Иван</first>
+        <surname>Петров</surname>
+      </name>
+      <eventref hlink="_e1" role="Primary"/>
+      <parentin hlink="_f1"/>
+    </person>
+    <person handle="_p2" change="1523700000" id="I0002">
+      <gender>F</gender>
+      <name type="Birth Name">
+        <first>Мария</first>
+        <surname>Петрова</surname>
+      </name>
+      <childof hlink="_f1"/>
+    </person>
+  </people>
+  <families>
+    <family handle="_f1" change="1523700000" id="F0001">
+      <rel type="Married"/>
+      <father hlink="_p1"/>
+      <childref hlink="_p2"/>
+    </family>
+  </families>
+  <namemaps>
+    <map type="group_as" key="Петрова" value="Петров"/>
+  </namemaps>
+</database>
+'''
+
+
+def test_streamed_export_matches_tree(tmpdir):
+    mongomock = pytest.importorskip('mongomock')
+
+    path = tmpdir.join('original.xml')
+    path.write_text(ROUND_TRIP_XML, encoding='utf-8')
+    db = mongomock.MongoClient()['test_export_xml']
+    load(extract_and_transform_iteratively(str(path)), db)
+
+    chunks = list(export_to_xml(db))
+    # the previous serializer, with the whole tree in memory
+    expected = get_declaration() + etree.tostring(
+        build_xml(db), encoding='unicode', pretty_print=True)
+
+    assert len(chunks) > 1
+    assert ''.join(chunks).encode('utf-8') == expected.encode('utf-8')
+
+    # and back
+    exported = tmpdir.join('exported.xml')
+    exported.write_text(''.join(chunks), encoding='utf-8')
+    assert [data for _, _, data in transform(extract(str(exported)))] == \
+        [data for _, _, data in transform(extract(str(path)))]
@@ -0,0 +1,61 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import pytest
+
+from models import Event, Family, Person, _make_projection
+
+
+def test_make_projection():
+    assert _make_projection(['id', 'name', 'name.first', 'eventref']) == {
+        'eventref': True,
+        'id': True,
+        'name': True,
+    }
+
+
+def test_get_document_keys():
+    assert Person.get_document_keys(['id', 'name', 'initials', 'age']) == \
+        {'id', 'priv', 'name', 'eventref'}
+    assert Family.get_document_keys([]) == {'id', 'priv'}
+
+    with pytest.raises(ValueError):
+        Person.get_document_keys(['name', 'password'])
+
+
+def test_pretty_data_fields():
+    family = Family({
+        'id': 'F0001',
+        'father': {'id': 'I0001'},
+        'childref': [{'id': 'I0002'}, {'id': 'I0003'}],
+    }, partial=True)
+    assert family.get_pretty_data(['child_ids']) == {
+        'child_ids': ['I0002', 'I0003'],
+    }
+    assert set(family.get_pretty_data()) == set(Family.PRETTY_FIELDS)
+
+    event = Event({
+        'id': 'E0001',
+        'type': 'Birth',
+        'place': [{'id': 'P0001'}, {'id': 'P0002'}],
+        'priv': True,
+    }, partial=True)
+    assert event.get_public_data(fields=['type', 'place_id']) == {
+        'type': '[private]',
+        'place_id': '[private]',
+    }
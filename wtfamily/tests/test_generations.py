@@ -0,0 +1,141 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import pytest
+
+from generations import (DatabaseGenerations, COLLECTION, POINTER_ID, LIVE,
+                         RETIRED, STAGING)
+
+mongomock = pytest.importorskip('mongomock')
+
+
+@pytest.fixture
+def client():
+    client = mongomock.MongoClient()
+    client['wtfamily']['people'].insert_one({'id': 'I0001'})
+    return client
+
+
+def _get_status(generations, name):
+    return generations.control.find_one({'_id': name})['status']
+
+
+def _create(generations):
+    db = generations.create()
+    db['people'].insert_one({'id': 'I0001'})
+    return db.name
+
+
+def test_first_switch(client):
+    generations = DatabaseGenerations(client, 'wtfamily')
+    assert generations.get_current_name() == 'wtfamily'
+    assert generations.find_current() is None
+
+    db = generations.create(checksum='abc')
+    assert db.name.startswith('wtfamily-')
+    assert _get_status(generations, db.name) == STAGING
+    # not switched yet
+    assert generations.get_current_name() == 'wtfamily'
+
+    generations.switch(db.name)
+    pointer = generations.get_pointer()
+    assert pointer['name'] == db.name
+    assert pointer['history'] == ['wtfamily']
+    assert generations.find_current()['checksum'] == 'abc'
+    assert _get_status(generations, db.name) == LIVE
+
+    # switching to the current one is a no-op
+    generations.switch(db.name)
+    assert generations.get_pointer()['history'] == ['wtfamily']
+
+
+def test_concurrent_switch(client, monkeypatch):
+    ours = DatabaseGenerations(client, 'wtfamily')
+    theirs = DatabaseGenerations(client, 'wtfamily')
+    first = _create(ours)
+    second = _create(theirs)
+
+    # they read the pointer before we switched
+    monkeypatch.setattr(theirs, 'get_current_name', lambda: 'wtfamily')
+    ours.switch(first)
+
+    with pytest.raises(RuntimeError):
+        theirs.switch(second)
+    assert ours.get_current_name() == first
+
+    # same when the pointer exists already
+    third = _create(ours)
+    ours.switch(third)
+    monkeypatch.setattr(theirs, 'get_current_name', lambda: first)
+    with pytest.raises(RuntimeError):
+        theirs.switch(second)
+    assert ours.get_pointer()['name'] == third
+    assert ours.get_pointer()['history'] == [first, 'wtfamily']
+
+
+def test_rollback(client):
+    generations = DatabaseGenerations(client, 'wtfamily')
+    first = _create(generations)
+    second = _create(generations)
+    generations.switch(first)
+    generations.switch(second)
+
+    assert generations.rollback() == first
+    assert generations.get_pointer()['history'] == ['wtfamily']
+    assert _get_status(generations, first) == LIVE
+    assert _get_status(generations, second) == RETIRED
+
+    assert generations.rollback() == 'wtfamily'
+    assert generations.get_pointer()['history'] == []
+
+    with pytest.raises(ValueError):
+        generations.rollback()
+
+
+def test_collect_garbage(client):
+    generations = DatabaseGenerations(client, 'wtfamily')
+    names = [_create(generations) for _ in range(3)]
+    for name in names:
+        generations.switch(name)
+    staging = _create(generations)
+
+    # the current one, one rollback, the staging one (and the configured
+    # database which holds the pointer)
+    dropped = generations.collect_garbage(keep=1)
+    assert sorted(dropped) == sorted(['wtfamily', names[0]])
+
+    assert generations.get_current_name() == names[2]
+    assert generations.get_pointer()['history'] == [names[1]]
+    assert generations.rollback() == names[1]
+
+    existing = client.list_database_names()
+    assert names[0] not in existing
+    assert names[1] in existing
+    assert names[2] in existing
+    assert staging in existing
+
+    # only the data of the configured database has been dropped
+    assert client['wtfamily'].list_collection_names() == [COLLECTION]
+    assert client['wtfamily'][COLLECTION].find_one({'_id': POINTER_ID})
+
+    # the one abandoned by the rollback goes; the staging one is only
+    # dropped when asked to
+    assert generations.collect_garbage(keep=1) == [names[2]]
+    assert generations.collect_garbage(include_staging=True) == [staging]
+    assert generations.get_current_name() == names[1]
+    assert names[1] in client.list_database_names()
@@ -0,0 +1,104 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import pytest
+
+from models import Entity, IdentityMap, Person
+
+
+def _person(pk, first):
+    return {
+        'id': pk,
+        'gender': 'M',
+        'name': [{'type': 'Birth Name', 'first': first,
+                  'surname': [{'text': 'Doe'}]}],
+    }
+
+
+@pytest.fixture
+def db(mongo_db):
+    mongo_db.db[Person.entity_name].insert_many([
+        _person('I1', 'John'),
+        _person('I2', 'Jack'),
+        _person('I3', 'Jim'),
+    ])
+    return mongo_db
+
+
+def test_add_returns_canonical_instance():
+    identity_map = IdentityMap()
+    first = Person(_person('I1', 'John'))
+    second = Person(_person('I1', 'John'))
+
+    assert identity_map.add(first) is first
+    assert identity_map.add(second) is first
+    assert identity_map.get(Person, 'I1') is first
+    assert identity_map.get(Person, 'I2') is None
+    assert len(identity_map) == 1
+
+    identity_map.clear()
+    assert len(identity_map) == 0
+
+
+def test_instances_are_reused(db, identity_map):
+    person = Person.get('I1')
+    assert Person.get('I1') is person
+    # the second lookup by ID is answered by the map
+    assert db.queries == ['people']
+
+    found = dict((x.id, x) for x in Person.find())
+    assert found['I1'] is person
+    assert len(identity_map) == 3
+
+    # all known: no query at all
+    del db.queries[:]
+    assert Person.find_by_pks(['I2', 'I1']) == [found['I2'], person]
+    assert Person.find_by_pks(['I3'])[0] is found['I3']
+    assert db.queries == []
+
+
+def test_find_by_pks_fetches_missing_only(db, identity_map):
+    known = Person.get('I2')
+    del db.queries[:]
+
+    found = Person.find_by_pks(['I1', 'I2', 'I1', 'I3', 'nope'])
+    assert [x.id for x in found] == ['I1', 'I2', 'I3']
+    assert found[1] is known
+    assert db.queries == ['people']
+
+
+def test_partial_instances_bypass_map(db, identity_map):
+    partial = list(Person.find().only(['id', 'name']))
+    assert len(partial) == 3
+    assert len(identity_map) == 0
+
+    person = Person.get('I1')
+    assert person is not partial[0]
+    assert 'gender' in person._data
+
+    # nor are they replaced by the full ones
+    again = list(Person.find({'id': 'I1'}).only(['id']))
+    assert again[0] is not person
+    assert 'gender' not in again[0]._data
+
+
+def test_no_identity_map(db, monkeypatch):
+    monkeypatch.setattr(Entity, '_get_identity_map', classmethod(
+        lambda cls: None))
+    assert Person.get('I1') is not Person.get('I1')
+    assert Person.get('I1') == Person.get('I1')
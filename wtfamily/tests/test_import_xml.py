@@ -0,0 +1,270 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import gzip
+import io
+
+from lxml import etree
+import pytest
+
+import etl.gramps_xml_to_mongo
+from etl.gramps_xml_to_mongo import (
+    extract, transform, extract_and_transform_iteratively,
+    spool_chunks, load, load_incrementally, StoredChanges,
+)
+from models import Entity, Person, Family, Event, NameMap, Bookmark
+
+
+GRAMPS_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE database PUBLIC "-//Gramps//DTD Gramps XML 1.7.1//EN"
+"http://gramps-project.org/xml/1.7.1/grampsxml.dtd">
+<database xmlns="http://gramps-project.org/xml/1.7.1/">
+  <header>
+    <created date="2018-04-14" version="4.2.8"/>
+  </header>
+  <events>
+    <event handle="_e1" change="1523700000" id="E0001">
+      <type>Birth</type>
+      <dateval val="1900-01-02"/>
+    </event>
+  </events>
+  <people>
+    <person handle="_p1" change="1523700000" id="I0001">
+      <gender>M</gender>
+      <name type="Birth Name">
+        <first>John</first>
+        <surname>Doe</surname>
+      </name>
+      <eventref hlink="_e1" role="Primary"/>
+      <parentin hlink="_f1"/>
+    </person>
+    <person handle="_p2" change="1523700000" id="I0002">
+      <gender>M</gender>
+      <name type="Birth Name">
+        <first>Jack</first>
+        <surname>Doe</surname>
+      </name>
+      <childof hlink="_f1"/>
+    </person>
+  </people>
+  <families>
+    <family handle="_f1" change="1523700000" id="F0001">
+      <rel type="Married"/>
+      <father hlink="_p1"/>
+      <childref hlink="_p2"/>
+    </family>
+  </families>
+</database>
+'''
+
+
+def _write_sample(tmpdir):
+    plain = tmpdir.join('sample.xml')
+    plain.write_text(GRAMPS_XML, encoding='utf-8')
+    compressed = tmpdir.join('sample.gramps')
+    compressed.write_binary(gzip.compress(GRAMPS_XML.encode('utf-8')))
+    return str(plain), str(compressed)
+
+
+def test_iterative_transform_matches_full_tree(tmpdir):
+    plain, compressed = _write_sample(tmpdir)
+
+    expected = [(model, data) for _, model, data
+                in transform(extract(plain))]
+    items = [(model, data) for _, model, data
+             in extract_and_transform_iteratively(compressed)]
+
+    # document order vs. model order
+    assert [m for m, _ in items] == [Event, Person, Person, Family]
+    assert sorted(items, key=lambda x: x[1]['id']) == \
+        sorted(expected, key=lambda x: x[1]['id'])
+
+    _, person = items[1]
+    assert person['eventref'] == [{'role': 'Primary', 'id': 'E0001'}]
+
+
+def test_transform_with_workers(tmpdir):
+    plain, compressed = _write_sample(tmpdir)
+
+    expected = [(model, data) for _, model, data
+                in transform(extract(plain))]
+    items = [(model, data) for _, model, data
+             in transform(extract(plain), workers=2)]
+    assert items == expected
+
+    items = [(model, data) for _, model, data
+             in extract_and_transform_iteratively(compressed, workers=2)]
+    assert [data['id'] for _, data in items] == \
+        ['E0001', 'I0001', 'I0002', 'F0001']
+
+
+def test_spool_chunks(tmpdir):
+    plain, compressed = _write_sample(tmpdir)
+
+    for path in plain, compressed:
+        with open(path, 'rb') as f:
+            data = f.read()
+        # the first chunks are too short to tell the format
+        chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+        spooled = io.BytesIO()
+        spool_chunks(chunks, spooled)
+        assert spooled.getvalue() == data
+
+    for chunks in [b'PK\x03\x04', b'...'], [], [GRAMPS_XML[:-20].encode()]:
+        with pytest.raises((ValueError, etree.XMLSyntaxError)):
+            spool_chunks(chunks, io.BytesIO())
+
+
+def test_load_in_batches(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient()['test_import_xml']
+
+    batches = []
+    write_batch = etl.gramps_xml_to_mongo._write_batch
+
+    def _write_batch(model, batch, db):
+        batches.append((model, len(batch)))
+        write_batch(model, batch, db)
+
+    validated = []
+    validate_data = Entity.validate_data.__func__
+
+    def _validate_data(cls, data):
+        validated.append(data['key'] if cls is NameMap else data['hlink'])
+        validate_data(cls, data)
+
+    monkeypatch.setattr(etl.gramps_xml_to_mongo, '_write_batch',
+                        _write_batch)
+    monkeypatch.setattr(NameMap, 'validate_data', classmethod(_validate_data))
+    monkeypatch.setattr(Bookmark, 'validate_data',
+                        classmethod(_validate_data))
+
+    keys = ['k{}'.format(i) for i in range(5)]
+    items = [(None, NameMap, {'type': 'group_as', 'key': key, 'value': 'v'})
+             for key in keys]
+    items.insert(1, (None, Bookmark, {'target': 'person', 'hlink': '_p1'}))
+
+    counts = load(items, db, batch_size=2)
+
+    assert counts == {NameMap: 5, Bookmark: 1}
+    # the last batches are partial
+    assert batches == [(NameMap, 2), (NameMap, 2), (NameMap, 1),
+                       (Bookmark, 1)]
+    assert validated == ['k0', '_p1', 'k1', 'k2', 'k3', 'k4']
+    assert sorted(x['key'] for x in db.namemaps.find()) == keys
+    assert db.bookmarks.count_documents({}) == 1
+
+
+# appended to `GRAMPS_XML`
+EXTRA_ITEMS = '''
+  <notes>
+    <note handle="_n1" change="1523700000" id="N0001" type="General">
+      <text>Some note</text>
+    </note>
+  </notes>
+  <namemaps>
+    <map type="group_as" key="Doe" value="Dough"/>
+    <map type="group_as" key="Roe" value="Rowe"/>
+  </namemaps>
+</database>
+'''
+
+
+def _import_incrementally(tmpdir, xml, db, delete_missing=False):
+    path = tmpdir.join('changed.xml')
+    path.write_text(xml, encoding='utf-8')
+    stored = StoredChanges(db)
+    items = extract_and_transform_iteratively(str(path),
+                                              skip=stored.is_unchanged)
+    load_incrementally(items, db, stored, delete_missing=delete_missing)
+
+
+@pytest.fixture
+def imported(tmpdir, bulk_writes):
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient()['test_import_xml']
+    xml = GRAMPS_XML.replace('</database>\n', EXTRA_ITEMS)
+    path = tmpdir.join('imported.xml')
+    path.write_text(xml, encoding='utf-8')
+    load(extract_and_transform_iteratively(str(path)), db)
+    return db, xml
+
+
+def _get_name_maps(db):
+    return sorted((x['key'], x['value']) for x in db.namemaps.find())
+
+
+@pytest.mark.parametrize('delete_missing', [False, True])
+def test_load_incrementally(tmpdir, imported, delete_missing):
+    db, xml = imported
+    event = db.events.find_one()
+
+    # changed
+    xml = xml.replace('_p2" change="1523700000', '_p2" change="1523700001')
+    xml = xml.replace('<first>Jack</first>', '<first>Jim</first>')
+    xml = xml.replace('value="Dough"', 'value="Doh"')
+    # new
+    xml = xml.replace('</people>', '''
+    <person handle="_p3" change="1523700000" id="I0003">
+      <gender>F</gender>
+      <name type="Birth Name">
+        <first>Jane</first>
+        <surname>Poe</surname>
+      </name>
+    </person>
+  </people>''')
+    xml = xml.replace('</namemaps>', '''
+    <map type="group_as" key="Poe" value="Po"/>
+  </namemaps>''')
+    # deleted
+    xml = xml.replace('''<map type="group_as" key="Roe" value="Rowe"/>''',
+                      '''''')
+    start = xml.index('<notes>')
+    end = xml.index('</notes>') + len('</notes>')
+    xml = xml[:start] + xml[end:]
+
+    _import_incrementally(tmpdir, xml, db, delete_missing)
+
+    # unchanged: not even rewritten
+    assert db.events.find_one() == event
+
+    people = dict((x['id'], x) for x in db.people.find())
+    assert people['I0002']['name'][0]['first'] == 'Jim'
+    assert people['I0003']['gender'] == 'F'
+
+    name_maps = [('Doe', 'Doh'), ('Poe', 'Po')]
+    assert sorted(people) == ['I0001', 'I0002', 'I0003']
+    if delete_missing:
+        assert db.notes.count_documents({}) == 0
+    else:
+        name_maps.append(('Roe', 'Rowe'))
+        assert db.notes.count_documents({}) == 1
+    assert _get_name_maps(db) == sorted(name_maps)
+
+
+def test_load_incrementally_unchanged(tmpdir, imported):
+    db, xml = imported
+    before = dict((name, list(db[name].find()))
+                  for name in db.list_collection_names())
+
+    # again and again
+    for _ in range(2):
+        _import_incrementally(tmpdir, xml, db, delete_missing=True)
+
+    assert dict((name, list(db[name].find()))
+                for name in db.list_collection_names()) == before
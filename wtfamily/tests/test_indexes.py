@@ -0,0 +1,64 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import pytest
+
+from indexes import get_index_specs, get_text_index, _get_plan_stages
+from models import Person, Place, Event, NameMap, Bookmark
+
+
+def test_index_specs():
+    assert get_index_specs(Event) == [
+        ('id', True),
+        ('citationref.id', False),
+        ('handle', False),
+        ('place.id', False),
+    ]
+    assert ('parent_ids', False) in get_index_specs(Person)
+    assert get_index_specs(NameMap) == [('type', False)]
+    assert get_index_specs(Bookmark) == []
+
+
+def test_text_index():
+    index = get_text_index(Place).document
+    assert index['key'] == {'pname.value': 'text'}
+    assert index['default_language'] == 'none'
+
+
+def test_find_matching():
+    assert Person.find_matching('ivan "petrov"').conditions == {
+        '$text': {'$search': '"ivan" "petrov"'},
+    }
+    assert Person.find_matching(' ').conditions is None
+
+    with pytest.raises(ValueError):
+        Event.find_matching('birth')
+
+
+def test_plan_stages():
+    plan = {
+        'stage': 'FETCH',
+        'inputStage': {
+            'stage': 'OR',
+            'inputStages': [
+                {'stage': 'IXSCAN', 'keyPattern': {'id': 1}},
+                {'stage': 'COLLSCAN', 'filter': {'place.id': {'$eq': 'P1'}}},
+            ],
+        },
+    }
+    assert _get_plan_stages(plan) == ['FETCH', 'OR', 'IXSCAN', 'COLLSCAN']
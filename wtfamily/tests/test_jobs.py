@@ -0,0 +1,93 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import threading
+import time
+
+from jobs import JobQueue, MAX_FINISHED_JOBS, QUEUED, RUNNING, DONE, FAILED
+
+
+def _wait(job, *statuses):
+    for _ in range(100):
+        if job.status in statuses:
+            return
+        time.sleep(0.01)
+    raise AssertionError('{} is still {}'.format(job, job.status))
+
+
+def test_job_lifecycle():
+    queue = JobQueue()
+    go = threading.Event()
+
+    def _import(progress):
+        progress.set_phase('loading')
+        yield 'Started'
+        go.wait()
+        yield 'Done'
+
+    first = queue.submit(_import, description='first')
+    _wait(first, RUNNING)
+    # one at a time
+    second = queue.submit(_import, description='second')
+    assert second.status == QUEUED
+    assert queue.find() == [second, first]
+    assert queue.get(first.id) is first
+
+    data = first.get_public_data()
+    assert data['description'] == 'first'
+    assert data['phase'] == 'loading'
+
+    go.set()
+    _wait(first, DONE)
+    _wait(second, DONE)
+    data = first.get_public_data()
+    assert data['output'] == ['Started', 'Done']
+    assert data['error'] is None
+    assert first.finished >= first.started >= first.created
+
+
+def test_failed_job():
+    queue = JobQueue()
+
+    def _import(progress):
+        yield 'Started'
+        raise RuntimeError('oops')
+
+    job = queue.submit(_import)
+    _wait(job, DONE, FAILED)
+    assert job.status == FAILED
+    assert job.output == ['Started']
+    assert job.error == 'RuntimeError: oops'
+
+    # the queue goes on
+    job = queue.submit(lambda progress: ['Started'])
+    _wait(job, DONE, FAILED)
+    assert job.status == DONE
+
+
+def test_finished_jobs_are_forgotten():
+    queue = JobQueue()
+    jobs = [queue.submit(lambda progress: [])
+            for _ in range(MAX_FINISHED_JOBS + 5)]
+    for job in jobs:
+        _wait(job, DONE)
+
+    queue.submit(lambda progress: [])
+    assert queue.get(jobs[0].id) is None
+    assert queue.get(jobs[-1].id) is jobs[-1]
+    assert len(queue.find()) == MAX_FINISHED_JOBS + 1
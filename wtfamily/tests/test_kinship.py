@@ -0,0 +1,126 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import pytest
+
+from kinship import KinshipGraph
+
+
+def _refs(*pks):
+    return [{'id': pk} for pk in pks]
+
+
+def _make_graph():
+    #    john + mary          bob + ann
+    #        |                   |
+    #     peter  +  kate        jane
+    #           |
+    #         alice (also a child of peter's second family with jane)
+    people = [
+        {'id': 'john', 'parentin': _refs('f1')},
+        {'id': 'mary', 'parentin': _refs('f1')},
+        {'id': 'bob', 'parentin': _refs('f2')},
+        {'id': 'ann', 'parentin': _refs('f2')},
+        {'id': 'peter', 'childof': _refs('f1'), 'parentin': _refs('f3', 'f4')},
+        {'id': 'kate', 'childof': _refs('f1'), 'parentin': _refs('f3')},
+        {'id': 'jane', 'childof': _refs('f2'), 'parentin': _refs('f4')},
+        {'id': 'alice', 'childof': _refs('f3', 'f4')},
+    ]
+    families = [
+        {'id': 'f1', 'father': {'id': 'john'}, 'mother': {'id': 'mary'},
+         'childref': _refs('peter', 'kate')},
+        {'id': 'f2', 'father': {'id': 'bob'}, 'mother': {'id': 'ann'},
+         'childref': _refs('jane')},
+        {'id': 'f3', 'father': {'id': 'peter'}, 'mother': {'id': 'kate'},
+         'childref': _refs('alice')},
+        {'id': 'f4', 'father': {'id': 'peter'}, 'mother': {'id': 'jane'},
+         'childref': _refs('alice')},
+    ]
+    return KinshipGraph(people, families)
+
+
+def test_immediate_relatives():
+    graph = _make_graph()
+
+    # mother goes first, just like in Person.get_parents()
+    assert graph.parents_of('peter') == ['mary', 'john']
+    assert graph.parents_of('alice') == ['kate', 'peter', 'jane']
+    assert graph.parents_of('john') == []
+    assert graph.children_of('john') == ['peter', 'kate']
+    assert graph.children_of('peter') == ['alice']
+    assert graph.partners_of('peter') == ['kate', 'jane']
+    assert graph.siblings_of('kate') == ['peter']
+    assert graph.related_to('peter') == ['mary', 'john', 'kate', 'jane',
+                                         'alice']
+
+
+def test_families():
+    graph = _make_graph()
+
+    assert graph.parent_families_of('alice') == ['f3', 'f4']
+    assert graph.families_of('peter') == ['f3', 'f4']
+    assert graph.family_parents('f4') == ('peter', 'jane')
+
+
+def test_pedigree_collapse_yields_each_ancestor_once():
+    graph = _make_graph()
+
+    ancestors = graph.ancestors_of('alice')
+    assert ancestors[0] == 'alice'
+    assert sorted(ancestors) == sorted(['alice', 'kate', 'peter', 'jane',
+                                        'john', 'mary', 'bob', 'ann'])
+
+    assert graph.descendants_of('mary') == ['mary', 'kate', 'alice', 'peter']
+
+
+def test_dangling_references_are_ignored():
+    people = [{'id': 'john', 'parentin': _refs('f1', 'missing')}]
+    families = [{'id': 'f1', 'father': {'id': 'john'},
+                 'mother': {'id': 'nobody'}, 'childref': _refs('ghost')}]
+    graph = KinshipGraph(people, families)
+
+    assert 'john' in graph
+    assert 'ghost' not in graph
+    assert graph.children_of('john') == []
+    assert graph.family_parents('f1') == ('john', None)
+
+
+def test_rebuilt_on_new_revision():
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient()['test_kinship']
+    db.people.insert_many([
+        {'id': 'john', 'parentin': _refs('f1')},
+        {'id': 'peter', 'childof': _refs('f1')},
+    ])
+    db.families.insert_one({'id': 'f1', 'father': {'id': 'john'},
+                            'childref': _refs('peter')})
+
+    graph = KinshipGraph.for_database(db, revision=1)
+    assert KinshipGraph.for_database(db, revision=1) is graph
+
+    # e.g. an incremental import into the same database
+    db.people.insert_one({'id': 'kate', 'childof': _refs('f1')})
+    db.families.update_one({'id': 'f1'},
+                           {'$push': {'childref': {'id': 'kate'}}})
+    assert 'kate' not in graph
+
+    graph = KinshipGraph.for_database(db, revision=2)
+    assert graph.siblings_of('kate') == ['peter']
+
+    KinshipGraph.invalidate(db)
+    assert KinshipGraph.for_database(db, revision=2) is not graph
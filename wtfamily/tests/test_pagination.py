@@ -0,0 +1,91 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import datetime
+
+import pytest
+
+from pagination import (parse_sort, encode_cursor, decode_cursor,
+                        get_sort_values, make_after_conditions, paginate)
+
+
+DOCUMENTS = [
+    {'id': 'I0001', 'gender': 'M', 'change': datetime.datetime(2018, 1, 1)},
+    {'id': 'I0002', 'gender': 'F'},
+    {'id': 'I0003', 'gender': 'M', 'change': datetime.datetime(2017, 1, 1)},
+    {'id': 'I0004', 'change': datetime.datetime(2018, 1, 1)},
+    {'id': 'I0005', 'gender': 'F', 'change': datetime.datetime(2016, 1, 1)},
+]
+
+
+def test_parse_sort():
+    assert parse_sort(None) == [('id', 1)]
+    assert parse_sort('-change, gender') == \
+        [('change', -1), ('gender', 1), ('id', 1)]
+    assert parse_sort('-id') == [('id', -1)]
+    with pytest.raises(ValueError):
+        parse_sort('$where')
+
+    allowed = ('id', 'change', 'gender')
+    assert parse_sort('-change', allowed) == [('change', -1), ('id', 1)]
+    with pytest.raises(ValueError):
+        parse_sort('name.surname', allowed)
+
+
+def test_cursor():
+    values = ['F', datetime.datetime(2018, 1, 1), None, 'I0001']
+    cursor = encode_cursor(values)
+    assert decode_cursor(cursor) == values
+    with pytest.raises(ValueError):
+        decode_cursor('not a cursor')
+
+
+def _walk(sort, limit):
+    pages = []
+    after = None
+    while True:
+        page = paginate(DOCUMENTS, sort, limit, after)
+        if not page:
+            return pages
+        pages.append([x['id'] for x in page])
+        after = get_sort_values(page[-1], sort)
+
+
+def test_paginate():
+    sort = parse_sort('gender')
+    assert _walk(sort, 2) == [['I0004', 'I0002'], ['I0005', 'I0001'],
+                              ['I0003']]
+
+    # missing values come last in descending order
+    sort = parse_sort('-change,-id')
+    assert _walk(sort, 3) == [['I0004', 'I0001', 'I0003'],
+                              ['I0005', 'I0002']]
+
+
+def test_after_conditions():
+    sort = parse_sort('-change')
+    change = datetime.datetime(2018, 1, 1)
+    assert make_after_conditions(sort, [change, 'I0001']) == {'$or': [
+        {'$or': [{'change': {'$lt': change}}, {'change': None}]},
+        {'change': change, 'id': {'$gt': 'I0001'}},
+    ]}
+    assert make_after_conditions(sort, [None, 'I0002']) == {'$or': [
+        {'change': None, 'id': {'$gt': 'I0002'}},
+    ]}
+    with pytest.raises(ValueError):
+        make_after_conditions(sort, ['I0002'])
@@ -0,0 +1,73 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import pytest
+
+from indexes import get_index_specs
+from models import Person
+from phonetic import transliterate, encode, make_phonetic_codes
+
+
+@pytest.mark.parametrize('word,codes', [
+    ('Auerbach', ['097400', '097500']),
+    ('Ohrbach', ['097400', '097500']),
+    ('Lipshitz', ['874400']),
+    ('Lippszyc', ['874400', '874500']),
+    ('Lewinsky', ['876450']),
+    ('Levinski', ['876450']),
+    ('Szlamawicz', ['486740']),
+    ('Shlamovitz', ['486740']),
+    ('Peters', ['734000', '739400']),
+    ("O'Brien", ['079600']),
+    ('', []),
+])
+def test_encode(word, codes):
+    assert encode(word) == codes
+
+
+def test_variants():
+    assert encode('Kusnezow') == encode('Kuznetsov') == encode('Кузнецов')
+    assert (encode('Czajkowski') == encode('Tchaikovsky')
+            == encode('Чайковский'))
+    assert encode('Szczerbakow') == encode('Щербаков')
+    assert encode('Müller') == encode('Muller')
+
+
+def test_transliterate():
+    assert transliterate('Щукин') == 'shchukin'
+    assert transliterate('Łukasz') == 'łukasz'
+
+
+def test_make_phonetic_codes():
+    assert make_phonetic_codes(['Müller-Schmidt', 'Mueller']) == [
+        '463000', '689000']
+    assert make_phonetic_codes(['?']) == []
+
+
+def test_surnames():
+    data = {
+        'name': [
+            {'first': 'Ivan', 'surname': [
+                {'text': 'Petrov', 'prim': True},
+                {'text': 'Ivanovich', 'derivation': 'Patronymic'},
+            ]},
+            {'first': 'John', 'surname': 'Peters'},
+        ],
+    }
+    assert Person.get_surnames(data) == ['Petrov', 'Ivanovich', 'Peters']
+    assert ('phonetic_codes', False) in get_index_specs(Person)
@@ -0,0 +1,114 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import pytest
+
+from models import Event, Family, Person, prefetch_related
+
+
+def _refs(*pks):
+    return [{'id': pk} for pk in pks]
+
+
+def _person(pk, **extra):
+    return dict({
+        'id': pk,
+        'gender': 'M',
+        'name': [{'type': 'Birth Name', 'first': pk,
+                  'surname': [{'text': 'Doe'}]}],
+    }, **extra)
+
+
+@pytest.fixture
+def db(mongo_db):
+    mongo_db.db[Person.entity_name].insert_many([
+        _person('I1', parentin=_refs('F1'), eventref=_refs('E1')),
+        _person('I2', parentin=_refs('F1'), eventref=_refs('E1', 'E2')),
+        _person('I3', childof=_refs('F1'), parentin=_refs('F2')),
+        _person('I4', childof=_refs('F1')),
+        _person('I5', childof=_refs('F2')),
+    ])
+    mongo_db.db[Family.entity_name].insert_many([
+        {'id': 'F1', 'father': {'id': 'I1'}, 'mother': {'id': 'I2'},
+         'childref': _refs('I3', 'I4')},
+        {'id': 'F2', 'father': {'id': 'I3'}, 'childref': _refs('I5')},
+    ])
+    mongo_db.db[Event.entity_name].insert_many([
+        {'id': 'E1', 'type': 'Marriage'},
+        {'id': 'E2', 'type': 'Birth'},
+        {'id': 'E3', 'type': 'Death'},
+    ])
+    return mongo_db
+
+
+def test_one_query_per_relationship(db, identity_map):
+    families = list(Family.find().prefetch('father', 'mother', 'children'))
+    assert db.queries == ['families', 'people', 'people', 'people']
+
+    del db.queries[:]
+    f1, f2 = sorted(families, key=lambda x: x.id)
+    assert (f1.father.id, f1.mother.id) == ('I1', 'I2')
+    assert [x.id for x in f1.children] == ['I3', 'I4']
+    assert (f2.father.id, f2.mother) == ('I3', None)
+    assert [x.id for x in f2.children] == ['I5']
+    assert db.queries == []
+
+    # shared with the identity map
+    assert f2.father is f1.children[0]
+
+
+def test_without_identity_map(db):
+    families = list(Family.find().prefetch('children'))
+    assert db.queries == ['families', 'people']
+
+    del db.queries[:]
+    assert sorted(x.id for f in families for x in f.children) == [
+        'I3', 'I4', 'I5']
+    assert db.queries == []
+
+
+def test_nested(db, identity_map):
+    families = list(Family.find({'id': 'F1'})
+                    .prefetch('father.events', 'mother.events'))
+    assert db.queries == ['families', 'people', 'events', 'people', 'events']
+
+    del db.queries[:]
+    assert [x.id for x in families[0].mother.events] == ['E1', 'E2']
+    assert db.queries == []
+
+
+def test_back_references(db, identity_map):
+    events = prefetch_related(Event.find(), 'people')
+    assert db.queries == ['events', 'people']
+
+    del db.queries[:]
+    people_by_event = dict((e.id, sorted(x.id for x in e.people))
+                           for e in events)
+    assert people_by_event == {'E1': ['I1', 'I2'], 'E2': ['I2'], 'E3': []}
+    assert db.queries == []
+
+
+def test_nothing_to_prefetch(db):
+    assert prefetch_related([], 'people') == []
+    assert list(Family.find({'id': 'nope'}).prefetch('children')) == []
+    assert db.queries == ['families']
+
+
+def test_unknown_relationship(db):
+    with pytest.raises(ValueError):
+        list(Family.find().prefetch('grandchildren'))
@@ -0,0 +1,177 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import threading
+import time
+
+from flask import Flask, Response, g, stream_with_context
+import pytest
+
+from response_cache import ResponseCache, cached, response_cache
+
+
+def test_lru():
+    cache = ResponseCache(max_size=2)
+    assert cache.get('a', lambda: 1) == 1
+    assert cache.get('b', lambda: 2) == 2
+    assert cache.get('a', lambda: 'x') == 1
+    cache.get('c', lambda: 3)
+    # "b" was the least recently used one
+    assert cache.get('b', lambda: 'y') == 'y'
+    assert cache.get('a', lambda: 'x') == 'x'
+    assert len(cache) == 2
+
+
+def test_ttl():
+    cache = ResponseCache(ttl=0.05)
+    cache.get('a', lambda: 1)
+    assert cache.get('a', lambda: 2) == 1
+    time.sleep(0.06)
+    assert cache.get('a', lambda: 2) == 2
+
+
+def test_not_cached():
+    cache = ResponseCache()
+    assert cache.get('a', lambda: None) is None
+    assert cache.get('a', lambda: 1) == 1
+
+    with pytest.raises(RuntimeError):
+        cache.get('b', _fail)
+    assert cache.get('b', lambda: 2) == 2
+    stats = cache.get_stats()
+    assert (stats['size'], stats['hits'], stats['misses']) == (2, 0, 4)
+
+
+def test_max_bytes():
+    cache = ResponseCache(max_bytes=10, max_entry_bytes=6, get_size=len)
+    cache.get('a', lambda: 'aaaa')
+    cache.get('b', lambda: 'bbbb')
+    assert cache.get_stats()['bytes'] == 8
+
+    # "a" is evicted to make room
+    cache.get('c', lambda: 'cccc')
+    assert cache.get('a', lambda: 'x') == 'x'
+    assert cache.get_stats()['bytes'] == 9
+
+    # too large to be cached at all
+    assert cache.get('d', lambda: 'ddddddd') == 'ddddddd'
+    assert cache.get('d', lambda: 'y') == 'y'
+    assert cache.get_stats()['bytes'] == 10
+
+    cache.clear()
+    assert cache.get_stats()['bytes'] == 0
+
+
+def test_single_flight():
+    cache = ResponseCache()
+    calls = []
+
+    def _compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.get('a', _compute))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['value'] * 5
+    assert len(calls) == 1
+    assert cache.get_stats()['misses'] == 1
+
+
+def _fail():
+    raise RuntimeError
+
+
+def _make_stream_app(calls):
+    app = Flask(__name__)
+
+    @app.route('/items/')
+    @cached
+    def items():
+        calls.append(1)
+        return Response(stream_with_context('[{}]'.format(i)
+                                            for i in range(3)))
+
+    @app.before_request
+    def _init():
+        g.db_version = 'test', 1
+
+    response_cache.clear()
+    return app
+
+
+def test_cached_stream(monkeypatch):
+    calls = []
+    client = _make_stream_app(calls).test_client()
+
+    # not buffered, but cached once sent
+    resp = client.get('/items/')
+    assert resp.is_streamed
+    assert resp.get_data() == b'[0][1][2]'
+    assert client.get('/items/').get_data() == b'[0][1][2]'
+    assert len(calls) == 1
+
+    # too large to be kept
+    monkeypatch.setattr(response_cache, 'max_entry_bytes', 5)
+    assert client.get('/items/?x=1').get_data() == b'[0][1][2]'
+    assert client.get('/items/?x=1').get_data() == b'[0][1][2]'
+    assert len(calls) == 3
+
+
+def test_wait_timeout():
+    cache = ResponseCache(wait_timeout=0.01)
+    assert cache.acquire('a') == (None, cache._pending['a'])
+    # the first caller takes too long
+    assert cache.acquire('a') == (None, None)
+
+
+def test_cached_stream_single_flight():
+    calls = []
+    client = _make_stream_app(calls).test_client()
+    results = []
+
+    def _get():
+        results.append(client.get('/items/').get_data())
+
+    first = client.get('/items/')
+    thread = threading.Thread(target=_get)
+    thread.start()
+
+    # waits for the first response to be sent
+    thread.join(0.1)
+    assert thread.is_alive()
+    assert first.get_data() == b'[0][1][2]'
+    thread.join()
+    assert results == [b'[0][1][2]']
+    assert len(calls) == 1
+
+
+def test_cached_stream_not_sent():
+    calls = []
+    client = _make_stream_app(calls).test_client()
+
+    # the waiting requests are not stuck if the response is never sent
+    client.get('/items/').close()
+    assert client.get('/items/').get_data() == b'[0][1][2]'
+    assert len(calls) == 2
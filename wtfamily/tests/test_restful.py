@@ -0,0 +1,355 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import hashlib
+import json
+import os
+import time
+
+from flask import Flask, g
+import pytest
+from pymongo.errors import OperationFailure
+
+import restful
+from models import IdentityMap, ResultSet
+from restful import PersonModelAdapter, RESTfulService
+from response_cache import response_cache
+
+
+def _refs(*pks):
+    return [{'id': pk} for pk in pks]
+
+
+def _person(pk, first, surname, gender='M', **extra):
+    return dict({
+        'id': pk,
+        'gender': gender,
+        'name': [{'type': 'Birth Name', 'first': first,
+                  'surname': [{'text': surname}]}],
+    }, **extra)
+
+
+@pytest.fixture
+def db():
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient()['test_restful']
+    db.people.insert_many([
+        _person('I1', 'Ivan', 'Petrov', parentin=_refs('F1')),
+        _person('I2', 'Maria', 'Petrova', 'F', parentin=_refs('F1')),
+        _person('I3', 'Pyotr', 'Petrov', childof=_refs('F1')),
+        _person('I4', 'Anna', 'Sidorova', 'F', childof=_refs('F1')),
+        _person('I5', 'Olga', 'Ivanova', 'F'),
+    ])
+    db.families.insert_one({'id': 'F1', 'father': {'id': 'I1'},
+                            'mother': {'id': 'I2'},
+                            'childref': _refs('I3', 'I4')})
+    return db
+
+
+class FakeETL:
+    """
+    Records the imports instead of running them (see `WTFamilyETL`).
+    """
+    def __init__(self):
+        self.imported = []
+        self.error = None
+
+    def get_current_checksum(self, db_name):
+        return None
+
+    def run_import(self, path, **options):
+        with open(path, 'rb') as f:
+            self.imported.append((path, f.read(), options))
+        if self.error:
+            raise self.error
+        yield 'Imported {}'.format(path)
+
+
+@pytest.fixture
+def etl():
+    return FakeETL()
+
+
+@pytest.fixture
+def client(db, etl):
+    service = RESTfulService({'mongo_db': db, 'etl': etl, 'debug': True})
+    app = Flask(__name__)
+    app.register_blueprint(service.make_blueprint(), url_prefix='/r')
+
+    @app.before_request
+    def _init():
+        # see `web.WTFamilyWebApp`
+        g.mongo_db = db
+        g.db_version = db.name, app.config.get('REVISION', 1)
+        g.identity_map = IdentityMap()
+
+    response_cache.clear()
+    return app.test_client()
+
+
+def test_search_unsearchable(client):
+    resp = client.get('/r/events/?q=birth')
+    assert resp.status_code == 400
+    assert 'error' in resp.json
+
+
+def test_prefix_unsearchable(client):
+    resp = client.get('/r/events/?prefix=bir')
+    assert resp.status_code == 400
+    assert 'error' in resp.json
+
+
+def _walk(client, query, slug='people', key='id'):
+    ids = []
+    cursor = None
+    while True:
+        url = '/r/{}/?{}'.format(slug, query)
+        if cursor:
+            url += '&after=' + cursor
+        resp = client.get(url)
+        assert resp.status_code == 200
+        ids.extend(x[key] for x in resp.json)
+        cursor = resp.headers.get('X-Next-Cursor')
+        if not cursor:
+            return ids
+
+
+def test_pagination(client):
+    assert _walk(client, 'limit=2') == ['I1', 'I2', 'I3', 'I4', 'I5']
+    assert _walk(client, 'limit=2&sort=-gender&fields=id') == [
+        'I1', 'I3', 'I2', 'I4', 'I5']
+
+
+def test_pagination_without_ids(client, db):
+    # name maps have no `id`; they are paginated by `_id`
+    keys = ['K{}'.format(i) for i in range(8)]
+    db.namemaps.insert_many([{'type': 'group_as', 'key': key, 'value': 'V'}
+                             for key in keys])
+
+    assert _walk(client, 'limit=3', 'namegroups', 'key') == keys
+    assert sorted(_walk(client, 'limit=3&sort=value', 'namegroups',
+                        'key')) == keys
+    assert _walk(client, 'limit=3&sort=-key&fields=key', 'namegroups',
+                 'key') == keys[::-1]
+
+
+@pytest.mark.parametrize('query', [
+    'limit=0',
+    'limit=-3',
+    # an array: the cursor cannot point into it
+    'sort=name.surname',
+    'sort=password',
+    'after=nonsense',
+])
+def test_bad_pagination(client, query):
+    resp = client.get('/r/people/?' + query)
+    assert resp.status_code == 400
+    assert 'error' in resp.json
+
+
+def test_name_groups_follow_data_version(client, db):
+    def _get_groups():
+        resp = client.get('/r/person_name_groups')
+        return dict((x['name'], x['person_ids']) for x in resp.json)
+
+    assert _get_groups()['Petrova'] == ['I2']
+
+    # an import
+    db.namemaps.insert_one({'type': 'group_as', 'key': 'Petrova',
+                            'value': 'Petrov'})
+    assert _get_groups()['Petrova'] == ['I2']
+    client.application.config['REVISION'] = 2
+    groups = _get_groups()
+    assert 'Petrova' not in groups
+    assert groups['Petrov'] == ['I1', 'I2', 'I3']
+
+
+def test_lists_are_cached_once_streamed(client):
+    before = response_cache.get_stats()
+    first = client.get('/r/people/?fields=name')
+    assert first.is_streamed
+    data = first.get_data()
+    assert client.get('/r/people/?fields=name').get_data() == data
+
+    stats = client.get('/r/cache').json
+    assert stats['size'] == 1
+    assert stats['bytes'] == len(data)
+    assert stats['hits'] - before['hits'] == 1
+    assert stats['misses'] - before['misses'] == 1
+
+
+def test_list_query_error(client, monkeypatch):
+    def _fail(self):
+        raise OperationFailure('text index required for $text query')
+        yield
+
+    monkeypatch.setattr(ResultSet, '_iter_instances', _fail)
+    resp = client.get('/r/people/')
+    assert resp.status_code == 500
+    assert not resp.get_data().startswith(b'[')
+
+
+def test_list_error_while_streaming(client, monkeypatch):
+    prepare_obj = PersonModelAdapter.prepare_obj
+
+    def _prepare_obj(obj, *args, **kwargs):
+        if obj.id == 'I3':
+            raise RuntimeError('oops')
+        return prepare_obj(obj, *args, **kwargs)
+
+    monkeypatch.setattr(restful, 'STREAM_BATCH_SIZE', 2)
+    monkeypatch.setattr(PersonModelAdapter, 'prepare_obj', _prepare_obj)
+    resp = client.get('/r/people/')
+    assert resp.status_code == 200
+
+    chunks = []
+    with pytest.raises(RuntimeError):
+        for chunk in resp.response:
+            chunks.append(chunk.decode('utf-8'))
+    # the client can't take it for a complete list
+    assert chunks[-1] == '\n{"error":"RuntimeError: oops"}\n'
+    with pytest.raises(ValueError):
+        json.loads(''.join(chunks))
+    assert response_cache.get_stats()['size'] == 0
+
+
+def test_batch(client):
+    resp = client.post('/r/batch', json={'requests': [
+        {'slug': 'families'},
+        {'slug': 'people', 'params': {'ids': 'I1,I2', 'fields': 'name'}},
+        {'slug': 'people', 'id': 'I5'},
+        {'slug': 'people', 'id': 'nobody'},
+        # fails within the view; the others are not affected
+        {'slug': 'people', 'params': {'relatives_of': 'nobody'}},
+        {'slug': 'people', 'params': {'limit': 2}},
+    ]})
+    assert resp.status_code == 200
+
+    families, people, person, missing, failed, page = resp.json['responses']
+    assert families['status'] == 200
+    assert [x['id'] for x in families['body']] == ['F1']
+    assert people['body'] == [{'id': 'I1', 'name': 'Ivan  Petrov'},
+                              {'id': 'I2', 'name': 'Maria  Petrova'}]
+    assert person['body']['id'] == 'I5'
+    assert missing['status'] == 404
+    assert failed['status'] == 500
+    assert 'error' in failed['body']
+    assert page['headers']['X-Total-Count'] == '5'
+    assert 'X-Next-Cursor' in page['headers']
+
+
+def test_batch_is_cached(client):
+    batch = {'requests': [{'slug': 'families'},
+                          {'slug': 'people', 'params': {'fields': 'name'}}]}
+    before = response_cache.get_stats()
+    first = client.post('/r/batch', json=batch).json
+    assert client.post('/r/batch', json=batch).json == first
+
+    stats = response_cache.get_stats()
+    assert stats['size'] == 2
+    assert stats['misses'] - before['misses'] == 2
+    assert stats['hits'] - before['hits'] == 2
+
+
+def test_concurrent_batch(client):
+    batch = {'requests': [
+        {'slug': 'people', 'params': {'x': i, 'include': 'families'}}
+        for i in range(12)]}
+    responses = client.post('/r/batch', json=batch).json['responses']
+    assert len(responses) == 12
+    for sub_response in responses:
+        assert sub_response['status'] == 200
+        body = sub_response['body']
+        assert len(body['data']) == 5
+        assert [x['id'] for x in body['included']['families']] == ['F1']
+
+
+@pytest.mark.parametrize('batch', [
+    None,
+    {'requests': 'families'},
+    {'requests': [{'slug': 'passwords'}]},
+    {'requests': [{'slug': 'people', 'params': 'ids=I1'}]},
+])
+def test_bad_batch(client, batch):
+    resp = client.post('/r/batch', json=batch)
+    assert resp.status_code == 400
+    assert 'error' in resp.json
+
+
+def test_batch_bootstrap(client):
+    resp = client.get('/r/batch/bootstrap')
+    assert resp.status_code == 200
+    families, name_groups = resp.json['responses']
+    assert [x['id'] for x in families['body']] == ['F1']
+    assert [x['name'] for x in name_groups['body']] == [
+        'Ivanova', 'Petrov', 'Petrova', 'Sidorova']
+
+
+def _wait_for_job(client, url):
+    for _ in range(100):
+        job = client.get(url).json
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError('The job is still {}'.format(job['status']))
+
+
+def test_upload(client, etl):
+    data = b'<?xml version="1.0"?>\n<database><people/></database>\n'
+    resp = client.post('/r/etl/gramps_xml', data=data)
+    assert resp.status_code == 202
+    assert _wait_for_job(client, resp.json['url'])['status'] == 'done'
+
+    # imported item by item from a file which is then removed
+    [(path, imported, options)] = etl.imported
+    assert imported == data
+    assert options['stream']
+    assert options['checksum'] == hashlib.sha256(data).hexdigest()
+    assert not os.path.exists(path)
+
+
+def test_bad_upload(client, etl):
+    resp = client.post('/r/etl/gramps_xml', data=b'<?xml version="1.0"?><a>')
+    assert resp.status_code == 400
+    assert 'error' in resp.json
+    assert etl.imported == []
+
+
+def test_import_jobs(client, etl):
+    data = b'<?xml version="1.0"?>\n<database/>\n'
+    url = client.post('/r/etl/gramps_xml', data=data).json['url']
+    job = _wait_for_job(client, url)
+    assert job['output'] == ['Imported {}'.format(etl.imported[0][0])]
+    assert job['error'] is None
+
+    etl.error = RuntimeError('oops')
+    resp = client.post('/r/etl/gramps_xml', data=data + b' ')
+    assert resp.json['status'] in ('queued', 'running')
+    job = _wait_for_job(client, resp.json['url'])
+    assert job['status'] == 'failed'
+    assert job['error'] == 'RuntimeError: oops'
+
+    resp = client.get('/r/etl/jobs/')
+    assert [x['status'] for x in resp.json] == ['failed', 'done']
+    assert resp.headers['Cache-Control'] == 'no-store'
+    resp = client.get(url)
+    assert resp.headers['Cache-Control'] == 'no-store'
+
+
+def test_unknown_import_job(client):
+    assert client.get('/r/etl/jobs/nonsense').status_code == 404
@@ -0,0 +1,57 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+from search import normalize, split_words, make_search_tokens
+from models import Person, Place
+
+
+def test_normalize():
+    assert normalize('Łódź') == 'lodz'
+    assert normalize('Алёна') == 'алена'
+    assert normalize('Straße') == 'strasse'
+    assert normalize('ŒUVRE') == 'oeuvre'
+
+
+def test_split_words():
+    assert split_words('  Jean-Pierre  de la Tour, ') == [
+        'jean', 'pierre', 'de', 'la', 'tour']
+    assert split_words('') == []
+
+
+def test_make_search_tokens():
+    assert make_search_tokens(['Анна Łęcka']) == [
+        'l', 'le', 'lec', 'leck', 'lecka', 'а', 'ан', 'анн', 'анна']
+    assert make_search_tokens(['Ann', 'Anna']) == ['a', 'an', 'ann', 'anna']
+    assert make_search_tokens([]) == []
+
+
+def test_search_texts():
+    data = {
+        'name': [
+            {'first': 'John', 'surname': [{'text': 'Smith', 'prim': True}]},
+            {'first': 'Jack', 'surname': 'Smyth', 'nick': 'Jay'},
+        ],
+    }
+    texts = Person.get_search_texts(data)
+    assert sorted(texts) == ['Jack', 'Jay', 'John', 'Smith', 'Smyth']
+
+    group_as = {'Smyth': 'Smith-Group'}
+    assert 'Smith-Group' in Person.get_search_texts(data, group_as=group_as)
+
+    place = {'pname': [{'value': 'Kyiv'}, {'value': 'Київ'}]}
+    assert Place.get_search_texts(place) == ['Kyiv', 'Київ']
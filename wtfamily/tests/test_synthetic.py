@@ -0,0 +1,76 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+from collections import Counter
+
+from etl.gramps_xml_to_mongo import extract, transform
+from etl.synthetic import write_gramps_xml
+from kinship import KinshipGraph
+from models import Person, Family, Event, Place, NameMap
+
+
+def _generate(tmpdir, people, seed=0):
+    path = tmpdir.join('synthetic-{}-{}.xml'.format(people, seed))
+    with open(str(path), 'wb') as f:
+        write_gramps_xml(f, people=people, seed=seed)
+    return str(path)
+
+
+def test_synthetic_file_is_valid(tmpdir):
+    path = _generate(tmpdir, 500)
+
+    items = list(transform(extract(path)))
+    for _, model, data in items:
+        model.validate_data(data)
+
+    counts = Counter(model for _, model, _ in items)
+    assert counts[Person] == 500
+    assert counts[Family] > 100
+    assert counts[Event] > counts[Person] + counts[Family]
+    assert counts[NameMap]
+
+    places = dict((data['id'], data) for _, model, data in items
+                  if model == Place)
+    cities = [x for x in places.values() if x['type'] == 'City']
+    region = places[cities[0]['placeref'][0]['id']]
+    country = places[region['placeref'][0]['id']]
+    assert country['type'] == 'Country'
+
+    # all references are resolved
+    people = [data for _, model, data in items if model == Person]
+    families = [data for _, model, data in items if model == Family]
+    graph = KinshipGraph(people, families)
+    for family in families:
+        assert family['father']['id'] in graph
+        assert family['mother']['id'] in graph
+
+    # some people marry their cousins
+    collapsed = [f for f in families
+                 if set(graph.ancestors_of(f['father']['id']))
+                 & set(graph.ancestors_of(f['mother']['id']))]
+    assert collapsed
+
+
+def test_synthetic_file_is_reproducible(tmpdir):
+    with open(_generate(tmpdir, 100)) as f:
+        first = f.read()
+    with open(_generate(tmpdir, 100, seed=1)) as f:
+        other = f.read()
+    with open(_generate(tmpdir.mkdir('again'), 100)) as f:
+        assert f.read() == first
+    assert other != first
@@ -0,0 +1,131 @@
+#    WTFamily is a genealogical software.
+#
+#    Copyright © 2014—2018  Andrey Mikhaylenko
+#
+#    This file is part of WTFamily.
+#
+#    WTFamily is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    WTFamily is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
+import pytest
+
+from etl.gramps_xml_to_mongo import denormalize_parent_ids
+from models import Person
+
+
+def _refs(*pks):
+    return [{'id': pk} for pk in pks]
+
+
+def _person(pk, **refs):
+    return dict({
+        'id': pk,
+        'gender': 'F',
+        'name': [{'type': 'Birth Name', 'first': pk,
+                  'surname': [{'text': ''}]}],
+    }, **refs)
+
+
+@pytest.fixture
+def people(mongo_db, bulk_writes):
+    # same as in test_kinship: peter and kate are siblings, so alice has
+    # john and mary as her grandparents twice
+    db = mongo_db.db
+    db.people.insert_many([
+        _person('john', parentin=_refs('f1')),
+        _person('mary', parentin=_refs('f1')),
+        _person('bob', parentin=_refs('f2')),
+        _person('ann', parentin=_refs('f2')),
+        _person('peter', childof=_refs('f1'), parentin=_refs('f3', 'f4')),
+        _person('kate', childof=_refs('f1'), parentin=_refs('f3')),
+        _person('jane', childof=_refs('f2'), parentin=_refs('f4')),
+        _person('alice', childof=_refs('f3', 'f4')),
+        _person('nobody'),
+    ])
+    db.families.insert_many([
+        {'id': 'f1', 'father': {'id': 'john'}, 'mother': {'id': 'mary'},
+         'childref': _refs('peter', 'kate')},
+        {'id': 'f2', 'father': {'id': 'bob'}, 'mother': {'id': 'ann'},
+         'childref': _refs('jane')},
+        {'id': 'f3', 'father': {'id': 'peter'}, 'mother': {'id': 'kate'},
+         'childref': _refs('alice')},
+        {'id': 'f4', 'father': {'id': 'peter'}, 'mother': {'id': 'jane'},
+         'childref': _refs('alice')},
+    ])
+    denormalize_parent_ids(db)
+    return dict((x['id'], x) for x in db.people.find())
+
+
+def test_denormalize_parent_ids(people):
+    parent_ids = dict((pk, x[Person.PARENT_IDS_KEY])
+                      for pk, x in people.items())
+    assert parent_ids == {
+        'john': [], 'mary': [], 'bob': [], 'ann': [], 'nobody': [],
+        # mother first, just like `Person.get_parents()`
+        'peter': ['mary', 'john'],
+        'kate': ['mary', 'john'],
+        'jane': ['ann', 'bob'],
+        'alice': ['kate', 'peter', 'jane'],
+    }
+
+
+def _trace(people, pk, direction, max_generations, denormalized):
+    data = dict(people[pk])
+    if not denormalized:
+        # as if imported before `parent_ids` were denormalized
+        del data[Person.PARENT_IDS_KEY]
+    trace = getattr(Person(data), 'trace_' + direction)
+    traced = [(generation, x.id) for generation, x in trace(max_generations)]
+    # the order within a generation is not defined
+    assert [g for g, _ in traced] == sorted(g for g, _ in traced)
+    return sorted(traced)
+
+
+@pytest.mark.parametrize('denormalized', [True, False])
+def test_trace_ancestors(people, denormalized):
+    def _trace_ancestors(pk, max_generations=None):
+        return _trace(people, pk, 'ancestors', max_generations, denormalized)
+
+    assert _trace_ancestors('alice') == [
+        (0, 'alice'),
+        (1, 'jane'), (1, 'kate'), (1, 'peter'),
+        # once each, though reached via both peter and kate
+        (2, 'ann'), (2, 'bob'), (2, 'john'), (2, 'mary'),
+    ]
+    assert _trace_ancestors('alice', 1) == [
+        (0, 'alice'), (1, 'jane'), (1, 'kate'), (1, 'peter')]
+    assert _trace_ancestors('alice', 0) == [(0, 'alice')]
+    assert _trace_ancestors('john') == [(0, 'john')]
+
+
+@pytest.mark.parametrize('denormalized', [True, False])
+def test_trace_descendants(people, denormalized):
+    def _trace_descendants(pk, max_generations=None):
+        return _trace(people, pk, 'descendants', max_generations,
+                      denormalized)
+
+    assert _trace_descendants('john') == [
+        (0, 'john'), (1, 'kate'), (1, 'peter'), (2, 'alice')]
+    assert _trace_descendants('john', 1) == [
+        (0, 'john'), (1, 'kate'), (1, 'peter')]
+    assert _trace_descendants('bob', 5) == [
+        (0, 'bob'), (1, 'jane'), (2, 'alice')]
+    assert _trace_descendants('nobody') == [(0, 'nobody')]
+
+
+def test_both_paths_agree(people):
+    for pk in people:
+        for direction in 'ancestors', 'descendants':
+            for max_generations in None, 1, 2:
+                assert (_trace(people, pk, direction, max_generations, True)
+                        == _trace(people, pk, direction, max_generations,
+                                  False))
@@ -18,18 +18,22 @@
 #    along with WTFamily.  If not, see <http://gnu.org/licenses/>.
 from collections import OrderedDict
 import json
-#import os
+import os
 
 import babel.dates
 from confu import Configurable
 from flask import (
-    Flask, abort, render_template, url_for, g, request,
+    Flask, Response, abort, render_template, url_for, g, request,
 )
 #from werkzeug import LocalProxy
 from pymongo.database import Database
 
+import conditional
 from etl import WTFamilyETL
+from generations import DatabaseGenerations
+from kinship import KinshipGraph
 from models import (
+    IdentityMap,
     Person,
     Event,
     Family,
@@ -38,9 +42,11 @@ from models import (
     Citation,
     NameMap,
     MediaObject,
+    prefetch_related,
 )
 from restful import RESTfulApp
 from restful import RESTfulService
+from response_cache import cached
 
 
 class WTFamilyWebApp(Configurable):
@@ -57,9 +63,65 @@ class WTFamilyWebApp(Configurable):
     def run(self, host=None, port=None):
         self.flask_app = Flask(__name__)
 
+        # the ETL imports into new databases and switches the pointer;
+        # requests are served from the old one until the new one is ready
+        generations = DatabaseGenerations(self.mongo_db.client,
+                                          self.mongo_db.name)
+
+        def _get_revision(db):
+            revision, _ = generations.get_version(db.name)
+            return revision
+
+        def _prepare(db):
+            KinshipGraph.for_database(db, _get_revision(db))
+
+        def _get_current_db():
+            return generations.get_current(
+                prepare=_prepare,
+                release=KinshipGraph.invalidate)
+
+        # build the kinship index now rather than on the first request
+        _get_current_db()
+
+        # a deploy changes the responses, too
+        build, built_at = conditional.get_build(
+            os.path.dirname(os.path.abspath(__file__)))
+
         @self.flask_app.before_request
         def _init():
-            g.mongo_db = self.mongo_db
+            g.mongo_db = _get_current_db()
+            revision = _get_revision(g.mongo_db)
+
+            # see `response_cache`; needed for any method as the
+            # sub-requests of a POST to /r/batch are cached, too
+            g.db_version = g.mongo_db.name, revision
+
+            # the responses only change on imports and deploys
+            if (request.method in conditional.CONDITIONAL_METHODS and
+                    request.endpoint != 'static'):
+                _, modified = generations.get_version(g.mongo_db.name)
+                g.last_modified = max(modified or built_at, built_at)
+                g.etag = conditional.make_etag(g.mongo_db.name, revision,
+                                               request, build)
+                if conditional.is_not_modified(request, g.etag,
+                                               g.last_modified):
+                    return Response(status=304)
+
+            g.identity_map = IdentityMap()
+            # rebuilt if the data has changed in place (incremental import)
+            g.kinship_graph = KinshipGraph.for_database(g.mongo_db, revision)
+
+        @self.flask_app.after_request
+        def _set_validators(response):
+            if 'etag' in g:
+                conditional.set_validators(response, g.etag, g.last_modified)
+            return response
+
+        @self.flask_app.teardown_request
+        def _teardown(exc):
+            identity_map = g.pop('identity_map', None)
+            if identity_map is not None:
+                identity_map.clear()
 
         self.flask_app.route('/')(home)
         self.flask_app.route('/event/')(event_list)
@@ -115,7 +177,7 @@ def home():
 
 #@app.route('/event/')
 def event_list():
-    object_list = Event.find()
+    object_list = Event.find().prefetch('place', 'people', 'citations')
     return render_template('event_list.html', object_list=object_list)
 
 
@@ -128,6 +190,7 @@ def event_detail(obj_id):
 
 
 #@app.route('/family/')
+@cached
 def family_list():
     def _sort_key(item):
         # This is a very naïve sorting method.
@@ -141,7 +204,9 @@ def family_list():
         if item.mother and item.mother.birth:
             return str(item.mother.birth.year)
         return ''
-    object_list = sorted(Family.find(), key=_sort_key)
+    families = Family.find().prefetch('father.events', 'mother.events',
+                                      'children', 'events')
+    object_list = sorted(families, key=_sort_key)
     return render_template('family_list.html', object_list=object_list)
 
 
@@ -155,7 +220,7 @@ def family_detail(obj_id):
 
 #@app.route('/person/')
 def person_list():
-    object_list = Person.find()
+    object_list = Person.find().prefetch('events')
     object_list = sorted(object_list, key=lambda x: x.name)
     return render_template('person_list.html', object_list=object_list)
 
@@ -198,7 +263,7 @@ def source_detail(obj_id):
 
 #@app.route('/citation/')
 def citation_list():
-    object_list = Citation.find()
+    object_list = Citation.find().prefetch('source')
     by_source = {}
     for citation in object_list:
         by_source.setdefault(citation.source, []).append(citation)
@@ -230,29 +295,36 @@ def media_detail(obj_id):
 
 
 #@app.route('/map/heat')
+@cached
 def map_heatmap():
-    events = Event.find()
+    events = Event.find().prefetch('place')
     return render_template('map_heatmap.html', events=events)
 
 
 #@app.route('/map/circles')
+@cached
 def map_circles():
-    places = [p for p in Place.find() if list(p.events)]
+    places = Place.find().prefetch('events.people')
+    places = [p for p in places if list(p.events)]
     return render_template('map_circles.html', places=places)
 
 
 #@app.route('/map/circles/integrated')
+@cached
 def map_circles_integrated():
-    places = [p for p in Place.find() if list(p.events)]
+    places = Place.find().prefetch('events')
+    places = [p for p in places if list(p.events)]
     return render_template('map_circles_integrated.html', places=places)
 
 
+@cached
 def map_places():
     places = [p for p in Place.find()]
     print('places gathered, rendering template...')
     return render_template('map_places.html', places=places)
 
 
+@cached
 def map_migrations(person_ids):
     person_ids = person_ids.split(',')
     people = list(Person.find_by_pks(person_ids))
@@ -279,14 +351,26 @@ def orgchart():
 
 #@app.route('/orgchart/data')
 def orgchart_data():
-    def _prep_row(person):
-        parent_families = list(person.get_parent_families())
-        if parent_families:
-            # XXX ideally we should link to all members of all families
-            parent = parent_families[0].father or parent_families[0].mother
-            parent_id = parent.id
+    graph = g.kinship_graph
+
+    def _get_parent_ids(person):
+        if person.id in graph:
+            parent_families = graph.parent_families_of(person.id)
+            if parent_families:
+                return graph.family_parents(parent_families[0])
         else:
-            parent_id = None
+            # not in the graph (yet), see `Person._get_kin_from_graph()`
+            parent_families = person.get_parent_families()
+            if parent_families:
+                family = parent_families[0]
+                return tuple(x.id if x else None
+                             for x in (family.father, family.mother))
+        return None, None
+
+    def _prep_row(person):
+        # XXX ideally we should link to all members of all families
+        father_id, mother_id = _get_parent_ids(person)
+        parent_id = father_id or mother_id
         # TODO use url_for
         name_format = '<a name="id{id}"></a><a href="/person/{id}">{name}</a><br><small>{birth}<br>{death}</small>{spouses}'
         tooltip_format = '{birth}'
@@ -301,11 +385,7 @@ def orgchart_data():
         birth_str = _compress_life_str(birth_str)
         death_str = _compress_life_str(death_str)
 
-        spouses = []
-        for f in person.get_families():
-            for x in (f.father, f.mother):
-                if x and x.id != person.id:
-                    spouses.append(x)
+        spouses = list(person.get_partners())
         if spouses:
             # TODO use url_for
             spouses_str = ', '.join(
@@ -328,7 +408,9 @@ def orgchart_data():
             parent_id,
             tooltip,
         ]
-    return json.dumps([_prep_row(p) for p in Person.find()])
+    # load everyone at once so that partners are found in the identity map
+    people = list(Person.find().prefetch('events'))
+    return json.dumps([_prep_row(p) for p in people])
 
 
 #@app.route('/familytreejs')
@@ -340,18 +422,29 @@ def familytreejs():
 
 #@app.route('/familytreejs.json')
 def familytreejs_json():
-    people = sorted(Person.find(), key=lambda p: p.group_name)
+    graph = g.kinship_graph
+    people = sorted(Person.find().prefetch('events'), key=lambda p: p.group_name)
     def _prepare_item(person):
         print(person.group_name, person.name)
         url = url_for('person_detail', obj_id=person.id)
 
+        if person.id in graph:
+            has_families = (graph.parent_families_of(person.id) or
+                            graph.families_of(person.id))
+            parent_ids = graph.parents_of(person.id)
+        else:
+            # not in the graph (yet), see `Person._get_kin_from_graph()`
+            has_families = (person.get_parent_families() or
+                            person.get_families())
+            parent_ids = [x.id for x in person.get_parents()]
+
         # XXX orphans should be handled on frontend
-        if not list(person.get_parent_families()) and not list(person.get_families()):
+        if not has_families:
             return
 
         data = {
             'name': person.name,
-            'parents': [p.id for p in person.get_parents()],
+            'parents': parent_ids,
             'blurb': '{}—{}'.format(person.birth or '?', person.death or '?'),
         }
 
@@ -368,36 +461,45 @@ def familytree_primitives():
 
 
 #@app.route('/familytree-bp/data')
+@cached
 def familytree_primitives_data():
+    graph = g.kinship_graph
     filter_surnames = set(x for x in request.values.get('surname', '').lower().split(',') if x)
 
     # only show given individual
     single_person = request.values.get('single_person')
-    if single_person:
-        people = [Person.get(single_person)]
-    else:
-        people = sorted(Person.find(), key=lambda p: p.group_name)
-
     relatives_of = request.values.get('relatives_of')
     if relatives_of:
         central_person = Person.get(relatives_of)
         people = central_person.related_people
+    elif single_person:
+        people = [Person.get(single_person)]
+    else:
+        # the whole list is only needed if no other filter is given
+        people = None
 
     # only find ancestors of given person
     ancestors, descendants = None, None
+    generations = request.values.get('generations', type=int)
     ancestors_of = request.values.get('ancestors_of')
     if ancestors_of:
         central_person = Person.get(ancestors_of)
-        ancestors = central_person.find_ancestors()
+        ancestors = central_person.find_ancestors(generations)
 
     descendants_of = request.values.get('descendants_of')
     if descendants_of:
         central_person = Person.get(descendants_of)
-        descendants = central_person.find_descendants()
+        descendants = central_person.find_descendants(generations)
 
     if ancestors_of or descendants_of:
         people = set(list(ancestors or [])) | set(list(descendants or []))
 
+    if people is None:
+        people = sorted(Person.find(), key=lambda p: p.group_name)
+
+    # birth and death are derived from events
+    people = prefetch_related(people, 'events')
+
     def _prepare_item(person):
         names_lowercase = (n.lower() for n in person.group_names)
         if filter_surnames:
@@ -412,11 +514,18 @@ def familytree_primitives_data():
             tmpl = '{born}'
         description = tmpl.format(born=person.birth.year_formatted or '?',
                                   dead=person.death.year_formatted or '?')
+        if person.id in graph:
+            parent_ids = graph.parents_of(person.id)
+            partner_ids = graph.partners_of(person.id)
+        else:
+            # not in the graph (yet), see `Person._get_kin_from_graph()`
+            parent_ids = [x.id for x in person.get_parents()]
+            partner_ids = [x.id for x in person.get_partners()]
         return {
             'id': person.id,
             'title': person.name,
-            'parents': [p.id for p in person.get_parents()],
-            'spouses': [p.id for p in person.get_partners()],
+            'parents': parent_ids,
+            'spouses': partner_ids,
             'description': description,
             'gender': person.gender,
         }